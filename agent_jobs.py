@@ -0,0 +1,230 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional
+
+import streamlit as st
+from langchain.callbacks.base import BaseCallbackHandler
+
+# agent runs hold an OpenAI request and a warehouse connection for their whole duration, so the
+# number running at once is capped process-wide, and each user runs one at a time
+MAX_CONCURRENT_RUNS = 4
+MAX_RUNS_PER_USER = 1
+AGENT_TIMEOUT_SECONDS = 300
+
+
+class AgentCancelled(Exception):
+    pass
+
+
+@dataclass
+class AgentStep:
+    kind: str  # "action", "observation" or "error"
+    tool: str = ""
+    text: str = ""
+
+
+class _JobCallbackHandler(BaseCallbackHandler):
+    """
+    Records the agent's steps on the job and stops the run once the job is cancelled
+    or past its deadline. raise_error makes LangChain propagate the exception instead of logging it.
+    """
+
+    raise_error = True
+
+    def __init__(self, job: "AgentJob"):
+        self.job = job
+
+    def _check(self):
+        self.job.raise_if_stopped()
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self._check()
+
+    def on_chat_model_start(self, serialized, messages, **kwargs):
+        self._check()
+
+    def on_agent_action(self, action, **kwargs):
+        self.job.steps.append(AgentStep("action", action.tool, str(action.tool_input)))
+        self._check()
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        self._check()
+
+    def on_tool_end(self, output, **kwargs):
+        self.job.steps.append(AgentStep("observation", text=str(output)))
+
+    def on_tool_error(self, error, **kwargs):
+        self.job.steps.append(AgentStep("error", text=str(error)))
+
+
+class AgentJob:
+    """
+    One agent run on the shared scheduler. `fn` receives the callbacks to attach to the run and
+    returns the answer. Steps are appended to `steps` as the agent takes them, and kept so a rerun
+    can redraw them; cancel() stops a running job at its next LLM or tool call, and its answer is
+    dropped if the call in flight still returns one.
+    """
+
+    def __init__(self, user_id: str, fn: Callable[[List[BaseCallbackHandler]], str],
+                 timeout: float = AGENT_TIMEOUT_SECONDS, **metadata: Any):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.fn = fn
+        self.timeout = timeout
+        self.metadata = metadata
+        self.steps: List[AgentStep] = []
+        self.submitted_at = time.monotonic()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        self.output: Optional[str] = None
+        self.error: Optional[str] = None
+        self.cancelled = False
+        self.timed_out = False
+        self._cancel = threading.Event()
+        self._done = threading.Event()
+
+    @property
+    def state(self) -> str:
+        if self._done.is_set():
+            return "done"
+        return "running" if self.started_at is not None else "queued"
+
+    def stopped(self) -> bool:
+        """
+        True once the job is cancelled or past its deadline. The run itself only notices at its next
+        LLM or tool call, so whoever waits on the job can give up on it right away.
+        """
+        if (not self._cancel.is_set() and self.started_at is not None
+                and time.monotonic() - self.started_at > self.timeout):
+            self.timed_out = True
+            self._cancel.set()
+        return self._cancel.is_set()
+
+    @property
+    def stop_reason(self) -> str:
+        return f"The run took longer than {self.timeout:.0f}s" if self.timed_out else "The run was cancelled"
+
+    def raise_if_stopped(self):
+        if self.stopped():
+            raise AgentCancelled(self.stop_reason)
+
+    def run(self):
+        self.started_at = time.monotonic()
+        try:
+            self.raise_if_stopped()
+            output = self.fn([_JobCallbackHandler(self)])
+            # stopped during the last call: the session has already told the user so
+            self.raise_if_stopped()
+            self.output = output
+        except AgentCancelled as e:
+            self.cancelled = True
+            self.error = str(e)
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+        finally:
+            self.finished_at = time.monotonic()
+            self._done.set()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def done(self) -> bool:
+        return self._done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        return self._done.wait(timeout)
+
+    def iter_steps(self, poll_interval: float = 0.2) -> Iterator[Optional[AgentStep]]:
+        """
+        Yield every step, the recorded ones first and then new ones as they arrive, until the job
+        finishes or is stopped. None is yielded after every `poll_interval` in between, so a
+        Streamlit caller can make an st call and let Stop or new input interrupt the wait.
+        """
+        i = 0
+        while True:
+            finished = self.done() or self.stopped()
+            while i < len(self.steps):
+                yield self.steps[i]
+                i += 1
+            if finished:
+                return
+            self.wait(poll_interval)
+            yield None
+
+
+class AgentScheduler:
+    """
+    A bounded pool for agent runs with a FIFO queue per user. Free workers take the next job
+    round-robin across users, so one user queueing many questions cannot hold back the others.
+    """
+
+    def __init__(self, max_workers: int = MAX_CONCURRENT_RUNS, max_per_user: int = MAX_RUNS_PER_USER):
+        self.max_workers = max_workers
+        self.max_per_user = max_per_user
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kai-agent")
+        self._lock = threading.Lock()
+        self._queues: "OrderedDict[str, Deque[AgentJob]]" = OrderedDict()
+        self._running: Dict[str, int] = {}
+
+    def submit(self, job: AgentJob) -> AgentJob:
+        with self._lock:
+            self._queues.setdefault(job.user_id, deque()).append(job)
+            self._dispatch()
+        return job
+
+    def cancel(self, job: AgentJob):
+        job.cancel()
+        with self._lock:
+            pending = self._queues.get(job.user_id)
+            if pending is not None and job in pending:
+                pending.remove(job)
+                if not pending:
+                    del self._queues[job.user_id]
+                # never started: run() sees the cancel flag and finishes without calling the agent
+                job.run()
+
+    def position(self, job: AgentJob) -> int:
+        """Upper bound on the jobs that start before this one (0 once it is running)."""
+        if job.state != "queued":
+            return 0
+        with self._lock:
+            own = list(self._queues.get(job.user_id, ()))
+            ahead = own.index(job) if job in own else 0
+            return ahead + sum(len(q) for user, q in self._queues.items() if user != job.user_id)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"running": sum(self._running.values()), "queued": sum(len(q) for q in self._queues.values())}
+
+    def _dispatch(self):
+        # caller holds the lock
+        while sum(self._running.values()) < self.max_workers:
+            user = next((u for u, q in self._queues.items() if q and self._running.get(u, 0) < self.max_per_user), None)
+            if user is None:
+                return
+            job = self._queues[user].popleft()
+            # rotate the user to the back so the next free worker serves someone else first
+            self._queues.move_to_end(user)
+            if not self._queues[user]:
+                del self._queues[user]
+            self._running[user] = self._running.get(user, 0) + 1
+            self._pool.submit(self._run, job)
+
+    def _run(self, job: AgentJob):
+        try:
+            job.run()
+        finally:
+            with self._lock:
+                self._running[job.user_id] -= 1
+                if not self._running[job.user_id]:
+                    del self._running[job.user_id]
+                self._dispatch()
+
+
+@st.cache_resource(show_spinner=False)
+def get_agent_scheduler() -> AgentScheduler:
+    return AgentScheduler()
@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import numpy as np
+
+SIMILARITY_THRESHOLD = 0.96
+MAX_ENTRIES = 1000
+TTL_SECONDS = 24 * 3600
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    answer: str
+    sql: List[str]
+    model: str
+    vector: np.ndarray = field(repr=False)
+    created_at: float = field(default_factory=time.time)
+    similarity: float = 1.0
+
+
+class SemanticAnswerCache:
+    """
+    Final answers of past agent runs, looked up by cosine similarity of the question embedding.
+    Entries are scoped by model, evicted LRU beyond `max_entries` and after `ttl` seconds.
+    One cache serves one database; clear it whenever that database's schema changes.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD, max_entries: int = MAX_ENTRIES,
+                 ttl: int = TTL_SECONDS):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[int, CachedAnswer]" = OrderedDict()
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector) -> np.ndarray:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in self._entries.items() if e.created_at < cutoff]:
+            del self._entries[key]
+
+    def lookup(self, vector, model: str) -> Optional[CachedAnswer]:
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire()
+            keys = [k for k, e in self._entries.items() if e.model == model]
+            if keys:
+                matrix = np.stack([self._entries[k].vector for k in keys])
+                scores = matrix @ query
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    self._entries.move_to_end(keys[best])
+                    self.hits += 1
+                    entry = self._entries[keys[best]]
+                    return CachedAnswer(entry.question, entry.answer, entry.sql, entry.model, entry.vector,
+                                        entry.created_at, float(scores[best]))
+            self.misses += 1
+            return None
+
+    def store(self, vector, question: str, answer: str, sql: List[str], model: str):
+        with self._lock:
+            self._entries[self._next_id] = CachedAnswer(question, answer, sql, model, self._normalize(vector))
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._entries)
@@ -2,25 +2,30 @@ import openai
 import re
 import streamlit as st
 import os
-import sqlalchemy
 import json
-import requests
+import time
 import pandas as pd
+import uuid
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
-from langchain.memory import StreamlitChatMessageHistory
-from langchain.memory import ConversationBufferMemory
-from langchain.memory.chat_message_histories import StreamlitChatMessageHistory
-from langchain.agents import create_sql_agent
-from langchain.agents.agent_toolkits import SQLDatabaseToolkit
-from langchain.sql_database import SQLDatabase
 from langchain.chat_models import ChatOpenAI
-from langchain.agents.agent_types import AgentType
-from langchain.callbacks import StreamlitCallbackHandler
 
 
 #from src.workspace_connection.workspace_connection import connect_to_snowflake
-from prompts import  custom_gen_sql
-from few_shot_examples import custom_tool_list
+from prompts import  custom_gen_sql, relevant_tables_prompt, conversation_history_prompt
+from few_shot_examples import custom_tool_list, vector_db
+from fast_path import FAST_PATH_TIMEOUT_SECONDS, match_few_shot, format_fast_path_answer
+from model_router import AUTO, FAST_MODEL, STRONG_MODEL, answer_with_escalation
+from embedding_cache import embed_question
+from local_engine import exported_tables
+from agent_jobs import AgentJob, get_agent_scheduler
+from chat_history import HOT_MESSAGES, SQLiteChatMessageHistory, get_chat_store
+from resources import configure_llm_cache, get_sql_resources, get_agent_executor, get_table_index, get_answer_cache, get_embeddings, get_query_guard, get_sql_validator, get_model_router, get_result_cache, get_local_engine, resource_build_count
+from result_store import format_bytes
+from token_memory import TokenBudgetMemory
+from telemetry import get_telemetry
+from tracing import TraceCallbackHandler, record_span
+from sql_execution import extract_sql_blocks, get_execution_engine, submit_statements, iter_completed, cancel_jobs
 
 
 image_path = os.path.dirname(os.path.abspath(__file__))
@@ -32,75 +37,241 @@ st.markdown(f"""# {home_title} <span style="color:#2E9BF5; font-size:16px;">Beta
 
 # Initialize the chat messages history
 openai.api_key = st.secrets.OPENAI_API_KEY
-msgs = StreamlitChatMessageHistory(key="chat_messages")
-memory = ConversationBufferMemory(chat_memory=msgs)
+configure_llm_cache(st.secrets.get("llm_cache_mode", "passthrough"))
+# identifies this session to the agent scheduler, which queues each user's questions separately,
+# and to the chat history store, which keeps only the newest messages in memory
+user_id = st.session_state.setdefault("user_id", uuid.uuid4().hex)
+msgs = SQLiteChatMessageHistory(user_id, get_chat_store())
 
 
 # Model selection for the chatbot
-model_selection = st.sidebar.selectbox("Choose a model", ['gpt-3.5-turbo-16k', 'gpt-4'], help="Select the model you want to use for the chatbot.")
-llm = ChatOpenAI(model=model_selection, temperature=0, streaming=True) if model_selection != 'default' else OpenAI(temperature=0, streaming=True)
+model_selection = st.sidebar.selectbox("Choose a model", [AUTO, FAST_MODEL, STRONG_MODEL], help="Select the model you want to use for the chatbot. Auto sends simple questions to the faster model and retries with the stronger one when needed.")
 
+# the chat history is written below, so the memory only reads it back within the model's token budget;
+# it is not attached to the agent, the history goes into the prompt once per question
+if "memory" not in st.session_state:
+    st.session_state["memory"] = TokenBudgetMemory(llm=ChatOpenAI(model='gpt-3.5-turbo-16k', temperature=0),
+                                                   chat_memory=msgs, save_to_history=False)
+memory = st.session_state["memory"]
+# in Auto mode a question may end up with either model, so budget for the smaller context
+memory.model = STRONG_MODEL if model_selection == AUTO else model_selection
+use_fast_path = st.sidebar.checkbox("Run known questions directly", value=True, help="Execute the stored SQL of a closely matching example question without calling the agent.")
+use_local_tables = st.sidebar.checkbox("Query exported tables locally", value=False, help="Let the agent answer from local copies of the tables exported to data/ when a query only reads those, without using the warehouse.")
 
 
-def initialize_connection():
-    account_identifier = st.secrets["account_identifier"]
-    user = st.secrets["user"]
-    password = st.secrets["password"]
-    database_name = st.secrets["database_name"]
-    schema_name = st.secrets["schema_name"]
-    warehouse_name = st.secrets["warehouse_name"]
-    role_name = st.secrets["user"]
-    conn_string = f"snowflake://{user}:{password}@{account_identifier}/{database_name}/{schema_name}?warehouse={warehouse_name}&role={role_name}"
-    db = SQLDatabase.from_uri(conn_string)
-    toolkit = SQLDatabaseToolkit(llm=llm, db=db)
-    agent_executor = create_sql_agent(
-        llm=llm,
-        toolkit=toolkit,
-        verbose=True,
-        handle_parsing_errors=True,
-        max_iterations=50,
-        extra_tools=custom_tool_list,
-        agent_type=AgentType.OPENAI_FUNCTIONS,
-        memory=memory,
-        return_intermediate_steps=True
-    )
-    return agent_executor, conn_string
+def initialize_connection(model):
+    # engine, SQLDatabase and toolkit are shared process-wide; only the executor is built per session
+    resources = get_sql_resources(model)
+    local = get_local_engine(resources.conn_string) if use_local_tables else None
+    agent_executor = get_agent_executor(resources, extra_tools=custom_tool_list, local=local)
+    return agent_executor, resources.conn_string, resources
 
 
 
-agent_executor, conn_string = initialize_connection()   
+agent_executor, conn_string, resources = initialize_connection(FAST_MODEL if model_selection == AUTO else model_selection)
+router = get_model_router()
+if model_selection == AUTO:
+    st.sidebar.caption(f"Auto routing: questions scoring up to {router.threshold:.2f} go to {router.fast_model}")
+answer_cache = get_answer_cache(conn_string)
+st.sidebar.caption(f"Agent resource builds since start: {resource_build_count()}")
+st.sidebar.caption(f"Answer cache: {len(answer_cache)} answers, {answer_cache.hit_rate:.0%} hit rate")
+sql_validator = get_sql_validator(conn_string)
+st.sidebar.caption(f"SQL pre-validation: {sql_validator.saved_calls} of {sql_validator.checked} agent queries "
+                   f"fixed or rejected without a warehouse call")
+result_cache = get_result_cache(conn_string)
+st.sidebar.caption(f"Query result cache: {len(result_cache)} results, {result_cache.hit_rate:.0%} hit rate")
+if use_local_tables:
+    local_engine = get_local_engine(conn_string)
+    exported = exported_tables()
+    loaded = local_engine.tables()
+    selected = st.sidebar.multiselect("Local tables", list(exported), default=[name for name in exported if name.lower() in loaded],
+                                      help="Exported tables to load into the local engine.")
+    for name in selected:
+        table = loaded.get(name.lower())
+        if table is None or table.source_mtime != os.path.getmtime(exported[name]):
+            with st.spinner(f"Loading {name}..."):
+                local_engine.load(exported[name], name, loaded=loaded)
+    for name in loaded.keys() - {name.lower() for name in selected}:
+        local_engine.unload(loaded[name].name)
+    st.sidebar.caption(f"Local engine: {local_engine.local_queries} of "
+                       f"{local_engine.local_queries + local_engine.warehouse_queries} agent queries answered locally")
+scheduler = get_agent_scheduler()
+scheduler_stats = scheduler.stats()
+st.sidebar.caption(f"Agent runs: {scheduler_stats['running']} running, {scheduler_stats['queued']} queued")
 
 
-# Create a dictionary to store feedback counts
-feedback_counts = {"thumbs_up": 0, "thumbs_down": 0}
+# conversation and feedback events are queued here and sent to st.secrets["url"] in the background
+telemetry = get_telemetry()
+st.sidebar.caption(f"Telemetry: {telemetry.sent} events sent, {telemetry.spooled} spooled, "
+                   f"{telemetry.mean_emit_us:.0f} µs per event in the app")
+
+
+def last_exchange():
+    """(last question, last answer) of the conversation."""
+    messages = msgs.messages
+    question = next((m.content for m in reversed(messages) if m.type == "human"), None)
+    return question, messages[-1].content if messages else None
+
 
 # Function to handle user feedback
 def handle_feedback(feedback_type):
-    feedback_counts[feedback_type] += 1
+    question, answer = last_exchange()
+    telemetry.emit("feedback", session=user_id, question=question, answer=answer,
+                   feedback="positive" if feedback_type == "thumbs_up" else "negative")
+    # the router learns which questions the fast model gets wrong
+    if st.session_state.get("last_decision_id") is not None:
+        router.record_feedback(st.session_state["last_decision_id"], feedback_type == "thumbs_up")
+
+
+def run_agent(agent_executor, prompt_formatted, trace, callbacks) -> dict:
+    # runs on the scheduler's worker thread: no st.* calls in here
+    try:
+        # the executor returns intermediate steps too, so call it rather than .run()
+        return agent_executor({"input": prompt_formatted}, callbacks=callbacks + [trace])
+    except ValueError as e:
+        response = str(e)
+        if not response.startswith("Could not parse LLM output: `"):
+            raise e
+        return {"output": response.removeprefix("Could not parse LLM output: `").removesuffix("`")}
+
+
+def follow_agent_job(job: AgentJob) -> str:
+    """Draw the job's steps as they stream in, then write and return the answer once it finishes."""
+    with st.chat_message("Kai"):
+        status = st.status("Thinking...", expanded=True)
+        # the answer is given up on at once; a model or SQL call in flight finishes in the background
+        st.button("Stop", key=f"stop_{job.id}", on_click=scheduler.cancel, args=(job,),
+                  help="Stops waiting for the agent. A model or SQL call already running still completes in the background.")
+        while job.state == "queued":
+            status.update(label=f"Waiting for a free agent ({scheduler.position(job) + 1} in line)...")
+            job.wait(0.5)
+        status.update(label="Thinking...")
+        for step in job.iter_steps():
+            if step is None:
+                # an st call on every tick, so Stop and new input interrupt the wait even mid LLM call
+                status.update(label=f"Thinking... ({time.monotonic() - job.started_at:.0f}s)")
+            elif step.kind == "action":
+                status.markdown(f"**{step.tool}**: `{step.text[:500]}`")
+            else:
+                status.text(step.text[:1000])
+        if job.output is not None:
+            label = f"Done in {job.finished_at - job.started_at:.1f}s"
+            decision = job.metadata.get("decision")
+            if decision is not None:
+                label += f" by {decision.final_model}" + (" (retried with the stronger model)" if decision.escalated else "")
+            status.update(label=label, state="complete", expanded=False)
+            response = job.output
+        else:
+            # a stopped run may still be finishing its last call in the background; its answer is dropped
+            status.update(label="Stopped" if job.stopped() else "Failed", state="error", expanded=False)
+            if job.timed_out:
+                response = f"I stopped working on this question: {job.stop_reason}. Please try a more specific question."
+            elif job.stopped():
+                response = "Stopped."
+            else:
+                response = f"Sorry, something went wrong while answering: {job.error}"
+        st.write(response)
+    return response
 
 
 ai_intro = "Hello, I'm Kai, your AI SQL Bot. I'm here to assist you with SQL queries. What can I do for you?"
 
 if len(msgs.messages) == 0:
     msgs.add_ai_message(ai_intro)
-for msg in msgs.messages:
+# older messages stay on disk until the user asks for them
+hot_offset = msgs.offset
+shown_from = max(0, hot_offset - st.session_state.get("history_shown", 0))
+if shown_from > 0 and st.button("Show earlier messages"):
+    st.session_state["history_shown"] = st.session_state.get("history_shown", 0) + HOT_MESSAGES
+    shown_from = max(0, hot_offset - st.session_state["history_shown"])
+for msg in msgs.slice(shown_from, hot_offset) + msgs.messages:
     st.chat_message(msg.type).write(msg.content)
 if prompt := st.chat_input():
+    prompt_started = time.perf_counter()
+    telemetry.emit("question", session=user_id, question=prompt, model=model_selection)
+    history = memory.load_memory_variables({})[memory.memory_key]
+    # a follow-up depends on the conversation before it, which the answer cache doesn't key on
+    follow_up = msgs.offset > 0 or any(m.type == "human" for m in msgs.messages)
     msgs.add_user_message(prompt)
     st.chat_message("user").write(prompt)
-    st_callback = StreamlitCallbackHandler(st.container(), expand_new_thoughts=True) 
-    prompt_formatted = custom_gen_sql.format(context=prompt)
-    try:
-        response = agent_executor.run(input=prompt_formatted, callbacks=[st_callback], memory=memory)
-    except ValueError as e:
-        response = str(e)
-        if not response.startswith("Could not parse LLM output: `"):
-            raise e
-        response = response.removeprefix("Could not parse LLM output: `").removesuffix("`")
+    question_vector = embed_question(get_embeddings(), prompt)
+    cached_answer = None if follow_up else answer_cache.lookup(question_vector, model_selection)
+    few_shot_match = match_few_shot(vector_db, question_vector) if use_fast_path and cached_answer is None else None
+    response = None
+    if cached_answer is not None:
+        source = "answer_cache"
+        response = cached_answer.answer
+        st.caption(f"Answered from cache (similar to: \"{cached_answer.question}\", similarity {cached_answer.similarity:.2f})")
+    elif few_shot_match is not None:
+        # a known question: one warehouse round trip instead of the agent loop, bounded like any other query
+        guarded = get_query_guard(conn_string).check(few_shot_match.sql)
+        if guarded.rejected:
+            st.caption(f"The known example query was not run ({guarded.rejected}), asking the agent instead")
+        else:
+            job = submit_statements([guarded.sql], get_execution_engine(conn_string), cache=result_cache)[0]
+            try:
+                result = job.future.result(timeout=FAST_PATH_TIMEOUT_SECONDS)
+            except FutureTimeoutError:
+                job.cancel()
+                st.caption(f"The known example query took over {FAST_PATH_TIMEOUT_SECONDS}s, asking the agent instead")
+            else:
+                record_span("warehouse", "fast_path", result.elapsed, question=prompt, error=result.error)
+                if result.result_set is None:
+                    # the stored query no longer runs (renamed table, lost grant...); the agent can work around it
+                    st.caption("The known example query failed, asking the agent instead")
+                else:
+                    source = "fast_path"
+                    response = format_fast_path_answer(few_shot_match, result)
+                    caption = f"Answered from a known example (\"{few_shot_match.question}\", similarity {few_shot_match.similarity:.2f})"
+                    if guarded.limited:
+                        caption += f", limited to {get_query_guard(conn_string).preview_limit:,} rows"
+                    st.caption(caption)
+                    st.dataframe(result.df)
+    if response is None:
+        prompt_formatted = custom_gen_sql.format(context=prompt)
+        # hand the agent the few relevant tables up front instead of letting it crawl the schema
+        relevant_schema = get_table_index(conn_string).relevant_schema(prompt, vector=question_vector)
+        if relevant_schema:
+            prompt_formatted += relevant_tables_prompt.format(schema=relevant_schema)
+        if history:
+            prompt_formatted += conversation_history_prompt.format(history=history)
+        # the run goes to the shared agent pool and keeps going across reruns; its answer is
+        # picked up below
+        decision = None
+        if model_selection == AUTO:
+            decision = router.route(prompt, vector_db, question_vector)
+            executors = {model: initialize_connection(model)[0] for model in (decision.model, router.strong_model)}
+            run = lambda callbacks: answer_with_escalation(router, decision, lambda model: run_agent(
+                executors[model], prompt_formatted, TraceCallbackHandler(question=prompt, model=model), callbacks))["output"]
+        else:
+            trace = TraceCallbackHandler(question=prompt, model=model_selection)
+            run = lambda callbacks: run_agent(agent_executor, prompt_formatted, trace, callbacks)["output"]
+        job = AgentJob(user_id, run, question=prompt, vector=question_vector, model=model_selection, decision=decision,
+                       follow_up=follow_up)
+        st.session_state.setdefault("agent_jobs", []).append(scheduler.submit(job))
 
+    if response is not None:
+        telemetry.emit("answer", session=user_id, question=prompt, answer=response, source=source,
+                       sql=extract_sql_blocks(response), latency=time.perf_counter() - prompt_started)
+        st.session_state["last_decision_id"] = None
+        msgs.add_ai_message(response)
+        st.chat_message("Kai").write(response)
 
+# this session's agent runs, oldest first
+while st.session_state.get("agent_jobs"):
+    job = st.session_state["agent_jobs"][0]
+    response = follow_agent_job(job)
+    if job.output is not None and not job.metadata["follow_up"]:
+        answer_cache.store(job.metadata["vector"], job.metadata["question"], response,
+                           extract_sql_blocks(response), job.metadata["model"])
+    decision = job.metadata["decision"]
+    telemetry.emit("answer", session=user_id, question=job.metadata["question"], answer=response, source="agent",
+                   sql=extract_sql_blocks(response), state=job.state,
+                   model=decision.final_model if decision is not None else job.metadata["model"],
+                   latency=(job.finished_at or time.monotonic()) - job.started_at if job.started_at is not None else None)
+    st.session_state["last_decision_id"] = decision.id if decision is not None and job.output is not None else None
     msgs.add_ai_message(response)
-    st.chat_message("Kai").write(response)
+    st.session_state["agent_jobs"].pop(0)
 
 
 with st.container():
@@ -108,25 +279,77 @@ with st.container():
     if len(msgs.messages) > 1:
         last_output_message = msgs.messages[-1].content    
     
-        # function to extact the sql from the response and execute it   
-        def execute_sql():
-            sql_matches = re.findall(r"```sql\n(.*?)\n```", last_output_message, re.DOTALL)
-            for sql in sql_matches:
-                try:
-                    #connect to snowflake using sqlalchemy engine and execute the sql query
-                    engine = sqlalchemy.create_engine(conn_string)
-                    df = engine.execute(sql).fetchall()
-                    df = pd.DataFrame(df)
-                    st.sidebar.write("Results")
-                    st.sidebar.dataframe(df)
-                except Exception as e:
-                    #st.write(e) #in case you want to write the error
-                    st.sidebar.warning("Invalid Query")
-        if re.findall(r"```sql\n(.*?)\n```", last_output_message, re.DOTALL):
-            st.button("Execute SQL", on_click=execute_sql)     
+        # function to extact the sql from the response and execute it
+        def execute_sql(full=False):
+            for job in st.session_state.get("sql_jobs", []):
+                if job.done() and job.result().result_set is not None:
+                    job.result().result_set.cleanup()
+            # previews are limited and size-checked; "Run full queries" sends the statements as written
+            checks = [get_query_guard(conn_string).check(sql, full=full) for sql in extract_sql_blocks(last_output_message)]
+            runnable = [check for check in checks if not check.rejected]
+            # a full run asks for fresh data, so it bypasses the result cache
+            jobs = submit_statements([check.sql for check in runnable], get_execution_engine(conn_string),
+                                     cache=None if full else result_cache)
+            st.session_state["sql_jobs"] = jobs
+            st.session_state["sql_checks"] = checks
+            st.sidebar.write("Results")
+            for check in checks:
+                if check.rejected:
+                    st.sidebar.warning(check.rejected)
+            # one slot per statement so each result appears as soon as it finishes
+            placeholders = {job: st.sidebar.empty() for job in jobs}
+            job_checks = dict(zip(jobs, runnable))
+            for job in iter_completed(jobs):
+                result = job.result()
+                check = job_checks[job]
+                record_span("warehouse", "execute_sql", result.elapsed, error=result.error, full=full)
+                telemetry.emit("execute_sql", session=user_id, sql=job.sql, latency=result.elapsed, error=result.error,
+                               cached=result.cached, full=full)
+                with placeholders[job].container():
+                    if result.result_set is not None:
+                        st.dataframe(result.df)
+                        caption = (f"{result.result_set.row_count:,} rows, "
+                                   f"{format_bytes(result.result_set.bytes_fetched)} fetched in {result.elapsed:.1f}s")
+                        if check.limited:
+                            caption += f", limited to {get_query_guard(conn_string).preview_limit:,} rows"
+                        if check.sampled:
+                            caption += f", sampled from {', '.join(check.sampled)}"
+                        if result.cached:
+                            caption += " (cached)"
+                        st.caption(caption)
+                    elif result.cancelled:
+                        st.warning("Query cancelled")
+                    else:
+                        #st.write(result.error) #in case you want to write the error
+                        st.warning("Invalid Query")
+
+        def cancel_sql():
+            cancel_jobs(st.session_state.get("sql_jobs", []))
+
+        if extract_sql_blocks(last_output_message):
+            st.button("Execute SQL", on_click=execute_sql)
+        if any(check.limited or check.sampled or check.rejected for check in st.session_state.get("sql_checks", [])):
+            st.sidebar.button("Run full queries", on_click=execute_sql, kwargs={"full": True},
+                              help="Run the statements as written, without the row limit, sampling or scan-size check.")
+        if any(not job.done() for job in st.session_state.get("sql_jobs", [])):
+            st.sidebar.button("Cancel running queries", on_click=cancel_sql)
+
+        # results too large for the preview were spilled to disk; page through them from there
+        for i, job in enumerate(st.session_state.get("sql_jobs", [])):
+            result_set = job.result().result_set if job.done() else None
+            if result_set is None or not result_set.spilled:
+                continue
+            with st.sidebar.expander(f"Full result {i + 1} ({result_set.row_count:,} rows)"):
+                page = st.number_input("Page", min_value=1, max_value=result_set.page_count, value=1, key=f"result_page_{i}")
+                st.dataframe(result_set.page(page - 1))
+                with open(result_set.parquet_path(), "rb") as f:
+                    st.download_button("Download Parquet", f, file_name=f"result_{i + 1}.parquet", key=f"result_download_{i}")
 
         def clear_chat():
+            for job in st.session_state.pop("agent_jobs", []):
+                scheduler.cancel(job)
             msgs.clear()
+            st.session_state.pop("history_shown", None)
             
         st.sidebar.button("Clear Chat", on_click=clear_chat)
 
@@ -151,18 +374,3 @@ with st.container():
         with col_2:
             if st.button("👎"):
                 handle_feedback("thumbs_down")
-        if feedback_counts["thumbs_up"] > feedback_counts["thumbs_down"]:
-            feedback = "positive"
-        elif feedback_counts["thumbs_up"] < feedback_counts["thumbs_down"]:
-            feedback = "negative"
-        else:
-            # If both counts are equal or both are 0, set a default feedback
-            feedback = "neutral"
-
-        #log_data = "User: " + last_user_message["content"] + "\n" + "Kai: " + last_output_message["content"] + "\n" + "feedback: " + feedback + "\n"
-        headers = {'Content-Type': 'application/json'}
-        # write the conversation back to keboola with feedback
-        # check if the url exists in the secrets
-        #if "url" in st.secrets:
-            #r = requests.post(st.secrets["url"], data=log_data.encode('utf-8'), headers=headers)
-
@@ -0,0 +1,306 @@
+"""
+Headless validation benchmark.
+
+Runs every model x agent type x validation question on a bounded thread pool and writes one
+JSON line per case (answer, score, wall time, LLM calls, tokens, agent iterations and SQL round
+trips) to benchmark_output.jsonl, next to the evaluation_output.csv written by validation.py.
+Cases whose inputs are unchanged since an earlier run are reused, and the run is diffed against
+the previous one.
+
+    python benchmark.py --workers 4 --models gpt-3.5-turbo-16k gpt-4
+"""
+import argparse
+import json
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Tuple
+
+import openai
+import pandas as pd
+import streamlit as st
+from langchain.agents import create_sql_agent
+from langchain.agents.agent_types import AgentType
+from langchain.callbacks.base import BaseCallbackHandler
+from langchain.chat_models import ChatOpenAI
+from langchain.evaluation import load_evaluator
+from langchain.llms.openai import OpenAI
+from langchain.sql_database import SQLDatabase
+
+from prompts import custom_gen_sql
+from embedding_cache import embed_question
+from llm_cache import MODES, install_llm_cache
+from model_router import AUTO, ModelRouter, answer_with_escalation
+from resources import database_url
+from schema_catalog import SchemaCatalog, catalog_key
+from sql_evaluator import ExecutionEvaluator
+from sql_toolkit import KaiSQLDatabaseToolkit
+from tracing import TraceCallbackHandler
+from validation_store import RESULTS_PATH, ValidationStore, case_fingerprint, regression_report
+
+# AUTO routes each question like the app's Auto mode, to compare its latency and score with the fixed models
+MODELS = ['gpt-3.5-turbo-instruct', 'gpt-3.5-turbo-16k', 'gpt-4', AUTO]
+AGENT_TYPES = [AgentType.ZERO_SHOT_REACT_DESCRIPTION, AgentType.OPENAI_FUNCTIONS]
+# completion-only models cannot drive the OpenAI functions agent
+COMPLETION_MODELS = {'gpt-3.5-turbo-instruct'}
+MAX_WORKERS = 4
+MAX_ITERATIONS = 10
+RATE_LIMIT_RETRIES = 4
+# per-case columns of a benchmark record; results written by validation.py have none of them
+METRIC_COLUMNS = ["wall_time", "llm_calls", "prompt_tokens", "completion_tokens", "iterations", "sql_round_trips"]
+
+
+def build_llm(model: str, **kwargs):
+    if model in COMPLETION_MODELS:
+        return OpenAI(model_name=model, temperature=0, **kwargs)
+    return ChatOpenAI(model=model, temperature=0, **kwargs)
+
+
+def supports(model: str, agent_type: AgentType) -> bool:
+    return not (model in COMPLETION_MODELS and agent_type == AgentType.OPENAI_FUNCTIONS)
+
+
+def generate_agent_executor(db, llm, catalog, max_iterations, agent_type, memory=None):
+    toolkit = KaiSQLDatabaseToolkit(llm=llm, db=db, catalog=catalog)
+    return create_sql_agent(
+        llm=llm,
+        toolkit=toolkit,
+        verbose=False,
+        handle_parsing_errors=True,
+        max_iterations=max_iterations,
+        agent_type=agent_type,
+        memory=memory,
+    )
+
+
+class RunMetricsHandler(BaseCallbackHandler):
+    """Counts LLM calls, tokens, agent iterations and warehouse queries for one agent run."""
+
+    def __init__(self):
+        self.llm_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.iterations = 0
+        self.sql_round_trips = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.llm_calls += 1
+
+    def on_llm_end(self, response, **kwargs):
+        usage = (response.llm_output or {}).get("token_usage", {})
+        self.prompt_tokens += usage.get("prompt_tokens", 0)
+        self.completion_tokens += usage.get("completion_tokens", 0)
+
+    def on_agent_action(self, action, **kwargs):
+        self.iterations += 1
+
+    def on_tool_start(self, serialized, input_str, **kwargs):
+        if serialized.get("name") == "sql_db_query":
+            self.sql_round_trips += 1
+
+    def as_dict(self) -> dict:
+        return {
+            "llm_calls": self.llm_calls,
+            "prompt_tokens": self.prompt_tokens,
+            "completion_tokens": self.completion_tokens,
+            "iterations": self.iterations,
+            "sql_round_trips": self.sql_round_trips,
+        }
+
+
+class RateLimitGate:
+    """Shared back-off: one worker hitting a rate limit pauses all of them."""
+
+    def __init__(self):
+        self._resume_at = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        delay = self._resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+
+    def backoff(self, attempt: int):
+        with self._lock:
+            self._resume_at = max(self._resume_at, time.monotonic() + min(60, 2 ** attempt))
+
+
+def run_agent(agent_executor, prompt: str, callbacks) -> str:
+    """agent_executor.run with the error handling validation.py uses."""
+    try:
+        return agent_executor.run(input=prompt, callbacks=callbacks)
+    except ValueError as e:
+        response = str(e)
+        if not response.startswith("Could not parse LLM output: `"):
+            raise e
+        return response.removeprefix("Could not parse LLM output: `").removesuffix("`")
+    except openai.InvalidRequestError as e:
+        response = str(e)
+        if "maximum context length" in response:
+            response = "Model context length exceeded. Please try again."
+        return response
+
+
+def run_case(case: dict, model: str, agent_type: AgentType, db, catalog, gate: RateLimitGate, evaluator=None,
+             router: ModelRouter = None, route=None) -> dict:
+    """`router` and `route` (question -> RoutingDecision) are needed for the AUTO model."""
+    record = {"model": model, "agent_type": str(agent_type), "question": case["question"], "answer": case["answer"]}
+    prompt = custom_gen_sql.format(context=case["question"])
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        gate.wait()
+        metrics = RunMetricsHandler()
+        started = time.perf_counter()
+        try:
+            def run(model_name):
+                agent_executor = generate_agent_executor(db, build_llm(model_name), catalog, MAX_ITERATIONS, agent_type)
+                return {"output": run_agent(agent_executor, prompt, [metrics, TraceCallbackHandler(case["question"], model_name)])}
+
+            if model == AUTO:
+                decision = route(case["question"])
+                response = answer_with_escalation(router, decision, run)["output"]
+                record.update({"routed_model": decision.final_model, "escalated": decision.escalated})
+            else:
+                response = run(model)["output"]
+            record["error"] = None
+        except openai.error.RateLimitError as e:
+            if attempt < RATE_LIMIT_RETRIES:
+                gate.backoff(attempt)
+                continue
+            response = ""
+            record["error"] = str(e)
+        except Exception as e:
+            response = ""
+            record["error"] = f"{type(e).__name__}: {e}"
+        record["wall_time"] = round(time.perf_counter() - started, 3)
+        record.update(metrics.as_dict())
+        break
+    record["prediction"] = response
+    if evaluator is not None and response:
+        try:
+            evaluation = evaluator.evaluate(response, reference_sql=case.get("sql"), reference_answer=case["answer"],
+                                            question=case["question"])
+        except Exception as e:
+            evaluation = {"score": None, "method": "error"}
+            record["eval_error"] = f"{type(e).__name__}: {e}"
+        record["score"] = evaluation.get("score")
+        record["eval_method"] = evaluation["method"]
+    return record
+
+
+def error_record(case: dict, model: str, agent_type: AgentType, error: Exception) -> dict:
+    """The record of a case whose run failed outside the agent, so the rest of the run goes on."""
+    record = {"model": model, "agent_type": str(agent_type), "question": case["question"], "answer": case["answer"],
+              "prediction": "", "error": f"{type(error).__name__}: {error}"}
+    return {**dict.fromkeys(METRIC_COLUMNS), **record}
+
+
+def run_benchmark(cases: List[dict], models: List[str], agent_types: List[AgentType], db, catalog,
+                  workers: int = MAX_WORKERS, output_path: str = RESULTS_PATH, evaluate: bool = True,
+                  llm_fallback: bool = False, force: bool = False) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Run the matrix and return (results, regression report against the previous run).
+    Cases whose fingerprint already has a result are reused unless `force` is set.
+    """
+    # imported here: loading the few-shot index needs the OpenAI key main() sets up
+    from few_shot_examples import embeddings, few_shots, vector_db
+
+    run_id = uuid.uuid4().hex[:12]
+    store = ValidationStore(output_path)
+    previous_run_id = store.last_run_id()
+    gate = RateLimitGate()
+    evaluator = None
+    if evaluate:
+        evaluator = ExecutionEvaluator(db._engine, llm_fallback=load_evaluator("pairwise_string") if llm_fallback else None)
+    router = ModelRouter() if AUTO in models else None
+
+    def route(question: str):
+        return router.route(question, vector_db, embed_question(embeddings, question))
+
+    matrix = [(case, model, agent_type) for model in models for agent_type in agent_types
+              if supports(model, agent_type) for case in cases]
+
+    records = []
+
+    def finish(record: dict, fingerprint: str, reused: bool):
+        record.update({"run_id": run_id, "timestamp": pd.Timestamp.now().isoformat(),
+                       "fingerprint": fingerprint, "reused": reused})
+        store.append(record)
+        records.append(record)
+        wall_time = f"{record['wall_time']:.1f}s" if pd.notna(record["wall_time"]) else "-"
+        print(f"[{len(records)}/{len(matrix)}] {'reused ' if reused else ''}{record['model']} {record['agent_type']} "
+              f"{wall_time} {record['question'][:60]}")
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="kai-benchmark") as pool:
+        futures = {}
+        for case, model, agent_type in matrix:
+            # the router refits its threshold as it learns, which changes where Auto sends a case
+            fingerprint = case_fingerprint(case, model, agent_type, custom_gen_sql.template, few_shots,
+                                           router_threshold=router.threshold if model == AUTO else None)
+            previous = None if force else store.lookup(fingerprint)
+            if previous is not None:
+                # records from validation.py share the store but have no metric columns
+                reused = {**dict.fromkeys(METRIC_COLUMNS), **previous}
+                finish({k: v for k, v in reused.items() if k not in ("run_id", "timestamp", "reused")}, fingerprint, True)
+                continue
+            future = pool.submit(run_case, case, model, agent_type, db, catalog, gate, evaluator, router, route)
+            futures[future] = (fingerprint, case, model, agent_type)
+        for future in as_completed(futures):
+            fingerprint, case, model, agent_type = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                record = error_record(case, model, agent_type, e)
+            finish(record, fingerprint, False)
+
+    current = pd.DataFrame(records)
+    previous = store.run(previous_run_id) if previous_run_id else pd.DataFrame()
+    return current, regression_report(current, previous)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run validation.json headless across models and agent types.")
+    parser.add_argument("--validation-file", default="validation.json")
+    parser.add_argument("--models", nargs="+", default=MODELS)
+    parser.add_argument("--agent-types", nargs="+", default=[a.value for a in AGENT_TYPES])
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS)
+    parser.add_argument("--output", default=RESULTS_PATH)
+    parser.add_argument("--no-eval", action="store_true", help="skip scoring the predictions")
+    parser.add_argument("--force", action="store_true", help="rerun every case, even if its inputs are unchanged")
+    parser.add_argument("--llm-fallback", action="store_true", help="grade answers without SQL with the pairwise LLM evaluator")
+    parser.add_argument("--llm-cache", choices=MODES, default="passthrough",
+                        help="record LLM responses to .cache/llm_cache.sqlite or replay them offline")
+    parser.add_argument("--database-url", help="run against this database instead of the Snowflake secrets, "
+                                               "e.g. a fixture written by local_fixture.py")
+    args = parser.parse_args()
+
+    if "OPENAI_API_KEY" in st.secrets:
+        os.environ.setdefault("OPENAI_API_KEY", st.secrets["OPENAI_API_KEY"])
+    with open(args.validation_file, "r") as f:
+        cases = json.load(f)
+    install_llm_cache(args.llm_cache)
+    conn_string = args.database_url or database_url()
+    db = SQLDatabase.from_uri(conn_string)
+    catalog = SchemaCatalog(db._engine, catalog_key(conn_string))
+
+    df, report = run_benchmark(cases, args.models, [AgentType(a) for a in args.agent_types], db, catalog,
+                               workers=args.workers, output_path=args.output, evaluate=not args.no_eval,
+                               llm_fallback=args.llm_fallback, force=args.force)
+    columns = list(METRIC_COLUMNS)
+    if "score" in df:
+        columns.append("score")
+    # reused and failed cases may have no metrics
+    df[columns] = df[columns].apply(pd.to_numeric, errors="coerce")
+    summary = df.groupby(["model", "agent_type"])[columns].mean().round(2)
+    summary["median_wall_time"] = df.groupby(["model", "agent_type"])["wall_time"].median().round(2)
+    print(summary.to_string())
+    print(f"\nReused {int(df['reused'].sum())} of {len(df)} cases. Against the previous run:")
+    print(report["status"].value_counts().to_string())
+    changed = report[report["status"].isin(["regressed", "improved"])]
+    if not changed.empty:
+        print(changed.to_string())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,156 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, List, Tuple
+
+import streamlit as st
+from langchain.schema import BaseChatMessageHistory
+from langchain.schema.messages import BaseMessage, messages_from_dict, messages_to_dict
+
+from settings import CACHE_DIR
+
+CHAT_HISTORY_PATH = os.path.join(CACHE_DIR, "chat_history.sqlite")
+# messages per session kept in memory; anything older is read back from disk on demand
+HOT_MESSAGES = 20
+MAX_HOT_SESSIONS = 200
+IDLE_SECONDS = 30 * 60
+RETENTION_DAYS = 30
+
+
+@dataclass
+class _HotWindow:
+    messages: Deque[BaseMessage]
+    total: int
+    last_access: float = field(default_factory=time.monotonic)
+
+    @property
+    def offset(self) -> int:
+        return self.total - len(self.messages)
+
+
+class ChatHistoryStore:
+    """
+    Chat messages of every session in one SQLite file. Appends go straight to disk and only the
+    newest `hot_messages` of each active session stay in memory; sessions idle for `idle_seconds`,
+    or beyond `max_sessions`, drop their window and reload it from disk when they come back.
+    """
+
+    def __init__(self, path: str = CHAT_HISTORY_PATH, hot_messages: int = HOT_MESSAGES,
+                 max_sessions: int = MAX_HOT_SESSIONS, idle_seconds: int = IDLE_SECONDS):
+        self.path = path
+        self.hot_messages = hot_messages
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._hot: "OrderedDict[str, _HotWindow]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS messages (session_id TEXT, seq INTEGER, message TEXT, "
+                         "created_at REAL, PRIMARY KEY (session_id, seq))")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _read(self, session_id: str, start: int, end: int) -> List[BaseMessage]:
+        with self._connect() as conn:
+            rows = conn.execute("SELECT message FROM messages WHERE session_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+                                (session_id, start, end)).fetchall()
+        return messages_from_dict([json.loads(row[0]) for row in rows])
+
+    def _window(self, session_id: str) -> _HotWindow:
+        # caller holds the lock
+        window = self._hot.get(session_id)
+        if window is None:
+            with self._connect() as conn:
+                total = conn.execute("SELECT COUNT(*) FROM messages WHERE session_id = ?", (session_id,)).fetchone()[0]
+            recent = self._read(session_id, max(0, total - self.hot_messages), total)
+            window = _HotWindow(deque(recent, maxlen=self.hot_messages), total)
+            self._hot[session_id] = window
+        window.last_access = time.monotonic()
+        self._hot.move_to_end(session_id)
+        self._evict()
+        return window
+
+    def _evict(self):
+        cutoff = time.monotonic() - self.idle_seconds
+        while self._hot:
+            oldest_id, oldest = next(iter(self._hot.items()))
+            if len(self._hot) <= self.max_sessions and oldest.last_access >= cutoff:
+                break
+            del self._hot[oldest_id]
+
+    def recent(self, session_id: str) -> Tuple[int, List[BaseMessage]]:
+        """(index of the first in-memory message, the in-memory messages)"""
+        with self._lock:
+            window = self._window(session_id)
+            return window.offset, list(window.messages)
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            return self._window(session_id).total
+
+    def page(self, session_id: str, start: int, end: int) -> List[BaseMessage]:
+        """Messages [start, end) of the session, read from disk."""
+        return self._read(session_id, max(0, start), end)
+
+    def append(self, session_id: str, message: BaseMessage):
+        with self._lock:
+            window = self._window(session_id)
+            with self._connect() as conn:
+                conn.execute("INSERT INTO messages (session_id, seq, message, created_at) VALUES (?, ?, ?, ?)",
+                             (session_id, window.total, json.dumps(messages_to_dict([message])[0]), time.time()))
+            window.messages.append(message)
+            window.total += 1
+
+    def clear(self, session_id: str):
+        with self._lock:
+            with self._connect() as conn:
+                conn.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            self._hot.pop(session_id, None)
+
+    def purge(self, max_age_days: int = RETENTION_DAYS):
+        """Delete conversations whose last message is older than `max_age_days`."""
+        cutoff = time.time() - max_age_days * 86400
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM messages WHERE session_id IN (SELECT session_id FROM messages "
+                         "GROUP BY session_id HAVING MAX(created_at) < ?)", (cutoff,))
+
+
+class SQLiteChatMessageHistory(BaseChatMessageHistory):
+    """
+    One session's view of the ChatHistoryStore. `messages` holds only the in-memory window;
+    `offset` is how many older messages precede it, readable with slice().
+    """
+
+    def __init__(self, session_id: str, store: ChatHistoryStore):
+        self.session_id = session_id
+        self.store = store
+
+    @property
+    def messages(self) -> List[BaseMessage]:
+        return self.store.recent(self.session_id)[1]
+
+    @property
+    def offset(self) -> int:
+        return self.store.recent(self.session_id)[0]
+
+    def slice(self, start: int, end: int) -> List[BaseMessage]:
+        return self.store.page(self.session_id, start, end)
+
+    def add_message(self, message: BaseMessage) -> None:
+        self.store.append(self.session_id, message)
+
+    def clear(self) -> None:
+        self.store.clear(self.session_id)
+
+
+@st.cache_resource(show_spinner=False)
+def get_chat_store() -> ChatHistoryStore:
+    store = ChatHistoryStore()
+    store.purge()
+    return store
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+import shutil
+from typing import List
+
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.embeddings.base import Embeddings
+from langchain.embeddings.openai import OpenAIEmbeddings
+from langchain.schema import Document
+from langchain.storage import LocalFileStore
+from langchain.vectorstores import FAISS
+
+from settings import CACHE_DIR
+
+EMBEDDING_CACHE_DIR = os.path.join(CACHE_DIR, "embeddings")
+FAISS_INDEX_DIR = os.path.join(CACHE_DIR, "faiss")
+
+
+def cached_embeddings(underlying: Embeddings = None) -> CacheBackedEmbeddings:
+    """
+    Embeddings backed by an on-disk store keyed by (model, text hash), so a document is only
+    ever sent to the embedding API once per model.
+    """
+    underlying = underlying or OpenAIEmbeddings()
+    namespace = getattr(underlying, "model", type(underlying).__name__)
+    return CacheBackedEmbeddings.from_bytes_store(underlying, LocalFileStore(EMBEDDING_CACHE_DIR), namespace=namespace)
+
+
+def embed_question(embeddings: Embeddings, question: str) -> List[float]:
+    # embed_documents goes through the cache, so repeated questions cost no API call
+    return embeddings.embed_documents([question])[0]
+
+
+def documents_hash(docs: List[Document]) -> str:
+    payload = [(doc.page_content, doc.metadata) for doc in docs]
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+def load_or_build_faiss(name: str, docs: List[Document], embeddings: Embeddings) -> FAISS:
+    """
+    Load the FAISS index saved for exactly these documents, or build and save it.
+    Building goes through `embeddings`, so with cached_embeddings() only new or edited
+    documents are embedded; indexes saved for older versions of the documents are removed.
+    """
+    root = os.path.join(FAISS_INDEX_DIR, name)
+    index_dir = os.path.join(root, documents_hash(docs))
+    if os.path.exists(os.path.join(index_dir, "index.faiss")):
+        return FAISS.load_local(index_dir, embeddings)
+    vector_db = FAISS.from_documents(docs, embeddings)
+    vector_db.save_local(index_dir)
+    for stale in os.listdir(root):
+        if os.path.join(root, stale) != index_dir:
+            shutil.rmtree(os.path.join(root, stale), ignore_errors=True)
+    return vector_db
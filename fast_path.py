@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from typing import List, Optional
+
+from langchain.vectorstores import FAISS
+
+from sql_execution import StatementResult
+
+FAST_PATH_THRESHOLD = 0.97
+# a known query slower than this is handed to the agent instead of keeping the user waiting
+FAST_PATH_TIMEOUT_SECONDS = 20
+
+
+@dataclass
+class FewShotMatch:
+    question: str
+    sql: str
+    similarity: float
+
+
+def nearest_few_shot(vector_db: FAISS, vector: List[float]) -> Optional[FewShotMatch]:
+    """
+    The closest few-shot example to the question, however far it is.
+    FAISS returns squared L2 distances; OpenAI embeddings are unit length, so
+    cosine similarity is 1 - d / 2.
+    """
+    results = vector_db.similarity_search_with_score_by_vector(vector, k=1)
+    if not results:
+        return None
+    doc, distance = results[0]
+    return FewShotMatch(question=doc.page_content, sql=doc.metadata['sql_query'], similarity=1 - float(distance) / 2)
+
+
+def match_few_shot(vector_db: FAISS, vector: List[float], threshold: float = FAST_PATH_THRESHOLD) -> Optional[FewShotMatch]:
+    """Top few-shot example for the question if it is close enough to run its SQL as-is."""
+    match = nearest_few_shot(vector_db, vector)
+    if match is None or match.similarity < threshold:
+        return None
+    return match
+
+
+def format_fast_path_answer(match: FewShotMatch, result: StatementResult) -> str:
+    rows = result.result_set.row_count
+    answer = f"Here is the SQL query for this question:\n\n```sql\n{match.sql}\n```\n\nIt returned {rows:,} row{'s' if rows != 1 else ''}."
+    if rows == 1 and len(result.result_set.columns) == 1:
+        answer += f" The result is {result.df.iloc[0, 0]}."
+    return answer
@@ -1,18 +1,19 @@
-from langchain.embeddings.openai import OpenAIEmbeddings
-from langchain.vectorstores import FAISS
 from langchain.schema import Document
 from langchain.agents.agent_toolkits import create_retriever_tool
 
+from embedding_cache import cached_embeddings, load_or_build_faiss
+
 
 few_shots = {'List all customers.': 'SELECT * FROM "customer";',
  'How many orders are there?': 'SELECT COUNT(*) FROM \"order\";',
  'Help me write a query to find the number of orders placed by each customer.': 'SELECT customer_id, COUNT(*) AS order_count FROM \"order\" GROUP BY customer_id;'
 }
 
-embeddings = OpenAIEmbeddings()
+embeddings = cached_embeddings()
 
 few_shot_docs = [Document(page_content=question, metadata={'sql_query': few_shots[question]}) for question in few_shots.keys()]
-vector_db = FAISS.from_documents(few_shot_docs, embeddings)
+# loaded from disk unless few_shots changed; then only the new/edited questions are embedded
+vector_db = load_or_build_faiss('few_shots', few_shot_docs, embeddings)
 retriever = vector_db.as_retriever()
 
 tool_description = """
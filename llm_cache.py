@@ -0,0 +1,79 @@
+import hashlib
+import os
+import pickle
+import sqlite3
+import threading
+from typing import Optional
+
+import langchain
+from langchain.schema.cache import RETURN_VAL_TYPE, BaseCache
+
+from settings import CACHE_DIR
+
+LLM_CACHE_PATH = os.path.join(CACHE_DIR, "llm_cache.sqlite")
+MODES = ("record", "replay", "passthrough")
+
+
+class LLMCacheMiss(RuntimeError):
+    pass
+
+
+class RecordReplayCache(BaseCache):
+    """
+    On-disk LLM response cache for reproducible runs.
+
+    LangChain hands the cache the serialized prompt messages and an llm_string made of the
+    model parameters (model name, temperature, functions, stop words), so the key is
+    sha256(llm_string + prompt).
+
+    - record: always call the model and store the response
+    - replay: only answer from the cache; a miss raises LLMCacheMiss instead of calling the API
+    """
+
+    def __init__(self, mode: str = "record", path: str = LLM_CACHE_PATH):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unsupported LLM cache mode: {mode}")
+        self.mode = mode
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, llm_string TEXT, value BLOB)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str) -> str:
+        return hashlib.sha256(f"{llm_string}\n{prompt}".encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        if self.mode == "record":
+            return None
+        with self._connect() as conn:
+            row = conn.execute("SELECT value FROM llm_cache WHERE key = ?", (self._key(prompt, llm_string),)).fetchone()
+        if row is None:
+            self.misses += 1
+            raise LLMCacheMiss(f"No recorded LLM response for this prompt ({llm_string[:80]}...)")
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO llm_cache (key, llm_string, value) VALUES (?, ?, ?)",
+                         (self._key(prompt, llm_string), llm_string, pickle.dumps(return_val)))
+
+    def clear(self, **kwargs) -> None:
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM llm_cache")
+
+
+def install_llm_cache(mode: str, path: str = LLM_CACHE_PATH) -> Optional[RecordReplayCache]:
+    """Set the process-wide LangChain LLM cache; passthrough removes it."""
+    if mode not in MODES:
+        raise ValueError(f"LLM cache mode must be one of {MODES}, got {mode}")
+    cache = None if mode == "passthrough" else RecordReplayCache(mode, path)
+    langchain.llm_cache = cache
+    return cache
@@ -0,0 +1,185 @@
+import glob
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import pandas as pd
+import sqlalchemy
+import sqlglot
+from sqlglot import exp
+
+from settings import CACHE_DIR
+from src.keboola_storage_api.export_cache import EXPORT_DIR
+
+LOCAL_DB_PATH = os.path.join(CACHE_DIR, "local_tables.sqlite")
+# tables larger than this stay in the warehouse; SQLite scans are single-threaded
+MAX_LOCAL_ROWS = 5_000_000
+LOAD_CHUNK_ROWS = 50_000
+TYPE_SAMPLE_ROWS = 10_000
+
+INTEGER_PATTERN = re.compile(r"^[+-]?\d+$")
+REAL_PATTERN = re.compile(r"^[+-]?(\d+\.?\d*|\.\d+)([eE][+-]?\d+)?$")
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?(Z|[+-]\d{2}:?\d{2})?$")
+
+
+def column_type(values: pd.Series) -> str:
+    """SQLite column type for a sample of CSV strings; empty values (Storage's NULL) don't count against a type."""
+    values = values[values != ""]
+    if values.empty:
+        return "TEXT"
+    for pattern, type_ in ((INTEGER_PATTERN, "INTEGER"), (REAL_PATTERN, "REAL"), (DATE_PATTERN, "TIMESTAMP")):
+        if values.str.match(pattern).all():
+            return type_
+    return "TEXT"
+
+
+def local_table_name(csv_path: str) -> str:
+    """`data/in.c-sales.orders.csv` -> `in.c-sales.orders`, the Storage table id the export cache names it by."""
+    return os.path.splitext(os.path.basename(csv_path))[0]
+
+
+def exported_tables(export_dir: str = EXPORT_DIR) -> Dict[str, str]:
+    """Exported CSVs available for loading, by table id."""
+    return {local_table_name(path): path for path in sorted(glob.glob(os.path.join(export_dir, "*.csv")))}
+
+
+@dataclass
+class LocalTable:
+    name: str  # the Storage table id, also the name of the local table
+    source_path: str
+    source_mtime: float
+    rows: int
+    loaded_at: float
+
+    @property
+    def bucket(self) -> str:
+        """The bucket id, which is the table's schema in the warehouse."""
+        return self.name.rsplit(".", 1)[0] if "." in self.name else ""
+
+    @property
+    def table(self) -> str:
+        return self.name.rsplit(".", 1)[-1]
+
+
+@dataclass
+class LocalRoute:
+    """Where a query runs; `sql` is the SQLite translation when it runs locally."""
+    local: bool
+    reason: str
+    sql: Optional[str] = None
+
+
+class LocalTableEngine:
+    """
+    Copies of exported Storage tables in a local SQLite file, so the agent can answer questions
+    about them without warehouse credits.
+
+    CSVs are loaded in chunks into tables named by their table id, with column types inferred
+    from a sample; values that don't fit keep their text (SQLite type affinity), so nothing is
+    lost to a wrong guess. Empty values are NULL in typed columns and stay empty strings in text
+    ones. A table is only reloaded when its CSV changes.
+
+    route() decides per query: it runs locally only if it is a read-only query, every table it
+    reads is loaded here from the bucket the query names (or `default_schema` for unqualified
+    names) and small enough, and it translates to SQLite. Anything else, or a local run that
+    fails, goes to the warehouse.
+    """
+
+    def __init__(self, path: str = LOCAL_DB_PATH, source_dialect: str = "snowflake",
+                 max_rows: int = MAX_LOCAL_ROWS, default_schema: Optional[str] = None):
+        self.path = path
+        self.source_dialect = source_dialect
+        self.max_rows = max_rows
+        self.default_schema = default_schema
+        self.local_queries = 0
+        self.warehouse_queries = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+        with self.engine.begin() as conn:
+            conn.exec_driver_sql("CREATE TABLE IF NOT EXISTS _local_tables (name TEXT PRIMARY KEY, source_path TEXT, "
+                                 "source_mtime REAL, rows INTEGER, loaded_at REAL)")
+
+    # loading
+
+    def tables(self) -> Dict[str, LocalTable]:
+        """Loaded tables by lower-cased table id."""
+        with self.engine.connect() as conn:
+            rows = conn.exec_driver_sql("SELECT name, source_path, source_mtime, rows, loaded_at FROM _local_tables").fetchall()
+        return {row[0].lower(): LocalTable(*row) for row in rows}
+
+    def load(self, csv_path: str, name: Optional[str] = None,
+             loaded: Optional[Dict[str, LocalTable]] = None) -> LocalTable:
+        """
+        Load the CSV unless it is loaded already and unchanged. `loaded` is a tables() result to
+        check against, so loading several tables reads the list once.
+        """
+        name = name or local_table_name(csv_path)
+        mtime = os.path.getmtime(csv_path)
+        current = (loaded if loaded is not None else self.tables()).get(name.lower())
+        if current is not None and current.source_path == csv_path and current.source_mtime == mtime:
+            return current
+        with self._lock:
+            sample = pd.read_csv(csv_path, dtype=str, nrows=TYPE_SAMPLE_ROWS, keep_default_na=False)
+            types = {column: column_type(sample[column]) for column in sample.columns}
+            typed = [t != "TEXT" for t in types.values()]
+            quote = self.engine.dialect.identifier_preparer.quote
+            rows = 0
+            with self.engine.begin() as conn:
+                conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote(name)}")
+                conn.exec_driver_sql(f"CREATE TABLE {quote(name)} ("
+                                     + ", ".join(f"{quote(c)} {t}" for c, t in types.items()) + ")")
+                insert = (f"INSERT INTO {quote(name)} VALUES (" + ", ".join("?" for _ in types) + ")")
+                for chunk in pd.read_csv(csv_path, dtype=str, chunksize=LOAD_CHUNK_ROWS, keep_default_na=False):
+                    values = [tuple(None if is_typed and v == "" else v for v, is_typed in zip(row, typed))
+                              for row in chunk.itertuples(index=False, name=None)]
+                    conn.exec_driver_sql(insert, values)
+                    rows += len(chunk)
+                table = LocalTable(name, csv_path, mtime, rows, time.time())
+                conn.exec_driver_sql("INSERT OR REPLACE INTO _local_tables VALUES (?, ?, ?, ?, ?)",
+                                     (table.name, table.source_path, table.source_mtime, table.rows, table.loaded_at))
+            return table
+
+    def unload(self, name: str):
+        with self._lock, self.engine.begin() as conn:
+            conn.exec_driver_sql(f"DROP TABLE IF EXISTS {self.engine.dialect.identifier_preparer.quote(name)}")
+            conn.exec_driver_sql("DELETE FROM _local_tables WHERE name = ?", (name,))
+
+    # routing
+
+    def route(self, sql: str) -> LocalRoute:
+        try:
+            tree = sqlglot.parse_one(sql, read=self.source_dialect)
+        except sqlglot.errors.ParseError:
+            return LocalRoute(False, "does not parse")
+        if not isinstance(tree, exp.Query):
+            return LocalRoute(False, "not a query")
+        ctes = {cte.alias_or_name.lower() for cte in tree.find_all(exp.CTE)}
+        loaded = self.tables()
+        referenced = [t for t in tree.find_all(exp.Table) if t.name.lower() not in ctes]
+        if not referenced:
+            return LocalRoute(False, "reads no tables")
+        for table in referenced:
+            bucket = table.db or self.default_schema
+            if not bucket:
+                return LocalRoute(False, f"{table.name} does not name its bucket")
+            local = loaded.get(f"{bucket}.{table.name}".lower())
+            if local is None:
+                return LocalRoute(False, f"{bucket}.{table.name} is not loaded locally")
+            if local.rows > self.max_rows:
+                return LocalRoute(False, f"{local.name} has {local.rows:,} rows")
+            # the local copy lives in SQLite's single schema, under its table id; the old name stays
+            # as the alias so column references like orders.id still resolve
+            if not table.alias:
+                table.set("alias", exp.TableAlias(this=exp.to_identifier(table.name)))
+            table.set("this", exp.to_identifier(local.name, quoted=True))
+            table.set("db", None)
+            table.set("catalog", None)
+        try:
+            local_sql = tree.sql(dialect="sqlite", unsupported_level=sqlglot.ErrorLevel.RAISE)
+        except sqlglot.errors.UnsupportedError as e:
+            return LocalRoute(False, f"not supported by SQLite: {e}")
+        return LocalRoute(True, "all tables are local", local_sql)
@@ -0,0 +1,42 @@
+"""
+Copy the warehouse tables into a local SQLite file, so agent runs and benchmarks can be
+recorded and replayed without Snowflake:
+
+    python local_fixture.py --output fixtures/kai.sqlite --row-limit 10000
+    python benchmark.py --database-url sqlite:///fixtures/kai.sqlite --llm-cache record
+"""
+import argparse
+import os
+
+import pandas as pd
+import sqlalchemy
+
+FIXTURE_ROW_LIMIT = 10000
+
+
+def snapshot_to_sqlite(source_url: str, output_path: str, row_limit: int = FIXTURE_ROW_LIMIT):
+    source = sqlalchemy.create_engine(source_url)
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    target = sqlalchemy.create_engine(f"sqlite:///{output_path}")
+    metadata = sqlalchemy.MetaData()
+    for name in sqlalchemy.inspect(source).get_table_names():
+        table = sqlalchemy.Table(name, metadata, autoload_with=source)
+        with source.connect() as conn:
+            df = pd.read_sql(sqlalchemy.select(table).limit(row_limit), conn)
+        # pandas maps the column types to SQLite's; Snowflake DDL would not compile there
+        df.to_sql(name, target, if_exists="replace", index=False)
+        print(f"{name}: {len(df)} rows")
+
+
+def main():
+    from resources import snowflake_conn_string
+
+    parser = argparse.ArgumentParser(description="Snapshot the Snowflake schema from st.secrets into SQLite.")
+    parser.add_argument("--output", default="fixtures/kai.sqlite")
+    parser.add_argument("--row-limit", type=int, default=FIXTURE_ROW_LIMIT)
+    args = parser.parse_args()
+    snapshot_to_sqlite(snowflake_conn_string(), args.output, args.row_limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,213 @@
+import json
+import os
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Callable, List, Optional
+
+from agent_jobs import AgentCancelled
+from fast_path import nearest_few_shot
+from settings import CACHE_DIR
+
+AUTO = "Auto"
+FAST_MODEL = "gpt-3.5-turbo-16k"
+STRONG_MODEL = "gpt-4"
+ROUTING_LOG_PATH = os.path.join(CACHE_DIR, "routing.jsonl")
+
+DEFAULT_THRESHOLD = 0.5
+THRESHOLD_RANGE = (0.2, 0.8)
+# share of questions above the threshold still sent to the fast model, so the threshold can also move up
+EXPLORE_RATE = 0.1
+# share of fast-model answers, not escalated, that users may mark as wrong before the threshold drops
+MAX_BAD_ANSWER_RATE = 0.1
+MIN_SAMPLES = 20
+REFIT_EVERY = 10
+
+COMPLEX_HINTS = re.compile(
+    r"\b(each|per|by|compare|versus|vs|trend|over time|growth|ratio|rate|average|avg|median|percent|share|"
+    r"top \d+|rank|cohort|retention|ltv|lifetime|day|week|month|year|between|distribution|breakdown|correlat\w*)\b",
+    re.IGNORECASE)
+CHAINED = re.compile(r"\b(and|then|also|as well as)\b", re.IGNORECASE)
+LOW_CONFIDENCE_ANSWERS = ("i don't know", "agent stopped due to iteration limit", "i could not", "i'm unable", "i am unable")
+
+
+def question_features(question: str, few_shot_similarity: float = 0.0) -> dict:
+    return {
+        "words": len(question.split()),
+        "hints": len(COMPLEX_HINTS.findall(question)),
+        "clauses": len(CHAINED.findall(question)) + max(0, question.count("?") - 1),
+        "few_shot_similarity": round(few_shot_similarity, 4),
+    }
+
+
+def complexity_score(features: dict) -> float:
+    """0 for a short question close to a known example, towards 1 for a long, novel, multi-part one."""
+    novelty = min(1.0, max(0.0, (0.95 - features["few_shot_similarity"]) / 0.25))
+    return round(0.4 * novelty
+                 + 0.2 * min(1.0, features["words"] / 30)
+                 + 0.25 * min(1.0, features["hints"] / 3)
+                 + 0.15 * min(1.0, features["clauses"] / 2), 4)
+
+
+def low_confidence(output: str, error: Optional[BaseException] = None, intermediate_steps=None) -> Optional[str]:
+    """Why an agent answer should be retried with the stronger model, or None if it looks fine."""
+    if error is not None:
+        return f"{type(error).__name__}: {error}"
+    if not output or not output.strip():
+        return "empty answer"
+    lowered = output.lower()
+    for phrase in LOW_CONFIDENCE_ANSWERS:
+        if phrase in lowered:
+            return f"answer says \"{phrase}\""
+    if intermediate_steps and str(intermediate_steps[-1][1]).startswith("Error"):
+        return "last query failed"
+    return None
+
+
+@dataclass
+class RoutingDecision:
+    question: str
+    model: str
+    score: float
+    threshold: float
+    reason: str
+    features: dict = field(default_factory=dict)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    final_model: Optional[str] = None
+    escalated: bool = False
+
+
+class ModelRouter:
+    """
+    Sends each question to the fast or the strong model by a complexity score computed from
+    cheap local features and the similarity to the closest few-shot example.
+
+    Every routed run is logged with its latency and whether it had to be escalated, and thumbs
+    feedback is logged against it. The threshold is refit from that log: it is the highest score
+    at which the fast model's escalation rate still pays for itself in median latency and users
+    rarely mark its answers wrong.
+    """
+
+    def __init__(self, fast_model: str = FAST_MODEL, strong_model: str = STRONG_MODEL,
+                 threshold: float = DEFAULT_THRESHOLD, path: str = ROUTING_LOG_PATH):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.threshold = threshold
+        self.path = path
+        self._lock = threading.Lock()
+        self._unfitted = 0
+        self.fit()
+
+    def route(self, question: str, vector_db=None, vector: List[float] = None) -> RoutingDecision:
+        nearest = nearest_few_shot(vector_db, vector) if vector_db is not None and vector is not None else None
+        features = question_features(question, nearest.similarity if nearest is not None else 0.0)
+        score = complexity_score(features)
+        if score <= self.threshold:
+            model, reason = self.fast_model, "simple"
+        elif random.random() < EXPLORE_RATE:
+            model, reason = self.fast_model, "explore"
+        else:
+            model, reason = self.strong_model, "complex"
+        return RoutingDecision(question=question, model=model, score=score, threshold=self.threshold,
+                               reason=reason, features=features)
+
+    # learning
+
+    def _append(self, record: dict):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock, open(self.path, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    def record(self, decision: RoutingDecision, latency: float, first_latency: float,
+               escalation_reason: Optional[str] = None, error: Optional[str] = None):
+        self._append({"type": "run", "id": decision.id, "timestamp": time.time(), "score": decision.score,
+                      "reason": decision.reason, "first_model": decision.model, "final_model": decision.final_model,
+                      "escalated": decision.escalated, "latency": round(latency, 3),
+                      "first_latency": round(first_latency, 3), "escalation_reason": escalation_reason,
+                      "error": error, **decision.features})
+        self._unfitted += 1
+        if self._unfitted >= REFIT_EVERY:
+            self.fit()
+
+    def record_feedback(self, decision_id: str, positive: bool):
+        self._append({"type": "feedback", "id": decision_id, "timestamp": time.time(), "positive": positive})
+
+    def _load(self) -> List[dict]:
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def fit(self) -> float:
+        self._unfitted = 0
+        records = self._load()
+        # stopped runs say nothing about the model; older logs may still hold some
+        runs = {r["id"]: r for r in records if r["type"] == "run" and not _cancelled(r)}
+        feedback = {r["id"]: r["positive"] for r in records if r["type"] == "feedback"}
+        fast_runs = sorted((r for r in runs.values() if r["first_model"] == self.fast_model), key=lambda r: r["score"])
+        if len(fast_runs) < MIN_SAMPLES:
+            return self.threshold
+
+        # escalating costs the fast attempt on top of the strong one, so the fast model only wins
+        # while it is escalated less often than this
+        fast_latency = [r["first_latency"] for r in fast_runs]
+        strong_latency = [r["latency"] for r in runs.values() if r["first_model"] == self.strong_model]
+        break_even = 0.5
+        if strong_latency:
+            break_even = min(0.9, max(0.05, 1 - statistics.median(fast_latency) / statistics.median(strong_latency)))
+
+        threshold = THRESHOLD_RANGE[0]
+        escalated = bad = 0
+        for i, run in enumerate(fast_runs, 1):
+            escalated += bool(run["escalated"])
+            bad += not run["escalated"] and feedback.get(run["id"]) is False
+            if escalated / i <= break_even and bad / i <= MAX_BAD_ANSWER_RATE:
+                threshold = run["score"]
+        self.threshold = min(THRESHOLD_RANGE[1], max(THRESHOLD_RANGE[0], threshold))
+        return self.threshold
+
+
+def _cancelled(record: dict) -> bool:
+    return any((record.get(key) or "").startswith(AgentCancelled.__name__) for key in ("escalation_reason", "error"))
+
+
+def answer_with_escalation(router: ModelRouter, decision: RoutingDecision, run: Callable[[str], dict]) -> dict:
+    """
+    run(model) -> the agent's result dict. A failed or low-confidence answer from the fast model
+    is retried once with the strong one; the outcome is logged for the router either way, also
+    when the final run raises. A run stopped by the user or its timeout (AgentCancelled) is
+    neither retried nor logged.
+    """
+    started = time.perf_counter()
+    first_latency = None
+    reason = None
+    decision.final_model = decision.model
+    try:
+        try:
+            result, error = run(decision.model), None
+        except AgentCancelled:
+            raise
+        except Exception as e:
+            if decision.model == router.strong_model:
+                raise
+            result, error = {}, e
+        first_latency = time.perf_counter() - started
+        if decision.model != router.strong_model:
+            reason = low_confidence(result.get("output", ""), error, result.get("intermediate_steps"))
+        if reason is not None:
+            decision.escalated = True
+            decision.final_model = router.strong_model
+            result = run(router.strong_model)
+    except AgentCancelled:
+        raise
+    except Exception as e:
+        latency = time.perf_counter() - started
+        router.record(decision, latency, first_latency if first_latency is not None else latency,
+                      escalation_reason=reason, error=f"{type(e).__name__}: {e}")
+        raise
+    router.record(decision, time.perf_counter() - started, first_latency, escalation_reason=reason)
+    return result
@@ -0,0 +1,44 @@
+import hmac
+
+import pandas as pd
+import streamlit as st
+
+from tracing import load_spans, step_percentiles
+
+st.header("Admin: where the time goes")
+
+# the traces hold every user's questions, so the page is only open with the admin_password secret
+admin_password = st.secrets.get("admin_password")
+if not admin_password:
+    st.warning("The admin page is disabled. Set admin_password in the secrets to enable it.")
+    st.stop()
+if not st.session_state.get("is_admin"):
+    password = st.text_input("Admin password", type="password")
+    if not password:
+        st.stop()
+    if not hmac.compare_digest(password.encode("utf-8"), str(admin_password).encode("utf-8")):
+        st.error("Wrong password.")
+        st.stop()
+    st.session_state["is_admin"] = True
+
+spans = load_spans()
+if spans.empty:
+    st.info("No traces recorded yet. Ask Kai a question first.")
+    st.stop()
+
+st.subheader("Latency per step")
+st.dataframe(step_percentiles(spans), use_container_width=True)
+
+st.subheader("Duration histogram")
+step_type = st.selectbox("Step type", sorted(spans["type"].unique()))
+durations = spans.loc[spans["type"] == step_type, "duration_ms"]
+histogram = pd.cut(durations, bins=20).value_counts().sort_index()
+histogram.index = [f"{interval.left:.0f}-{interval.right:.0f} ms" for interval in histogram.index]
+st.bar_chart(histogram)
+
+agent_runs = spans[spans["type"] == "agent"]
+if not agent_runs.empty:
+    st.subheader("Recent questions")
+    columns = [c for c in ["question", "model", "duration_ms", "iterations", "llm_calls", "tokens", "warehouse_queries"]
+               if c in agent_runs]
+    st.dataframe(agent_runs[columns].tail(50).iloc[::-1], use_container_width=True)
@@ -63,6 +63,26 @@ group by "customer_id" having count(*) > 2
 )
 
 
+relevant_tables_prompt = PromptTemplate.from_template(
+   """
+Here is the schema of the tables most likely to be relevant to the user input, with a few sample rows each:
+
+{schema}
+
+Use these tables directly. Only list the other tables in the database if these are not enough to answer.
+"""
+)
+
+
+conversation_history_prompt = PromptTemplate.from_template(
+   """
+Here is the conversation so far, for context on follow-up questions:
+
+{history}
+"""
+)
+
+
 custom_gen_sql_1 = PromptTemplate.from_template(
     """
     You will be taking on the role of an AI Agent Snowflake SQL Expert named Kai. 
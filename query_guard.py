@@ -0,0 +1,171 @@
+import json
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import sqlalchemy
+import sqlglot
+from sqlglot import exp
+
+from result_store import PREVIEW_ROWS, format_bytes
+
+PREVIEW_LIMIT = PREVIEW_ROWS
+MAX_SCAN_BYTES = 10 * 1024 ** 3
+# with sampling on, scans of tables larger than this read a block sample of about this size
+SAMPLE_TARGET_BYTES = 1024 ** 3
+
+SQLGLOT_DIALECTS = {"postgresql": "postgres", "mssql": "tsql"}
+
+
+def sqlglot_dialect(engine: sqlalchemy.engine.Engine) -> str:
+    return SQLGLOT_DIALECTS.get(engine.dialect.name, engine.dialect.name)
+
+
+@dataclass
+class GuardedQuery:
+    original: str
+    sql: str
+    limited: bool = False
+    sampled: List[str] = field(default_factory=list)
+    scan_bytes: Optional[int] = None
+    rejected: Optional[str] = None
+
+    @property
+    def rewritten(self) -> bool:
+        return self.sql != self.original
+
+
+class QueryGuard:
+    """
+    Bounds what a preview query can cost before it reaches the warehouse:
+
+    - a LIMIT is added to SELECTs without one, and larger LIMITs are capped;
+    - with `sample` on, queries that only read rows (no aggregates, GROUP BY or DISTINCT, whose
+      result sampling would change) read a block sample of very large tables;
+    - on Snowflake, EXPLAIN estimates the bytes scanned and queries above `max_scan_bytes` are
+      rejected with the reason.
+
+    check(sql, full=True) skips all of it, for an explicit "run full" from the user.
+    SQL that doesn't parse, or holds more than one statement, is rejected, since none of the above
+    can be checked on it; single statements that aren't queries are passed through for the warehouse
+    to judge.
+    """
+
+    def __init__(self, engine: sqlalchemy.engine.Engine, preview_limit: int = PREVIEW_LIMIT,
+                 max_scan_bytes: Optional[int] = MAX_SCAN_BYTES, sample: bool = False,
+                 sample_target_bytes: int = SAMPLE_TARGET_BYTES):
+        self.engine = engine
+        self.dialect = sqlglot_dialect(engine)
+        self.preview_limit = preview_limit
+        self.max_scan_bytes = max_scan_bytes
+        self.sample = sample
+        self.sample_target_bytes = sample_target_bytes
+
+    def check(self, sql: str, full: bool = False) -> GuardedQuery:
+        guarded = GuardedQuery(original=sql, sql=sql)
+        if full:
+            return guarded
+        try:
+            statements = [tree for tree in sqlglot.parse(sql, read=self.dialect) if tree is not None]
+        except sqlglot.errors.ParseError as e:
+            guarded.rejected = f"This query could not be parsed, so its cost can't be checked: {e}"
+            return guarded
+        if len(statements) != 1:
+            guarded.rejected = "Run exactly one SQL statement at a time."
+            return guarded
+        tree = statements[0]
+        if not isinstance(tree, exp.Query):
+            return guarded
+        guarded.limited = self._cap_limit(tree)
+        if guarded.limited:
+            guarded.sql = tree.sql(dialect=self.dialect)
+        if self.engine.dialect.name != "snowflake" or self.max_scan_bytes is None:
+            return guarded
+
+        scan = self.explain(guarded.sql)
+        if scan is None:
+            return guarded
+        guarded.scan_bytes, table_bytes = scan
+        if self.sample and guarded.scan_bytes > self.max_scan_bytes and _sample_safe(tree):
+            guarded.sampled = self._sample_tables(tree, table_bytes)
+            if guarded.sampled:
+                guarded.sql = tree.sql(dialect=self.dialect)
+                guarded.scan_bytes = sum(min(size, self.sample_target_bytes) if name in guarded.sampled else size
+                                         for name, size in table_bytes.items())
+        if guarded.scan_bytes > self.max_scan_bytes:
+            guarded.rejected = (f"This query would scan about {format_bytes(guarded.scan_bytes)}, above the "
+                                f"{format_bytes(self.max_scan_bytes)} limit. Add filters so it reads less data.")
+        return guarded
+
+    def _cap_limit(self, tree: exp.Query) -> bool:
+        if isinstance(tree, exp.Select) and not tree.args.get("group") and _aggregates(tree):
+            return False  # a single row already
+        limit = tree.args.get("limit")
+        if isinstance(limit, exp.Fetch):
+            # FETCH FIRST n ROWS ONLY; a PERCENT or WITH TIES fetch has no row bound, so it is replaced
+            options = limit.args.get("limit_options")
+            value = None if options and (options.args.get("percent") or options.args.get("with_ties")) \
+                else limit.args.get("count")
+            if isinstance(value, exp.Literal) and value.is_int and int(value.this) <= self.preview_limit:
+                return False
+        elif limit is not None:
+            value = limit.expression
+            if not (isinstance(value, exp.Literal) and value.is_int) or int(value.this) <= self.preview_limit:
+                return False
+        tree.limit(self.preview_limit, copy=False)
+        return True
+
+    def _sample_tables(self, tree: exp.Query, table_bytes: Dict[str, int]) -> List[str]:
+        sampled = []
+        for table in tree.find_all(exp.Table):
+            size = table_bytes.get(table.name.upper())
+            if size is None or size <= self.sample_target_bytes or table.args.get("sample") is not None:
+                continue
+            percent = max(0.01, round(100 * self.sample_target_bytes / size, 2))
+            table.set("sample", exp.TableSample(method=exp.var("SYSTEM"), percent=exp.Literal.number(percent)))
+            sampled.append(table.name.upper())
+        return sampled
+
+    def explain(self, sql: str):
+        """(total bytes, {table name: bytes}) from Snowflake's plan, or None if it can't be explained."""
+        try:
+            with self.engine.connect() as conn:
+                plan = json.loads(conn.exec_driver_sql(f"EXPLAIN USING JSON {sql}").scalar())
+        except (sqlalchemy.exc.SQLAlchemyError, ValueError, TypeError):
+            return None
+        table_bytes = {}
+        for operation in (op for step in plan.get("Operations", []) for op in step):
+            if operation.get("operation") == "TableScan":
+                for name in operation.get("objects", []):
+                    short = name.split(".")[-1].strip('"').upper()
+                    table_bytes[short] = table_bytes.get(short, 0) + operation.get("bytesAssigned", 0)
+        return plan.get("GlobalStats", {}).get("bytesAssigned", 0), table_bytes
+
+
+def _aggregates(select: exp.Select) -> bool:
+    """
+    True if the SELECT list itself aggregates, so the query returns one row per group. Aggregates
+    in window functions or in subqueries (including CTEs) don't count.
+    """
+    for expression in select.expressions:
+        for agg in expression.find_all(exp.AggFunc):
+            node = agg
+            while node is not expression:
+                node = node.parent
+                if isinstance(node, (exp.Window, exp.Query)):
+                    break
+            else:
+                return True
+    return False
+
+
+def _sample_safe(tree: exp.Query) -> bool:
+    """
+    Sampling returns fewer rows; that only keeps the answer right if rows aren't combined, so
+    besides the SELECT list, window functions and aggregating subqueries rule it out too.
+    """
+    if not isinstance(tree, exp.Select):
+        return False
+    if tree.args.get("group") or tree.args.get("distinct") or _aggregates(tree):
+        return False
+    return not (tree.find(exp.Window) or any(query.find(exp.AggFunc) for query in tree.find_all(exp.Query)
+                                             if query is not tree))
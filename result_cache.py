@@ -0,0 +1,252 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+import numpy as np
+import pandas as pd
+import sqlglot
+from langchain.utilities.sql_database import truncate_word
+from sqlglot import exp
+from sqlglot.optimizer.normalize_identifiers import normalize_identifiers
+
+from result_store import ResultSet
+from schema_catalog import SchemaCatalog
+
+RESULT_CACHE_TTL_SECONDS = 10 * 60
+RESULT_CACHE_MAX_BYTES = 256 * 1024 ** 2
+RESULT_CACHE_MAX_ENTRIES = 500
+# results change on every run of these, so caching them would serve a stale value
+VOLATILE_FUNCTIONS = (exp.Rand, exp.CurrentTimestamp, exp.CurrentTime)
+VOLATILE_NAMES = {"RANDOM", "UUID_STRING", "SEQ1", "SEQ2", "SEQ4", "SEQ8", "RANDSTR", "NORMAL", "UNIFORM"}
+
+
+@dataclass
+class _Entry:
+    result_set: ResultSet
+    created_at: float
+    tables: Dict[str, Optional[str]]  # table name -> last_altered when stored
+    size: int
+
+
+class ResultCache:
+    """
+    Query results shared by the agent's sql_db_query and Execute SQL, keyed by the connection and
+    the SQL normalized for whitespace, keyword and (unquoted) identifier case.
+
+    Entries expire after `ttl`, are evicted least-recently-used once they hold more than
+    `max_bytes` of previews, and are dropped as soon as the schema catalog sees one of their tables
+    change (LAST_ALTERED on Snowflake). Only results small enough to stay in memory are cached;
+    with `disk_dir` set they are also written there as Parquet, so a restart or another worker
+    process starts warm.
+    """
+
+    def __init__(self, identity: str, dialect: str, catalog: Optional[SchemaCatalog] = None,
+                 ttl: int = RESULT_CACHE_TTL_SECONDS, max_bytes: int = RESULT_CACHE_MAX_BYTES,
+                 max_entries: int = RESULT_CACHE_MAX_ENTRIES, disk_dir: Optional[str] = None):
+        self.identity = identity
+        self.dialect = dialect
+        self.catalog = catalog
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if catalog is not None:
+            catalog.on_change(self._on_catalog_change)
+        if disk_dir is not None:
+            self._purge_disk()
+
+    # keys
+
+    def _parse(self, sql: str) -> Optional[exp.Expression]:
+        try:
+            tree = sqlglot.parse_one(sql, read=self.dialect)
+        except sqlglot.errors.ParseError:
+            return None
+        if not isinstance(tree, exp.Query) or tree.find(*VOLATILE_FUNCTIONS):
+            return None
+        if any(f.name.upper() in VOLATILE_NAMES for f in tree.find_all(exp.Anonymous)):
+            return None
+        return tree
+
+    def key(self, sql: str) -> Optional[str]:
+        """Cache key for `sql`, or None if it is not a deterministic query."""
+        tree = self._parse(sql)
+        if tree is None:
+            return None
+        normalized = normalize_identifiers(tree, dialect=self.dialect).sql(dialect=self.dialect)
+        return hashlib.sha256(f"{self.identity}\n{normalized}".encode("utf-8")).hexdigest()[:32]
+
+    def _tables(self, sql: str) -> Dict[str, Optional[str]]:
+        tree = self._parse(sql)
+        names = {t.name.lower() for t in tree.find_all(exp.Table)} if tree is not None else set()
+        versions = self._table_versions()
+        return {name: versions.get(name) for name in names}
+
+    def _table_versions(self) -> Dict[str, Optional[str]]:
+        if self.catalog is None:
+            return {}
+        return {name.lower(): entry.get("last_altered") for name, entry in self.catalog.snapshot().items()}
+
+    # reads and writes
+
+    def get(self, sql: str) -> Optional[ResultSet]:
+        key = self.key(sql)
+        if key is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None:
+            entry = self._read_disk(key)
+        if entry is not None and not self._fresh(entry):
+            self._drop(key)
+            entry = None
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return entry.result_set
+
+    def put(self, sql: str, result_set: ResultSet):
+        key = self.key(sql)
+        if key is None or result_set.spilled:
+            return
+        entry = _Entry(result_set=result_set, created_at=time.time(), tables=self._tables(sql),
+                       size=int(result_set.preview.memory_usage(deep=True).sum()))
+        self._insert(key, entry)
+        self._write_disk(key, entry)
+
+    def _fresh(self, entry: _Entry) -> bool:
+        if time.time() - entry.created_at > self.ttl:
+            return False
+        versions = self._table_versions()
+        return all(versions.get(name, altered) == altered for name, altered in entry.tables.items())
+
+    def _insert(self, key: str, entry: _Entry):
+        if entry.size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._bytes -= previous.size
+            self._entries[key] = entry
+            self._bytes += entry.size
+            while self._bytes > self.max_bytes or len(self._entries) > self.max_entries:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= evicted.size
+
+    def _drop(self, key: str):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._bytes -= entry.size
+        if self.disk_dir is not None:
+            for path in self._disk_paths(key):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def _on_catalog_change(self, catalog: SchemaCatalog):
+        versions = self._table_versions()
+        with self._lock:
+            stale = [key for key, entry in self._entries.items()
+                     if any(versions.get(name, altered) != altered for name, altered in entry.tables.items())]
+        for key in stale:
+            self._drop(key)
+
+    def clear(self):
+        with self._lock:
+            keys = list(self._entries)
+        for key in keys:
+            self._drop(key)
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    # disk
+
+    def _disk_paths(self, key: str):
+        return os.path.join(self.disk_dir, f"{key}.parquet"), os.path.join(self.disk_dir, f"{key}.json")
+
+    def _purge_disk(self):
+        if not os.path.isdir(self.disk_dir):
+            return
+        cutoff = time.time() - self.ttl
+        for name in os.listdir(self.disk_dir):
+            path = os.path.join(self.disk_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def _write_disk(self, key: str, entry: _Entry):
+        if self.disk_dir is None:
+            return
+        os.makedirs(self.disk_dir, exist_ok=True)
+        data_path, meta_path = self._disk_paths(key)
+        result_set = entry.result_set
+        try:
+            result_set.preview.to_parquet(data_path, index=False)
+        except (ValueError, TypeError, ImportError):
+            return  # e.g. mixed-type object columns; the in-memory entry still serves
+        with open(meta_path, "w") as f:
+            json.dump({"created_at": entry.created_at, "tables": entry.tables, "columns": result_set.columns,
+                       "row_count": result_set.row_count, "bytes_fetched": result_set.bytes_fetched}, f)
+
+    def _read_disk(self, key: str) -> Optional[_Entry]:
+        if self.disk_dir is None:
+            return None
+        data_path, meta_path = self._disk_paths(key)
+        try:
+            with open(meta_path, "r") as f:
+                meta = json.load(f)
+            preview = pd.read_parquet(data_path)
+        except (OSError, ValueError):
+            return None
+        result_set = ResultSet(columns=meta["columns"], preview=preview, row_count=meta["row_count"],
+                               bytes_fetched=meta["bytes_fetched"])
+        entry = _Entry(result_set=result_set, created_at=meta["created_at"], tables=meta["tables"],
+                       size=int(preview.memory_usage(deep=True).sum()))
+        if self._fresh(entry):
+            self._insert(key, entry)
+        return entry
+
+
+def render_rows(rows, max_string_length: int = 300) -> str:
+    """Rows rendered the way SQLDatabase.run renders a result for the agent."""
+    rendered = [tuple(truncate_word(v, length=max_string_length) for v in row) for row in rows]
+    return str(rendered) if rendered else ""
+
+
+def _python_value(value):
+    if isinstance(value, pd.Timestamp):
+        return value.to_pydatetime()
+    return value.item() if isinstance(value, np.generic) else value
+
+
+def format_rows(result_set: ResultSet, max_string_length: int = 300) -> str:
+    """
+    A cached preview rendered like the rows it was fetched from: pandas' NaN, NaT, Timestamps
+    and numpy scalars are turned back into None, datetimes and plain Python numbers first.
+    """
+    preview = result_set.preview.astype(object)
+    preview = preview.where(preview.notna(), None)
+    rows = ([_python_value(v) for v in row] for row in preview.itertuples(index=False, name=None))
+    return render_rows(rows, max_string_length)
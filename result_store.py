@@ -0,0 +1,203 @@
+import os
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+PREVIEW_ROWS = 1000
+FETCH_BATCH_ROWS = 10000
+PAGE_SIZE = 1000
+SPILL_DIR = os.path.join(tempfile.gettempdir(), "kai_results")
+SPILL_MAX_AGE_SECONDS = 6 * 3600
+
+
+@dataclass
+class ResultSet:
+    """
+    A query result that keeps at most `preview` rows in memory.
+    Anything larger is spilled to an Arrow IPC file and paged back through a memory map,
+    so the full result never has to be materialised in the Streamlit worker.
+    """
+    columns: List[str]
+    preview: pd.DataFrame
+    row_count: int = 0
+    bytes_fetched: int = 0
+    path: Optional[str] = None
+    _parquet_path: Optional[str] = field(default=None, repr=False)
+
+    @property
+    def spilled(self) -> bool:
+        return self.path is not None
+
+    @property
+    def page_count(self) -> int:
+        return max(1, -(-self.row_count // PAGE_SIZE))
+
+    def page(self, page: int, page_size: int = PAGE_SIZE) -> pd.DataFrame:
+        start = page * page_size
+        if not self.spilled:
+            return self.preview.iloc[start:start + page_size]
+        with pa.memory_map(self.path, "r") as source:
+            table = pa.ipc.open_file(source).read_all()
+            return table.slice(start, page_size).to_pandas()
+
+    def parquet_path(self) -> str:
+        """Compressed copy of the full result for download, written batch by batch."""
+        if self._parquet_path and os.path.exists(self._parquet_path):
+            return self._parquet_path
+        self._parquet_path = _spill_path(".parquet")
+        if not self.spilled:
+            pq.write_table(pa.Table.from_pandas(self.preview, preserve_index=False), self._parquet_path)
+            return self._parquet_path
+        with pa.memory_map(self.path, "r") as source:
+            reader = pa.ipc.open_file(source)
+            with pq.ParquetWriter(self._parquet_path, reader.schema) as writer:
+                for i in range(reader.num_record_batches):
+                    writer.write_batch(reader.get_batch(i))
+        return self._parquet_path
+
+    def cleanup(self):
+        for path in (self.path, self._parquet_path):
+            if path and os.path.exists(path):
+                os.remove(path)
+
+
+def _spill_path(suffix: str) -> str:
+    os.makedirs(SPILL_DIR, exist_ok=True)
+    return os.path.join(SPILL_DIR, f"{uuid.uuid4().hex}{suffix}")
+
+
+def purge_spill_dir(max_age: int = SPILL_MAX_AGE_SECONDS):
+    if not os.path.isdir(SPILL_DIR):
+        return
+    cutoff = time.time() - max_age
+    for name in os.listdir(SPILL_DIR):
+        path = os.path.join(SPILL_DIR, name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def _to_batch(rows, columns: List[str]) -> pa.RecordBatch:
+    df = pd.DataFrame.from_records(rows, columns=columns)
+    try:
+        return pa.RecordBatch.from_pandas(df, preserve_index=False)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # mixed Python types in one column (e.g. VARIANT values); keep them as strings
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = df[column].map(lambda v: None if v is None else str(v))
+        return pa.RecordBatch.from_pandas(df, preserve_index=False)
+
+
+def _common_type(a: pa.DataType, b: pa.DataType) -> pa.DataType:
+    """The type both batches' values fit in: NULL takes the other type, int64 and float64 widen
+    to float64, and anything without a common type becomes a string."""
+    if a == b or pa.types.is_null(b):
+        return a
+    if pa.types.is_null(a):
+        return b
+    try:
+        return pa.unify_schemas([pa.schema([("c", a)]), pa.schema([("c", b)])],
+                                promote_options="permissive").field("c").type
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pa.string()
+
+
+def _common_schema(a: pa.Schema, b: pa.Schema) -> pa.Schema:
+    return pa.schema([pa.field(fa.name, _common_type(fa.type, fb.type)) for fa, fb in zip(a, b)])
+
+
+def _cast(batch: pa.RecordBatch, schema: pa.Schema) -> pa.RecordBatch:
+    if batch.schema == schema:
+        return batch
+    return pa.RecordBatch.from_arrays([col.cast(f.type) for col, f in zip(batch.columns, schema)], schema=schema)
+
+
+def _respill(path: str, schema: pa.Schema):
+    """Copy the spilled batches into a new file with the wider `schema`; returns its path and open writer."""
+    new_path = _spill_path(".arrow")
+    writer = pa.ipc.new_file(new_path, schema)
+    with pa.memory_map(path, "r") as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            writer.write_batch(_cast(reader.get_batch(i), schema))
+    os.remove(path)
+    return new_path, writer
+
+
+def fetch_result(result, preview_rows: int = PREVIEW_ROWS, batch_rows: int = FETCH_BATCH_ROWS) -> ResultSet:
+    """
+    Drain a SQLAlchemy result in batches of `batch_rows`. Small results stay in memory;
+    once more than `preview_rows` rows arrive the batches are streamed to disk.
+    A column whose type changes between batches is widened to a type that holds both.
+    """
+    columns = list(result.keys())
+    schema = None
+    buffered = []
+    writer = None
+    path = None
+    row_count = 0
+    bytes_fetched = 0
+    try:
+        while True:
+            rows = result.fetchmany(batch_rows)
+            if not rows:
+                break
+            batch = _to_batch(rows, columns)
+            if schema is None:
+                schema = batch.schema
+            elif batch.schema != schema:
+                widened = _common_schema(schema, batch.schema)
+                if widened != schema:
+                    schema = widened
+                    buffered = [_cast(b, schema) for b in buffered]
+                    if writer is not None:
+                        writer.close()
+                        path, writer = _respill(path, schema)
+                batch = _cast(batch, schema)
+            row_count += batch.num_rows
+            bytes_fetched += batch.nbytes
+            if writer is None:
+                buffered.append(batch)
+                if row_count > preview_rows:
+                    purge_spill_dir()
+                    path = _spill_path(".arrow")
+                    writer = pa.ipc.new_file(path, schema)
+                    for b in buffered:
+                        writer.write_batch(b)
+            else:
+                writer.write_batch(batch)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    if buffered:
+        preview = pa.Table.from_batches(buffered, schema=schema).slice(0, preview_rows).to_pandas()
+    else:
+        preview = pd.DataFrame(columns=columns)
+    return ResultSet(columns=columns, preview=preview, row_count=row_count,
+                     bytes_fetched=bytes_fetched, path=path)
+
+
+def rows_result(rows, columns: List[str]) -> ResultSet:
+    """An in-memory ResultSet of rows already fetched; raises pyarrow's errors for values Arrow can't hold."""
+    if not rows:
+        return ResultSet(columns=columns, preview=pd.DataFrame(columns=columns))
+    batch = _to_batch(rows, columns)
+    return ResultSet(columns=columns, preview=batch.to_pandas(), row_count=batch.num_rows, bytes_fetched=batch.nbytes)
+
+
+def format_bytes(n: int) -> str:
+    for unit in ("B", "KB", "MB", "GB"):
+        if n < 1024:
+            return f"{n:.0f} {unit}" if unit == "B" else f"{n:.1f} {unit}"
+        n /= 1024
+    return f"{n:.1f} TB"
@@ -0,0 +1,200 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+import sqlalchemy
+from sqlalchemy import MetaData, Table, select
+from sqlalchemy.schema import CreateTable
+
+from settings import CACHE_DIR
+
+CATALOG_DIR = os.path.join(CACHE_DIR, "schema_catalog")
+CATALOG_TTL_SECONDS = 15 * 60
+SAMPLE_ROWS = 3
+# bumped when entries gain fields, so catalogs written by older code are described again
+CATALOG_VERSION = 2
+
+
+class SchemaCatalog:
+    """
+    Local, on-disk copy of the warehouse metadata the agent asks for: table names, columns,
+    types and a few sample rows per table, rendered the same way SQLDatabase.get_table_info does.
+
+    Reads never wait on the warehouse once the catalog has been built. A stale catalog is served
+    while a background thread refreshes it; on Snowflake only tables whose LAST_ALTERED changed
+    are described again, other dialects re-describe everything once the TTL expires.
+    """
+
+    def __init__(self, engine: sqlalchemy.engine.Engine, key: str, schema: Optional[str] = None,
+                 ttl: int = CATALOG_TTL_SECONDS, sample_rows: int = SAMPLE_ROWS):
+        self.engine = engine
+        self.schema = schema
+        self.ttl = ttl
+        self.sample_rows = sample_rows
+        self.path = os.path.join(CATALOG_DIR, f"{key}.json")
+        self.refreshed_at = 0.0
+        self.refresh_count = 0
+        self._tables: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._listeners = []
+        self._load()
+
+    # persistence
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            if data.get("version") != CATALOG_VERSION:
+                return
+            self._tables = data["tables"]
+            self.refreshed_at = data["refreshed_at"]
+        except (ValueError, KeyError, OSError):
+            self._tables = {}
+
+    def _save(self):
+        os.makedirs(CATALOG_DIR, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": CATALOG_VERSION, "refreshed_at": self.refreshed_at, "tables": self._tables}, f)
+        os.replace(tmp_path, self.path)
+
+    # warehouse metadata
+
+    def _remote_tables(self) -> Dict[str, Optional[str]]:
+        """Table name -> last-altered timestamp (None where the dialect has no such column)."""
+        if self.engine.dialect.name == "snowflake":
+            sql = ("SELECT table_name, last_altered FROM information_schema.tables "
+                   "WHERE table_schema = CURRENT_SCHEMA()")
+            with self.engine.connect() as conn:
+                rows = conn.exec_driver_sql(sql).fetchall()
+            # snowflake-sqlalchemy reports case-insensitive identifiers in lower case
+            return {self.engine.dialect.normalize_name(name): str(altered) for name, altered in rows}
+        inspector = sqlalchemy.inspect(self.engine)
+        names = inspector.get_table_names(schema=self.schema) + inspector.get_view_names(schema=self.schema)
+        return {name: None for name in names}
+
+    def _describe(self, name: str, last_altered: Optional[str]) -> dict:
+        table = Table(name, MetaData(), autoload_with=self.engine, schema=self.schema)
+        create = str(CreateTable(table).compile(self.engine)).rstrip()
+        with self.engine.connect() as conn:
+            rows = conn.execute(select(table).limit(self.sample_rows)).fetchall()
+        column_names = [c.name for c in table.columns]
+        sample = [[str(v)[:100] for v in row] for row in rows]
+        sample_text = "\n".join("\t".join(row) for row in sample)
+        info = (f"{create}\n\n/*\n{self.sample_rows} rows from {name} table:\n"
+                f"{chr(9).join(column_names)}\n{sample_text}\n*/")
+        # names as the warehouse stores them (Snowflake: case-insensitive ones in upper case), which
+        # the reflected, normalized names above no longer tell apart
+        dialect = self.engine.dialect
+        stored_name = dialect.denormalize_name if dialect.requires_name_normalize else str
+        return {
+            "stored_name": stored_name(name),
+            "columns": [{"name": c.name, "stored_name": stored_name(c.name), "type": str(c.type),
+                         "nullable": bool(c.nullable)} for c in table.columns],
+            "sample_rows": sample,
+            "last_altered": last_altered,
+            "info": info,
+        }
+
+    # refresh
+
+    def refresh(self, force: bool = False, blocking: bool = False) -> bool:
+        """Returns False if another thread is already refreshing and `blocking` is not set."""
+        if not self._refresh_lock.acquire(blocking=blocking):
+            return False
+        try:
+            expired = force or time.time() - self.refreshed_at > self.ttl
+            remote = self._remote_tables()
+            tables = {}
+            changed = False
+            for name, last_altered in remote.items():
+                cached = self._tables.get(name)
+                unchanged = cached is not None and (
+                    last_altered == cached["last_altered"] if last_altered is not None else not expired)
+                if unchanged:
+                    tables[name] = cached
+                    continue
+                try:
+                    tables[name] = self._describe(name, last_altered)
+                    changed = True
+                except sqlalchemy.exc.SQLAlchemyError:
+                    if cached is not None:
+                        tables[name] = cached
+            changed = changed or set(tables) != set(self._tables)
+            with self._lock:
+                self._tables = tables
+                self.refreshed_at = time.time()
+                self.refresh_count += 1
+            self._save()
+            if changed:
+                for listener in self._listeners:
+                    listener(self)
+            return True
+        finally:
+            self._refresh_lock.release()
+
+    def refresh_in_background(self):
+        threading.Thread(target=self.refresh, name="kai-schema-catalog", daemon=True).start()
+
+    def ensure_fresh(self):
+        if not self._tables:
+            self.refresh(blocking=True)
+        elif time.time() - self.refreshed_at > self.ttl:
+            self.refresh_in_background()
+
+    def on_change(self, listener):
+        """Register a callable(catalog) run after a refresh that changed the catalog."""
+        self._listeners.append(listener)
+
+    # reads
+
+    @property
+    def fingerprint(self) -> str:
+        with self._lock:
+            items = sorted((name, t["last_altered"], json.dumps(t["columns"])) for name, t in self._tables.items())
+        return hashlib.sha256(json.dumps(items).encode("utf-8")).hexdigest()[:16]
+
+    def snapshot(self) -> Dict[str, dict]:
+        """Current entries without triggering a refresh (safe to call from change listeners)."""
+        with self._lock:
+            return dict(self._tables)
+
+    def list_tables(self) -> List[str]:
+        self.ensure_fresh()
+        with self._lock:
+            return sorted(self._tables)
+
+    def table(self, name: str) -> Optional[dict]:
+        self.ensure_fresh()
+        with self._lock:
+            return self._tables.get(name)
+
+    def table_info(self, table_names: List[str]) -> str:
+        self.ensure_fresh()
+        infos = []
+        missing = []
+        for name in table_names:
+            with self._lock:
+                entry = self._tables.get(name)
+            if entry is None:
+                missing.append(name)
+            else:
+                infos.append(entry["info"])
+        if missing:
+            # possibly created since the last refresh; the next call will see it
+            self.refresh_in_background()
+            return f"Error: table_names {set(missing)} not found in database"
+        return "\n\n".join(infos)
+
+
+def catalog_key(conn_string: str) -> str:
+    # the password is left out so rotating credentials keeps the catalog
+    url = sqlalchemy.engine.make_url(conn_string).set(password=None)
+    return hashlib.sha256(str(url).encode("utf-8")).hexdigest()[:16]
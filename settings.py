@@ -0,0 +1,4 @@
+import os
+
+# local state (schema catalog, caches, spilled results) lives here; override per deployment
+CACHE_DIR = os.environ.get("KAI_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache"))
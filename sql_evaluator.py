@@ -0,0 +1,160 @@
+import hashlib
+import os
+import re
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+import sqlglot
+
+from query_guard import sqlglot_dialect
+from settings import CACHE_DIR
+from sql_execution import extract_sql_blocks
+
+EVAL_RESULTS_DIR = os.path.join(CACHE_DIR, "eval_results")
+EVAL_ROW_LIMIT = 10000
+RTOL = 1e-6
+# share of SQL cases that must return the reference result for a validation run to pass
+EXECUTION_PASS_RATE = 0.8
+ATOL = 1e-9
+
+# answers also carry SQL inline ("```sql SELECT ... ```") or with no fence at all; an unfenced
+# statement must start a line with an upper-case keyword, so prose like "I can help with that"
+# or "Select a table" is not taken for SQL. It ends at a semicolon, a blank line or the end.
+INLINE_SQL_PATTERN = re.compile(r"```sql\s+(.*?)(?:```|$)", re.DOTALL | re.IGNORECASE)
+BARE_SQL_PATTERN = re.compile(r"^[ \t]*((?:WITH\s+\S+\s+AS\s*\(|SELECT\s).+?)(?:;|\n[ \t]*\n|\Z)",
+                              re.DOTALL | re.MULTILINE)
+
+
+def extract_sql(text: str) -> Optional[str]:
+    for candidates in (extract_sql_blocks(text), INLINE_SQL_PATTERN.findall(text), BARE_SQL_PATTERN.findall(text)):
+        for sql in candidates:
+            sql = sql.strip().rstrip(";").strip()
+            if sql:
+                return sql
+    return None
+
+
+def normalize_sql(sql: str, dialect: Optional[str] = None) -> str:
+    """
+    Canonical form of a query for cache keys: sqlglot's rendering without comments, so layout and
+    keyword case don't matter but string literals do. Only used as a key, never executed.
+    """
+    sql = sql.strip().rstrip(";").strip()
+    try:
+        return ";\n".join(e.sql(dialect=dialect, comments=False) for e in sqlglot.parse(sql, read=dialect) if e)
+    except sqlglot.errors.SqlglotError:
+        return sql
+
+
+class ExecutionEvaluator:
+    """
+    Scores a prediction by running its SQL and the reference SQL and comparing the result sets:
+    1.0 when they hold the same rows (in any order, columns matched by content rather than alias,
+    numbers within tolerance), 0.0 otherwise.
+
+    Query results are cached on disk by SQL hash, so re-scoring costs no warehouse time.
+    Cases without SQL on either side go to `llm_fallback` (a LangChain string-pair evaluator)
+    when one is given.
+    """
+
+    def __init__(self, engine: sqlalchemy.engine.Engine, llm_fallback=None, row_limit: int = EVAL_ROW_LIMIT):
+        self.engine = engine
+        self.llm_fallback = llm_fallback
+        self.row_limit = row_limit
+        self.dialect = sqlglot_dialect(engine)
+        self._cache_scope = str(engine.url.set(password=None))
+
+    def _cache_path(self, sql: str) -> str:
+        digest = hashlib.sha256(f"{self._cache_scope}\n{normalize_sql(sql, self.dialect)}".encode("utf-8")).hexdigest()
+        return os.path.join(EVAL_RESULTS_DIR, f"{digest}.parquet")
+
+    def run_query(self, sql: str) -> pd.DataFrame:
+        path = self._cache_path(sql)
+        if os.path.exists(path):
+            return pd.read_parquet(path)
+        with self.engine.connect() as conn:
+            # as written: comments and string literals are part of what the query does
+            result = conn.exec_driver_sql(sql.strip().rstrip(";"))
+            df = pd.DataFrame(result.fetchmany(self.row_limit), columns=list(result.keys()))
+        os.makedirs(EVAL_RESULTS_DIR, exist_ok=True)
+        # parquet needs string column names and homogeneous object columns; return the stored
+        # form so a fresh result and a cached one compare the same way
+        df.columns = [str(c) for c in df.columns]
+        for column in df.columns:
+            if df[column].dtype == object:
+                df[column] = df[column].map(lambda v: None if v is None else str(v))
+        df.to_parquet(path, index=False)
+        return df
+
+    def evaluate(self, prediction: str, reference_sql: Optional[str] = None, reference_answer: str = "",
+                 question: str = "") -> dict:
+        predicted_sql = extract_sql(prediction)
+        if predicted_sql and reference_sql:
+            try:
+                predicted = self.run_query(predicted_sql)
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                return {"score": 0.0, "method": "execution", "reasoning": f"Predicted SQL failed: {e}"}
+            try:
+                expected = self.run_query(reference_sql)
+            except sqlalchemy.exc.SQLAlchemyError as e:
+                # not the prediction's fault; kept out of the execution accuracy
+                return {"score": None, "method": "reference_failed", "reasoning": f"Reference SQL failed: {e}"}
+            match = results_match(predicted, expected)
+            return {"score": 1.0 if match else 0.0, "method": "execution",
+                    "reasoning": "Result sets match" if match else "Result sets differ"}
+        if self.llm_fallback is not None:
+            evaluation = self.llm_fallback.evaluate_string_pairs(
+                prediction=prediction, prediction_b=reference_answer, input=question)
+            return {**evaluation, "method": "llm"}
+        return {"score": None, "method": "none", "reasoning": "No SQL to execute"}
+
+
+def _canonical(df: pd.DataFrame) -> pd.DataFrame:
+    """Numbers as float64, everything else as strings, so frames from both queries compare."""
+    out = {}
+    for i, column in enumerate(df.columns):
+        values = df.iloc[:, i]
+        numeric = pd.to_numeric(values, errors="coerce")
+        if numeric.notna().sum() == values.notna().sum():
+            out[i] = numeric.astype("float64")
+        else:
+            out[i] = values.astype(str)
+    return pd.DataFrame(out)
+
+
+def _columns_equal(a: pd.Series, b: pd.Series) -> bool:
+    if a.dtype == np.float64 and b.dtype == np.float64:
+        return bool(np.all(np.isclose(a.to_numpy(), b.to_numpy(), rtol=RTOL, atol=ATOL, equal_nan=True)))
+    return bool(np.array_equal(a.astype(str).to_numpy(), b.astype(str).to_numpy()))
+
+
+def _sorted_rows(df: pd.DataFrame) -> pd.DataFrame:
+    return df.sort_values(by=list(df.columns), kind="mergesort", na_position="last").reset_index(drop=True)
+
+
+def results_match(predicted: pd.DataFrame, expected: pd.DataFrame) -> bool:
+    """
+    True if `predicted` holds the rows of `expected`. Extra predicted columns are allowed;
+    each expected column is paired with the first unused predicted column holding the same values.
+    """
+    if len(predicted) != len(expected) or predicted.shape[1] < expected.shape[1]:
+        return False
+    predicted, expected = _canonical(predicted), _canonical(expected)
+    pairing = []
+    for e in expected.columns:
+        expected_values = expected[e].sort_values(kind="mergesort").reset_index(drop=True)
+        for p in predicted.columns:
+            if p in pairing:
+                continue
+            candidate = predicted[p].sort_values(kind="mergesort").reset_index(drop=True)
+            if candidate.dtype == expected_values.dtype and _columns_equal(candidate, expected_values):
+                pairing.append(p)
+                break
+        else:
+            return False
+    aligned = predicted[pairing]
+    aligned.columns = expected.columns
+    aligned, expected = _sorted_rows(aligned), _sorted_rows(expected)
+    return all(_columns_equal(aligned[c], expected[c]) for c in expected.columns)
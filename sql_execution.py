@@ -0,0 +1,162 @@
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError as FutureTimeoutError
+from dataclasses import dataclass
+from typing import Iterator, List, Optional
+
+import pandas as pd
+import sqlalchemy
+import streamlit as st
+
+from result_cache import ResultCache
+from result_store import ResultSet, fetch_result
+
+SQL_BLOCK_PATTERN = re.compile(r"```sql\n(.*?)\n```", re.DOTALL)
+
+# user-triggered execution gets its own bounded pool so "Execute SQL" clicks never
+# starve the agent's connections (and vice versa)
+POOL_SIZE = 4
+MAX_OVERFLOW = 4
+POOL_TIMEOUT_SECONDS = 30
+MAX_WORKERS = 8
+STATEMENT_TIMEOUT_SECONDS = 120
+
+
+def extract_sql_blocks(message: str) -> List[str]:
+    return SQL_BLOCK_PATTERN.findall(message)
+
+
+@st.cache_resource(show_spinner=False)
+def get_execution_engine(conn_string: str) -> sqlalchemy.engine.Engine:
+    if sqlalchemy.engine.make_url(conn_string).get_backend_name() == "sqlite":
+        # local fixtures: SQLite picks its own pool class
+        return sqlalchemy.create_engine(conn_string)
+    return sqlalchemy.create_engine(
+        conn_string,
+        pool_size=POOL_SIZE,
+        max_overflow=MAX_OVERFLOW,
+        pool_timeout=POOL_TIMEOUT_SECONDS,
+        pool_pre_ping=True,
+        pool_recycle=3600,
+    )
+
+
+@st.cache_resource(show_spinner=False)
+def get_execution_pool() -> ThreadPoolExecutor:
+    return ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="kai-sql")
+
+
+@dataclass
+class StatementResult:
+    sql: str
+    result_set: Optional[ResultSet] = None
+    error: Optional[str] = None
+    elapsed: float = 0.0
+    cancelled: bool = False
+    cached: bool = False
+
+    @property
+    def df(self) -> Optional[pd.DataFrame]:
+        return self.result_set.preview if self.result_set is not None else None
+
+
+class StatementJob:
+    """
+    A single statement running on the shared execution pool.
+    The timeout is enforced server-side where the dialect supports it (Snowflake) and
+    client-side by the caller waiting on the job; cancel() aborts it either way.
+    With a `cache`, a fresh cached result is returned without touching the warehouse.
+    """
+
+    def __init__(self, sql: str, engine: sqlalchemy.engine.Engine, timeout: int = STATEMENT_TIMEOUT_SECONDS,
+                 cache: ResultCache = None):
+        self.sql = sql
+        self.engine = engine
+        self.timeout = timeout
+        self.cache = cache
+        self.future = None
+        self._cancelled = threading.Event()
+        self._session_id = None
+        self._dbapi_connection = None
+
+    def run(self) -> StatementResult:
+        started = time.perf_counter()
+        if self._cancelled.is_set():
+            return StatementResult(self.sql, cancelled=True)
+        cached = self.cache.get(self.sql) if self.cache is not None else None
+        if cached is not None:
+            return StatementResult(self.sql, result_set=cached, elapsed=time.perf_counter() - started, cached=True)
+        try:
+            with self.engine.connect() as conn:
+                self._dbapi_connection = conn.connection.dbapi_connection
+                if self.engine.dialect.name == "snowflake":
+                    self._session_id = getattr(self._dbapi_connection, "session_id", None)
+                    conn.exec_driver_sql(f"ALTER SESSION SET STATEMENT_TIMEOUT_IN_SECONDS = {int(self.timeout)}")
+                result = conn.exec_driver_sql(self.sql)
+                result_set = fetch_result(result)
+            if self.cache is not None:
+                self.cache.put(self.sql, result_set)
+            return StatementResult(self.sql, result_set=result_set, elapsed=time.perf_counter() - started)
+        except Exception as e:
+            return StatementResult(self.sql, error=str(e), elapsed=time.perf_counter() - started,
+                                   cancelled=self._cancelled.is_set())
+        finally:
+            self._dbapi_connection = None
+
+    def cancel(self):
+        self._cancelled.set()
+        if self.future is not None and self.future.cancel():
+            return
+        if self._session_id is not None:
+            # the running connection is blocked in execute, so cancel from a second one
+            try:
+                with self.engine.connect() as conn:
+                    conn.exec_driver_sql(f"SELECT SYSTEM$CANCEL_ALL_QUERIES({int(self._session_id)})")
+            except Exception:
+                pass
+        elif self._dbapi_connection is not None and hasattr(self._dbapi_connection, "cancel"):
+            self._dbapi_connection.cancel()
+
+    def done(self) -> bool:
+        return self.future is not None and self.future.done()
+
+    def result(self) -> StatementResult:
+        if self.future.cancelled() or not self.future.done():
+            return StatementResult(self.sql, error="Statement was cancelled or timed out", cancelled=True)
+        return self.future.result()
+
+
+def submit_statements(statements: List[str], engine: sqlalchemy.engine.Engine,
+                      timeout: int = STATEMENT_TIMEOUT_SECONDS, cache: ResultCache = None) -> List[StatementJob]:
+    pool = get_execution_pool()
+    jobs = [StatementJob(sql, engine, timeout, cache) for sql in statements]
+    for job in jobs:
+        job.future = pool.submit(job.run)
+    return jobs
+
+
+def iter_completed(jobs: List[StatementJob], timeout: int = STATEMENT_TIMEOUT_SECONDS) -> Iterator[StatementJob]:
+    """
+    Yield jobs in the order they finish. Anything still running after the wall-clock
+    timeout is cancelled and yielded last.
+    """
+    futures = {job.future: job for job in jobs}
+    try:
+        for future in as_completed(futures, timeout=timeout):
+            yield futures.pop(future)
+    except FutureTimeoutError:
+        for job in futures.values():
+            job.cancel()
+        for future, job in futures.items():
+            try:
+                future.result(timeout=5)
+            except Exception:
+                pass
+            yield job
+
+
+def cancel_jobs(jobs: List[StatementJob]):
+    for job in jobs:
+        if not job.done():
+            job.cancel()
@@ -0,0 +1,138 @@
+from typing import List, Optional
+
+import pyarrow as pa
+import sqlalchemy
+from langchain.agents.agent_toolkits import SQLDatabaseToolkit
+from langchain.callbacks.manager import CallbackManagerForToolRun
+from langchain.tools import BaseTool
+from langchain.tools.sql_database.tool import InfoSQLDatabaseTool, ListSQLDatabaseTool, QuerySQLDataBaseTool
+
+from local_engine import LocalTableEngine
+from query_guard import QueryGuard
+from result_cache import ResultCache, format_rows, render_rows
+from result_store import PREVIEW_ROWS, rows_result
+from schema_catalog import SchemaCatalog
+from sql_validator import SQLValidator
+
+
+class CatalogListTablesTool(ListSQLDatabaseTool):
+    """sql_db_list_tables answered from the local schema catalog."""
+    catalog: SchemaCatalog
+
+    def _run(self, tool_input: str = "", run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        return ", ".join(self.catalog.list_tables())
+
+
+class CatalogInfoTool(InfoSQLDatabaseTool):
+    """sql_db_schema answered from the local schema catalog."""
+    catalog: SchemaCatalog
+
+    def _run(self, table_names: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        return self.catalog.table_info([t.strip() for t in table_names.split(",")])
+
+
+class GuardedQueryTool(QuerySQLDataBaseTool):
+    """
+    sql_db_query that checks identifiers against the catalog, then applies the row limit and
+    scan-size check, before anything reaches the warehouse. With a cache, results are shared
+    with Execute SQL and other sessions. With a local engine, queries that only read tables
+    loaded there run locally instead.
+    """
+    guard: Optional[QueryGuard] = None
+    validator: Optional[SQLValidator] = None
+    cache: Optional[ResultCache] = None
+    local: Optional[LocalTableEngine] = None
+
+    @property
+    def _max_rows(self) -> int:
+        # the agent only reads a preview; the guard has usually limited warehouse queries to this already
+        return self.guard.preview_limit if self.guard is not None else PREVIEW_ROWS
+
+    def _fetch(self, engine: sqlalchemy.engine.Engine, query: str):
+        """(columns, rows) of the query, fetching at most one row more than the agent is shown."""
+        with engine.connect() as conn:
+            result = conn.exec_driver_sql(query)
+            columns = list(result.keys())
+            rows = result.fetchmany(self._max_rows + 1) if result.returns_rows else []
+        return columns, rows
+
+    def _execute_local(self, query: str) -> Optional[str]:
+        route = self.local.route(query)
+        if not route.local:
+            return None
+        try:
+            _, rows = self._fetch(self.local.engine, route.sql)
+        except sqlalchemy.exc.SQLAlchemyError:
+            return None  # e.g. a function SQLite lacks; the warehouse gets the original query
+        self.local.local_queries += 1
+        return render_rows(rows[:self._max_rows], self.db._max_string_length)
+
+    def _execute(self, query: str) -> str:
+        """The result as run_no_throw renders it, read from or stored in the cache when there is one."""
+        if self.cache is None or self.cache.key(query) is None:
+            return self.db.run_no_throw(query)
+        result_set = self.cache.get(query)
+        if result_set is not None:
+            return format_rows(result_set, self.db._max_string_length)
+        try:
+            columns, rows = self._fetch(self.db._engine, query)
+        except sqlalchemy.exc.SQLAlchemyError as e:
+            return f"Error: {e}"
+        # a cut-off result must not be served later as the whole one
+        if len(rows) <= self._max_rows:
+            try:
+                self.cache.put(query, rows_result(rows, columns))
+            except (pa.ArrowException, ValueError, TypeError):
+                pass  # values Arrow can't hold are still answered, just not cached
+        return render_rows(rows[:self._max_rows], self.db._max_string_length)
+
+    def _run(self, query: str, run_manager: Optional[CallbackManagerForToolRun] = None) -> str:
+        note = ""
+        if self.validator is not None:
+            validation = self.validator.validate(query)
+            if not validation.ok:
+                return validation.message()
+            if validation.fixes:
+                # the agent should quote its final SQL the same way
+                note = f"Ran with corrected identifiers ({'; '.join(validation.fixes)}):\n{validation.sql}\n\n"
+                query = validation.sql
+        if self.local is not None:
+            output = self._execute_local(query)
+            if output is not None:
+                return note + output
+            self.local.warehouse_queries += 1
+        if self.guard is not None:
+            guarded = self.guard.check(query)
+            if guarded.rejected:
+                return f"Error: {guarded.rejected}"
+            query = guarded.sql
+        return note + self._execute(query)
+
+
+class KaiSQLDatabaseToolkit(SQLDatabaseToolkit):
+    """
+    SQLDatabaseToolkit whose metadata tools read from a SchemaCatalog instead of the warehouse,
+    and whose query tool goes through an SQLValidator, a QueryGuard, a ResultCache and a LocalTableEngine
+    when they are given.
+    Tool names and descriptions are kept, so the agent prompts don't change.
+    """
+    catalog: Optional[SchemaCatalog] = None
+    guard: Optional[QueryGuard] = None
+    validator: Optional[SQLValidator] = None
+    cache: Optional[ResultCache] = None
+    local: Optional[LocalTableEngine] = None
+
+    def get_tools(self) -> List[BaseTool]:
+        tools = super().get_tools()
+        swapped = []
+        for tool in tools:
+            guarded = any(x is not None for x in (self.guard, self.validator, self.cache, self.local))
+            if guarded and isinstance(tool, QuerySQLDataBaseTool):
+                tool = GuardedQueryTool(db=self.db, guard=self.guard, validator=self.validator, cache=self.cache,
+                                        local=self.local, description=tool.description)
+            elif self.catalog is not None and isinstance(tool, ListSQLDatabaseTool):
+                tool = CatalogListTablesTool(db=self.db, catalog=self.catalog, description=tool.description)
+            elif self.catalog is not None and isinstance(tool, InfoSQLDatabaseTool):
+                tool = CatalogInfoTool(db=self.db, catalog=self.catalog, description=tool.description)
+            swapped.append(tool)
+        return swapped
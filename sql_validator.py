@@ -0,0 +1,190 @@
+import difflib
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import sqlglot
+from sqlglot import exp
+
+from schema_catalog import SchemaCatalog
+
+# sources whose columns the catalog can't know; unresolved columns are left to the warehouse then
+DERIVED_SOURCES = (exp.Subquery, exp.Lateral, exp.Unnest, exp.UDTF)
+
+
+@dataclass
+class ValidationResult:
+    sql: str
+    errors: List[str] = field(default_factory=list)
+    fixes: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+    def message(self) -> str:
+        return "Error: " + " ".join(self.errors)
+
+
+class SQLValidator:
+    """
+    Checks the agent's SQL against the schema catalog before it is sent to the warehouse.
+
+    Table and column identifiers are resolved the way Snowflake would: unquoted names match
+    the upper-cased stored name, quoted names match exactly. Where a name only fails on case or
+    quoting and exactly one stored name fits, it is rewritten to the quoted stored name; names
+    that don't exist come back as errors listing what does. Other dialects compare names
+    case-insensitively and only report missing ones.
+
+    Statements sqlglot can't parse are passed through unchanged, so a parser gap never blocks
+    a valid query. Every rewritten or rejected statement is a failed warehouse call saved.
+    """
+
+    def __init__(self, catalog: SchemaCatalog, dialect: str = "snowflake"):
+        self.catalog = catalog
+        self.dialect = dialect
+        self.case_sensitive = dialect == "snowflake"
+        self.checked = 0
+        self.fixed = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    @property
+    def saved_calls(self) -> int:
+        return self.fixed + self.rejected
+
+    def validate(self, sql: str) -> ValidationResult:
+        result = ValidationResult(sql=sql)
+        try:
+            statements = [s for s in sqlglot.parse(sql, read=self.dialect) if s is not None]
+        except sqlglot.errors.ParseError:
+            return result
+        self.catalog.ensure_fresh()
+        tables = self.catalog.snapshot()
+        for statement in statements:
+            if isinstance(statement, exp.Query):
+                self._check_statement(statement, tables, result)
+        if result.fixes and any(s.find(exp.Lateral, exp.UDTF) for s in statements):
+            # sqlglot writes out the implicit column list of table functions; leave those statements as they are
+            result.fixes = []
+        if result.fixes and not result.errors:
+            result.sql = ";\n".join(s.sql(dialect=self.dialect) for s in statements)
+        with self._lock:
+            self.checked += 1
+            if result.errors:
+                self.rejected += 1
+            elif result.fixes:
+                self.fixed += 1
+        if any("does not exist" in e for e in result.errors):
+            # possibly created since the last refresh; the next call will see it
+            self.catalog.refresh_in_background()
+        return result
+
+    # resolution
+
+    def _matches(self, identifier: exp.Identifier, stored: str) -> bool:
+        if not self.case_sensitive:
+            return identifier.name.lower() == stored.lower()
+        return identifier.name == stored if identifier.quoted else identifier.name.upper() == stored
+
+    def _resolve(self, identifier: exp.Identifier, stored_names: List[str], kind: str, scope: str,
+                 result: ValidationResult) -> Optional[str]:
+        """The stored name `identifier` refers to, fixing its case/quoting if that is unambiguous."""
+        if any(self._matches(identifier, stored) for stored in stored_names):
+            return next(s for s in stored_names if self._matches(identifier, s))
+        candidates = sorted({s for s in stored_names if s.lower() == identifier.name.lower()})
+        if len(candidates) == 1:
+            fix = f"{kind} {identifier.sql(dialect=self.dialect)} -> \"{candidates[0]}\""
+            if fix not in result.fixes:
+                result.fixes.append(fix)
+            identifier.set("this", candidates[0])
+            identifier.set("quoted", True)
+            return candidates[0]
+        if candidates:
+            result.errors.append(f"{kind.capitalize()} {identifier.sql(dialect=self.dialect)} is ambiguous in {scope}, "
+                                 f"quote one of: {', '.join(_quote(c) for c in candidates)}.")
+            return None
+        close = difflib.get_close_matches(identifier.name.lower(), [s.lower() for s in stored_names], n=3, cutoff=0.6)
+        hint = f" Did you mean {', '.join(_quote(s) for s in stored_names if s.lower() in close)}?" if close else ""
+        result.errors.append(f"{kind.capitalize()} {identifier.sql(dialect=self.dialect)} does not exist in {scope}.{hint}")
+        return None
+
+    def _check_statement(self, statement: exp.Query, tables: Dict[str, dict], result: ValidationResult):
+        stored_tables = {entry["stored_name"]: entry for entry in tables.values()}
+        cte_names = {cte.alias_or_name.lower() for cte in statement.find_all(exp.CTE)}
+        derived = statement.find(*DERIVED_SOURCES) is not None or bool(cte_names)
+
+        # table references, and the stored table name behind every name or alias they can be used by
+        sources: Dict[str, str] = {}
+        table_sources: Dict[int, str] = {}
+        renamed: Dict[str, str] = {}
+        for table in statement.find_all(exp.Table):
+            if (not isinstance(table.this, exp.Identifier) or table.args.get("db") is not None
+                    or table.name.lower() in cte_names):
+                derived = True  # another schema, or a CTE: not in this catalog
+                continue
+            written = self._resolved_name(table.this)
+            stored = self._resolve(table.this, list(stored_tables), "table", "the database", result)
+            if stored is None:
+                continue
+            sources[stored.lower()] = stored
+            table_sources[id(table)] = stored
+            if table.alias:
+                sources[table.alias.lower()] = stored
+            elif self._resolved_name(table.this) != written:
+                renamed[written] = stored
+        if result.errors:
+            return
+
+        # qualifiers naming a rewritten table have to follow it, or they'd still resolve to the old name
+        for column in statement.find_all(exp.Column):
+            qualifier = column.args.get("table")
+            if isinstance(qualifier, exp.Identifier) and self._resolved_name(qualifier) in renamed:
+                qualifier.set("this", renamed[self._resolved_name(qualifier)])
+                qualifier.set("quoted", True)
+
+        using = {i.name.lower() for join in statement.find_all(exp.Join) for i in join.args.get("using") or []}
+        output_names = {a.alias.lower() for a in statement.find_all(exp.Alias)}
+        for column in statement.find_all(exp.Column):
+            if isinstance(column.this, exp.Star) or not column.name:
+                continue
+            if column.table:
+                if column.table.lower() not in sources:
+                    continue  # a CTE, subquery or table from another schema
+                candidates = [sources[column.table.lower()]]
+                scope = f"table {_quote(candidates[0])}"
+            else:
+                if column.name.lower() in output_names:
+                    continue  # a select alias used in ORDER BY/HAVING/QUALIFY
+                owners = self._owners(column, table_sources, stored_tables)
+                if len(owners) > 1 and column.name.lower() not in using:
+                    result.errors.append(f"Column {column.this.sql(dialect=self.dialect)} is ambiguous, it is in "
+                                         f"{', '.join(_quote(o) for o in owners)}; qualify it with the table.")
+                    continue
+                candidates = sorted(set(sources.values()))
+                scope = "the tables in the query"
+            stored_columns = [c["stored_name"] for name in candidates for c in stored_tables[name]["columns"]]
+            if derived and not column.table and not any(self._matches(column.this, s) or s.lower() == column.name.lower()
+                                                        for s in stored_columns):
+                continue  # may come from a subquery or CTE
+            if not candidates:
+                continue
+            self._resolve(column.this, stored_columns, "column", scope, result)
+
+    def _resolved_name(self, identifier: exp.Identifier) -> str:
+        """The name the warehouse looks up for `identifier`."""
+        if not self.case_sensitive:
+            return identifier.name.lower()
+        return identifier.name if identifier.quoted else identifier.name.upper()
+
+    def _owners(self, column: exp.Column, table_sources: Dict[int, str], stored_tables: Dict[str, dict]) -> List[str]:
+        """Tables read by the column's own SELECT that have a column of that name, in any case."""
+        select = column.find_ancestor(exp.Select)
+        names = sorted({table_sources[id(t)] for t in (select.find_all(exp.Table) if select else [])
+                        if id(t) in table_sources and t.find_ancestor(exp.Select) is select})
+        return [name for name in names
+                if any(c["stored_name"].lower() == column.name.lower() for c in stored_tables[name]["columns"])]
+
+
+def _quote(name: str) -> str:
+    return f'"{name}"'
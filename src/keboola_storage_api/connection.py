@@ -1,13 +1,16 @@
 import streamlit as st
-import os
 from requests.exceptions import HTTPError
 from typing import Dict, List, Tuple
 
 from kbcstorage.client import Client
 
+from src.keboola_storage_api.export_cache import get_export_cache
+from src.keboola_storage_api.metadata import ProjectMetadata, get_metadata_cache
+
 KBC_URLS = ['https://connection.keboola.com/',
             'https://connection.north-europe.azure.keboola.com/',
             'https://connection.eu-central-1.keboola.com/']
+DETECT_STACK = "Detect from token"
 
 
 def add_keboola_table_selection():
@@ -23,6 +26,7 @@ def add_keboola_table_selection():
     """
     _add_connection_form()
     if "kbc_storage_client" in st.session_state:
+        st.sidebar.text_input('Search buckets and tables', key='kbc_search')
         _add_bucket_form()
     if "selected_bucket" in st.session_state and "kbc_storage_client" in st.session_state:
         _add_table_form()
@@ -30,28 +34,34 @@ def add_keboola_table_selection():
 
 def _add_connection_form():
     with st.sidebar.form("Connection Details"): 
-        connection_url = st.selectbox('Connection URL', KBC_URLS)
+        connection_url = st.selectbox('Connection URL', [DETECT_STACK] + KBC_URLS)
         api_key = st.text_input('Keboola Storage Token', 'Enter Storage Token', type="password")
         if st.form_submit_button("Connect"):
-                kbc_client = Client(connection_url, api_key)
-                
-
             # Reset Client
-        if "kbc_storage_client" in st.session_state:
-            st.session_state.pop("kbc_storage_client")
-
-        # Clear selected buckets and tables if connection is reset
-        if "selected_table" in st.session_state:
-            st.session_state.pop("selected_table")
-        if "selected_table_id" in st.session_state:
-            st.session_state.pop("selected_table_id")
-        if "selected_bucket" in st.session_state:
-            st.session_state.pop("selected_bucket")
-        if "uploaded_file" in st.session_state:
-            st.session_state.pop("uploaded_file")
-        if _get_bucket_list(kbc_client):
+            if "kbc_storage_client" in st.session_state:
+                st.session_state.pop("kbc_storage_client")
+
+            # Clear selected buckets and tables if connection is reset
+            if "selected_table" in st.session_state:
+                st.session_state.pop("selected_table")
+            if "selected_table_id" in st.session_state:
+                st.session_state.pop("selected_table_id")
+            if "selected_bucket" in st.session_state:
+                st.session_state.pop("selected_bucket")
+            if "uploaded_file" in st.session_state:
+                st.session_state.pop("uploaded_file")
+            if "export_job" in st.session_state:
+                st.session_state.pop("export_job")
+
+            if connection_url == DETECT_STACK:
+                connection_url = get_metadata_cache().find_stack(KBC_URLS, api_key)
+                if connection_url is None:
+                    st.error("Invalid Connection settings")
+                    return api_key
+            kbc_client = Client(connection_url, api_key)
+            # a reconnect is the way to see buckets and tables created since the last listing
+            if _get_metadata(kbc_client, refresh=True):
                 st.session_state['kbc_storage_client'] = kbc_client
-                st.session_state['bucket_list'] = _get_bucket_list(kbc_client)
     return api_key
 
 def _add_bucket_form():
@@ -66,21 +76,42 @@ def _add_table_form():
     with st.sidebar.form("Table Details"):
         table_names, tables = _get_tables(st.session_state['selected_bucket'])
         st.session_state['selected_table'] = st.selectbox('Table', table_names)
-        st.session_state['selected_table_id'] = tables[st.session_state['selected_table']]["id"]
-        if st.form_submit_button("Select table"):
-            if os.listdir('data') == []:
-                os.mkdir('data')
-            data_dir = "data"
-            st.session_state['kbc_storage_client'].tables.export_to_file(
-                table_id=st.session_state['selected_table_id'],
-                path_name=data_dir)
-            st.session_state['uploaded_file'] = os.path.join(data_dir, st.session_state['selected_table'])
-
-
-def _get_bucket_list(kbc_storage_client):
+        if st.session_state['selected_table'] is not None:
+            st.session_state['selected_table_id'] = tables[st.session_state['selected_table']]["id"]
+        if st.form_submit_button("Select table") and st.session_state['selected_table'] is not None:
+            # served from the local copy when unchanged, otherwise exported in the background
+            st.session_state.pop('uploaded_file', None)
+            st.session_state['export_job'] = get_export_cache().get(
+                st.session_state['kbc_storage_client'], tables[st.session_state['selected_table']])
+    with st.sidebar:
+        _show_export_progress()
+
+
+def _show_export_progress():
+    job = st.session_state.get('export_job')
+    if job is None:
+        return
+    if not job.done():
+        # only a running job is polled, so the fragment stops with the rerun once it finishes
+        _poll_export_progress(job)
+        return
+    st.progress(job.progress, text=job.describe())
+    if job.phase == "done":
+        # the path of the local CSV copy (data/<table id>.csv)
+        st.session_state['uploaded_file'] = job.path
+
+
+@st.fragment(run_every=1)
+def _poll_export_progress(job):
+    st.progress(job.progress, text=job.describe())
+    if job.done():
+        st.rerun()
+
+
+def _get_metadata(kbc_storage_client, refresh=False) -> ProjectMetadata:
+    """Bucket and table listings, shared by every session using the same stack and token."""
     try:
-        project_bucket_list = kbc_storage_client.buckets.list()
-        return project_bucket_list
+        return get_metadata_cache().get(kbc_storage_client, refresh=refresh)
     except HTTPError:
         st.error("Invalid Connection settings")
 
@@ -90,7 +121,7 @@ def _get_buckets_from_bucket_list():
     This function is used to get the list of buckets from Keboola Storage.
     """
     try:
-        return [bucket['id'] for bucket in st.session_state['bucket_list']]
+        return _get_metadata(st.session_state['kbc_storage_client']).bucket_ids(st.session_state.get('kbc_search', ''))
     except Exception:
         st.error('Could not list buckets')
 
@@ -98,10 +129,11 @@ def _get_buckets_from_bucket_list():
 def _get_tables(bucket_id: str) -> Tuple[List, Dict]:
     try:
         tables = {}
-        for table in st.session_state['kbc_storage_client'].buckets.list_tables(bucket_id):
+        metadata = _get_metadata(st.session_state['kbc_storage_client'])
+        for table in metadata.bucket_tables(bucket_id, st.session_state.get('kbc_search', '')):
             tables[table['name']] = table
         table_names = list(tables.keys())
         return table_names, tables
     except Exception as e:
         st.error('Could not list tables')
-        st.error(e)
\ No newline at end of file
+        st.error(e)
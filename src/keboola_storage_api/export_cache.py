@@ -0,0 +1,172 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+import pandas as pd
+import streamlit as st
+from kbcstorage.client import Client
+
+EXPORT_DIR = "data"
+MANIFEST_NAME = ".exports.json"
+MAX_EXPORT_WORKERS = 2
+# rough share of the work done when each phase starts, for the sidebar progress bar
+PHASE_PROGRESS = {"queued": 0.0, "checking": 0.05, "exporting": 0.15, "merging": 0.85, "done": 1.0, "failed": 1.0}
+
+
+@dataclass
+class ExportJob:
+    table_id: str
+    path: str
+    phase: str = "queued"
+    mode: Optional[str] = None  # "cached", "incremental" or "full"
+    error: Optional[str] = None
+    changed_rows: Optional[int] = None
+    started_at: float = field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    future: Optional[Future] = None
+
+    def done(self) -> bool:
+        return self.phase in ("done", "failed")
+
+    @property
+    def progress(self) -> float:
+        return PHASE_PROGRESS[self.phase]
+
+    def describe(self) -> str:
+        elapsed = (self.finished_at or time.time()) - self.started_at
+        if self.phase == "failed":
+            return f"Export of {self.table_id} failed: {self.error}"
+        if self.phase != "done":
+            return f"{self.table_id}: {self.phase}... ({elapsed:.0f}s)"
+        if self.mode == "cached":
+            return f"{self.table_id}: unchanged, loaded from the local copy"
+        if self.mode == "incremental":
+            return f"{self.table_id}: merged {self.changed_rows:,} changed rows in {elapsed:.1f}s"
+        return f"{self.table_id}: exported in {elapsed:.1f}s"
+
+
+class ExportCache:
+    """
+    Local copies of exported Storage tables, keyed by table id and the table's lastChangeDate.
+
+    An unchanged table is served from disk without a request. A changed table with a primary key
+    is refreshed with a changedSince export of the rows imported after the cached copy, upserted
+    into it by primary key; tables without one, or whose columns or key changed, are exported in
+    full. Exports run on a small thread pool so the script thread never waits on Storage.
+    Rows deleted in Storage are only dropped locally by a full export.
+    """
+
+    def __init__(self, directory: str = EXPORT_DIR, max_workers: int = MAX_EXPORT_WORKERS):
+        self.directory = directory
+        self._manifest_path = os.path.join(directory, MANIFEST_NAME)
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, ExportJob] = {}
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kai-export")
+        os.makedirs(directory, exist_ok=True)
+        self._manifest = self._load_manifest()
+
+    def _load_manifest(self) -> dict:
+        try:
+            with open(self._manifest_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _save_manifest(self):
+        # caller holds the lock
+        tmp_path = self._manifest_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f, indent=1)
+        os.replace(tmp_path, self._manifest_path)
+
+    def path(self, table_id: str) -> str:
+        return os.path.join(self.directory, f"{table_id}.csv")
+
+    def cached(self, table_id: str, last_change: Optional[str]) -> Optional[str]:
+        """Path of the local copy if it is as new as `last_change`, else None."""
+        with self._lock:
+            entry = self._manifest.get(table_id)
+        if entry is None or last_change is None or entry["last_change"] != last_change:
+            return None
+        return entry["path"] if os.path.exists(entry["path"]) else None
+
+    def get(self, client: Client, table: dict) -> ExportJob:
+        """
+        The local copy of `table` (an entry from buckets.list_tables), as a job that is already
+        done when the copy is current and otherwise exports in the background.
+        """
+        table_id = table["id"]
+        with self._lock:
+            running = self._jobs.get(table_id)
+            if running is not None and not running.done():
+                return running
+        path = self.cached(table_id, table.get("lastChangeDate"))
+        if path is not None:
+            return ExportJob(table_id, path, phase="done", mode="cached", finished_at=time.time())
+        job = ExportJob(table_id, self.path(table_id))
+        with self._lock:
+            self._jobs[table_id] = job
+        job.future = self._pool.submit(self._run, client, job)
+        return job
+
+    def _run(self, client: Client, job: ExportJob):
+        try:
+            job.phase = "checking"
+            detail = client.tables.detail(job.table_id)
+            with self._lock:
+                entry = self._manifest.get(job.table_id)
+            if entry is not None and entry["last_change"] == detail.get("lastChangeDate") and os.path.exists(entry["path"]):
+                job.mode = "cached"
+            elif (entry is not None and detail.get("primaryKey") and entry["primary_key"] == detail["primaryKey"]
+                  and entry["columns"] == detail["columns"] and os.path.exists(entry["path"])):
+                job.mode = "incremental"
+                self._export_incremental(client, job, entry, detail["primaryKey"])
+            else:
+                job.mode = "full"
+                self._export_full(client, job)
+            with self._lock:
+                self._manifest[job.table_id] = {"path": job.path, "last_change": detail.get("lastChangeDate"),
+                                                "primary_key": detail.get("primaryKey") or [],
+                                                "columns": detail["columns"], "exported_at": time.time()}
+                self._save_manifest()
+            job.phase = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.phase = "failed"
+        finally:
+            job.finished_at = time.time()
+
+    def _export(self, client: Client, table_id: str, directory: str, changed_since: Optional[str] = None) -> str:
+        return client.tables.export_to_file(table_id=table_id, path_name=directory, changed_since=changed_since)
+
+    def _export_full(self, client: Client, job: ExportJob):
+        job.phase = "exporting"
+        with tempfile.TemporaryDirectory(dir=self.directory) as tmp_dir:
+            exported = self._export(client, job.table_id, tmp_dir)
+            os.replace(exported, job.path)
+
+    def _export_incremental(self, client: Client, job: ExportJob, entry: dict, primary_key: List[str]):
+        job.phase = "exporting"
+        with tempfile.TemporaryDirectory(dir=self.directory) as tmp_dir:
+            exported = self._export(client, job.table_id, tmp_dir, changed_since=entry["last_change"])
+            job.phase = "merging"
+            changed = pd.read_csv(exported, dtype=str, keep_default_na=False)
+            job.changed_rows = len(changed)
+            if changed.empty:
+                return
+            current = pd.read_csv(entry["path"], dtype=str, keep_default_na=False)
+            merged = pd.concat([current, changed], ignore_index=True).drop_duplicates(subset=primary_key, keep="last")
+            tmp_path = os.path.join(tmp_dir, "merged.csv")
+            merged.to_csv(tmp_path, index=False)
+            shutil.move(tmp_path, job.path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_export_cache() -> ExportCache:
+    return ExportCache()
@@ -0,0 +1,109 @@
+import hashlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import streamlit as st
+from kbcstorage.client import Client
+from requests.exceptions import HTTPError, RequestException
+
+METADATA_TTL_SECONDS = 5 * 60
+MAX_METADATA_WORKERS = 8
+
+
+def token_hash(token: str) -> str:
+    """Cache key part for a token, so the token itself is never kept as a key."""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()[:16]
+
+
+@dataclass
+class ProjectMetadata:
+    """
+    Bucket and table listings of one project, with a search index over their ids and names.
+    Terms are matched as substrings, all of them against the same bucket or table.
+    """
+    url: str
+    buckets: List[dict]
+    tables: List[dict]
+    fetched_at: float = field(default_factory=time.time)
+
+    def __post_init__(self):
+        self.tables_by_bucket: Dict[str, List[dict]] = {}
+        for table in self.tables:
+            self.tables_by_bucket.setdefault(table["id"].rsplit(".", 1)[0], []).append(table)
+        self._bucket_text = {b["id"]: f"{b['id']} {b.get('name', '')} {b.get('description', '')}".lower()
+                             for b in self.buckets}
+        self._table_text = {t["id"]: f"{t['id']} {t.get('displayName', '')}".lower() for t in self.tables}
+
+    def bucket_ids(self, query: str = "") -> List[str]:
+        """Buckets matching `query` themselves or through one of their tables."""
+        terms = query.lower().split()
+        if not terms:
+            return [b["id"] for b in self.buckets]
+        matching_tables = {t_id.rsplit(".", 1)[0] for t_id, text in self._table_text.items()
+                           if all(term in text for term in terms)}
+        return [b_id for b_id, text in self._bucket_text.items()
+                if b_id in matching_tables or all(term in text for term in terms)]
+
+    def bucket_tables(self, bucket_id: str, query: str = "") -> List[dict]:
+        """Tables of the bucket; all of them if the bucket itself matches `query`."""
+        tables = self.tables_by_bucket.get(bucket_id, [])
+        terms = query.lower().split()
+        if not terms or all(term in self._bucket_text.get(bucket_id, "") for term in terms):
+            return tables
+        return [t for t in tables if all(term in self._table_text[t["id"]] for term in terms)]
+
+
+class MetadataCache:
+    """
+    Storage listings per (stack URL, token hash), kept for `ttl` seconds; expired entries are
+    evicted whenever a listing is fetched, and invalidate() drops a project's entry after a write
+    such as an upload. The bucket and table listings of a project are fetched in parallel, and
+    finding the stack a token belongs to asks every stack at once instead of one after another.
+    """
+
+    def __init__(self, ttl: int = METADATA_TTL_SECONDS, max_workers: int = MAX_METADATA_WORKERS):
+        self.ttl = ttl
+        self._entries: Dict[Tuple[str, str], ProjectMetadata] = {}
+        self._lock = threading.Lock()
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kai-kbc-metadata")
+
+    def get(self, client: Client, refresh: bool = False) -> ProjectMetadata:
+        """Raises requests.HTTPError for an invalid token."""
+        key = (client.root_url, token_hash(client.token))
+        with self._lock:
+            cached = self._entries.get(key)
+        if cached is not None and not refresh and time.time() - cached.fetched_at < self.ttl:
+            return cached
+        buckets = self._pool.submit(client.buckets.list)
+        tables = self._pool.submit(client.tables.list)
+        metadata = ProjectMetadata(client.root_url, buckets.result(), tables.result())
+        with self._lock:
+            now = time.time()
+            for expired in [k for k, entry in self._entries.items() if now - entry.fetched_at >= self.ttl]:
+                del self._entries[expired]
+            self._entries[key] = metadata
+        return metadata
+
+    def find_stack(self, urls: List[str], token: str) -> Optional[str]:
+        """The stack among `urls` that accepts the token, asking all of them concurrently."""
+        futures = {self._pool.submit(Client(url, token).buckets.list): url for url in urls}
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except (HTTPError, RequestException):
+                continue
+            return futures[future]
+        return None
+
+    def invalidate(self, client: Client):
+        """Forget the project's listings, so the next get() sees tables just created or changed."""
+        with self._lock:
+            self._entries.pop((client.root_url, token_hash(client.token)), None)
+
+
+@st.cache_resource(show_spinner=False)
+def get_metadata_cache() -> MetadataCache:
+    return MetadataCache()
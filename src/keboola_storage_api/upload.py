@@ -1,21 +1,204 @@
-from io import StringIO
+import glob
+import gzip
 import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import List, Optional
+
 import streamlit as st
-from pathlib import Path
 import keboola_api as kb
+from kbcstorage.client import Client
+from requests.exceptions import HTTPError
+
+from src.keboola_storage_api.metadata import get_metadata_cache
+
+KEBOOLA_URL = "https://connection.north-europe.azure.keboola.com"
+# bytes read from the uploaded buffer at a time
+CHUNK_SIZE = 8 * 1024 ** 2
+# uncompressed bytes per slice; larger files are uploaded as several slices in parallel
+SLICE_SIZE = 256 * 1024 ** 2
+MAX_UPLOAD_WORKERS = 4
+GZIP_LEVEL = 6
+STAGING_PREFIX = "kai-upload-"
+# staged copies left behind by sessions that ended without replacing their upload
+STAGING_MAX_AGE_SECONDS = 6 * 3600
+
+
+@dataclass
+class StagedUpload:
+    """An uploaded CSV written to a temp dir as gzipped slices, each starting with the header row."""
+    name: str
+    directory: str
+    paths: List[str] = field(default_factory=list)
+    raw_bytes: int = 0
+    compressed_bytes: int = 0
+    seconds: float = 0.0
+    peak_memory: Optional[int] = None
+
+    @property
+    def throughput(self) -> float:
+        """Uncompressed bytes per second while staging."""
+        return self.raw_bytes / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> str:
+        memory = f", peak memory {self.peak_memory / 1024 ** 2:.1f} MB" if self.peak_memory is not None else ""
+        return (f"{self.name}: {self.raw_bytes / 1024 ** 2:.1f} MB staged as {len(self.paths)} gzipped slice(s) "
+                f"of {self.compressed_bytes / 1024 ** 2:.1f} MB in {self.seconds:.1f}s "
+                f"({self.throughput / 1024 ** 2:.1f} MB/s{memory})")
+
+    def cleanup(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def _split_point(chunk: bytes, in_quotes: bool) -> Optional[int]:
+    """Index just after the last newline in `chunk` that is not inside a quoted field."""
+    end = len(chunk)
+    while True:
+        newline = chunk.rfind(b"\n", 0, end)
+        if newline < 0:
+            return None
+        # "" escapes count twice, so the parity of quotes before the newline tells if it is inside a field
+        if in_quotes ^ (chunk.count(b'"', 0, newline) % 2 == 1):
+            end = newline
+            continue
+        return newline + 1
+
+
+def purge_staging_dir(max_age: int = STAGING_MAX_AGE_SECONDS):
+    cutoff = time.time() - max_age
+    for directory in glob.glob(os.path.join(tempfile.gettempdir(), f"{STAGING_PREFIX}*")):
+        try:
+            if os.path.getmtime(directory) < cutoff:
+                shutil.rmtree(directory, ignore_errors=True)
+        except OSError:
+            pass
+
+
+def stage_upload(uploaded, chunk_size: int = CHUNK_SIZE, slice_size: int = SLICE_SIZE,
+                 measure_memory: bool = False) -> StagedUpload:
+    """
+    Stream an uploaded CSV into gzipped slices in a temp dir, one chunk at a time, instead of
+    decoding the whole buffer into a string and copying it again. Call cleanup() when done.
+    measure_memory records the peak with tracemalloc, which slows every allocation in the process
+    while it runs; it is meant for benchmarking.
+    """
+    purge_staging_dir()
+    staged = StagedUpload(name=uploaded.name, directory=tempfile.mkdtemp(prefix=STAGING_PREFIX))
+    tracing = measure_memory and tracemalloc.is_tracing()
+    if measure_memory:
+        if not tracing:
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+    started = time.perf_counter()
+
+    header = b""
+    out = None
+    slice_bytes = 0
+    in_quotes = False
+
+    def open_slice():
+        path = os.path.join(staged.directory, f"{os.path.splitext(uploaded.name)[0]}.part{len(staged.paths):04d}.csv.gz")
+        staged.paths.append(path)
+        f = gzip.open(path, "wb", compresslevel=GZIP_LEVEL)
+        f.write(header)
+        return f
+
+    try:
+        uploaded.seek(0)
+        while chunk := uploaded.read(chunk_size):
+            staged.raw_bytes += len(chunk)
+            if out is None:
+                # the header is repeated at the top of every slice
+                header, _, chunk = chunk.partition(b"\n")
+                header += b"\n"
+                out = open_slice()
+            if slice_bytes + len(chunk) >= slice_size:
+                cut = _split_point(chunk, in_quotes)
+                if cut is not None:
+                    out.write(chunk[:cut])
+                    in_quotes ^= chunk.count(b'"', 0, cut) % 2 == 1
+                    chunk = chunk[cut:]
+                    out.close()
+                    out = open_slice()
+                    slice_bytes = 0
+            out.write(chunk)
+            in_quotes ^= chunk.count(b'"') % 2 == 1
+            slice_bytes += len(chunk)
+        if out is not None:
+            out.close()
+    except BaseException:
+        if out is not None:
+            out.close()
+        staged.cleanup()
+        raise
+    finally:
+        if measure_memory:
+            staged.peak_memory = tracemalloc.get_traced_memory()[1]
+            if not tracing:
+                tracemalloc.stop()
+
+    staged.seconds = time.perf_counter() - started
+    staged.compressed_bytes = sum(os.path.getsize(path) for path in staged.paths)
+    return staged
+
+
+def upload_staged(client: Client, staged: StagedUpload, bucket_id: str, table_name: str,
+                  primary_key: Optional[List[str]] = None, max_workers: int = MAX_UPLOAD_WORKERS) -> str:
+    """
+    Create or replace the table from the first slice, then load the other slices incrementally
+    with their file uploads running in parallel. Returns the table id.
+    The project's cached bucket and table listings are dropped afterwards.
+    """
+    table_id = f"{bucket_id}.{table_name}"
+    first, rest = staged.paths[0], staged.paths[1:]
+    try:
+        client.tables.detail(table_id)
+        exists = True
+    except HTTPError as e:
+        if e.response is None or e.response.status_code != 404:
+            raise
+        exists = False
+    if exists:
+        client.tables.load(table_id, first, is_incremental=False)
+    else:
+        table_id = client.tables.create(bucket_id, table_name, first, primary_key=primary_key)
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="kai-upload") as pool:
+            list(pool.map(lambda path: client.tables.load(table_id, path, is_incremental=True), rest))
+    finally:
+        # the table was created or replaced even if a later slice failed
+        get_metadata_cache().invalidate(client)
+    return table_id
+
+
+def _staged_file(fl) -> Optional[StagedUpload]:
+    """
+    The staged copy of the current upload, restaged (and the old copy removed) when it changes.
+    Copies of sessions that ended are purged by age when something is staged next.
+    """
+    file_id = getattr(fl, "file_id", None) or fl.name if fl is not None else None
+    previous = st.session_state.get("staged_upload")
+    if previous is not None and previous[0] != file_id:
+        previous[1].cleanup()
+        st.session_state.pop("staged_upload")
+        previous = None
+    if file_id is None:
+        return None
+    if previous is None:
+        st.session_state["staged_upload"] = (file_id, stage_upload(fl))
+    return st.session_state["staged_upload"][1]
 
-def saveFile(uploaded):
-    with open(os.path.join(os.getcwd(),uploaded.name),"w") as f:
-        strIo= StringIO(uploaded.getvalue().decode("utf-8"))
-        f.write(strIo.read())
-        return os.path.join(os.getcwd(),uploaded.name)
 
 def main():
     st.write("# Keboola upload button")
     st.write("## A Streamlit Custom component")
     with st.expander("Keboola Tables"):
         tables=kb.keboola_table_list(
-                keboola_URL="https://connection.north-europe.azure.keboola.com",
+                keboola_URL=KEBOOLA_URL,
                 keboola_key='<key>',
                 # Button Label
                 label="GET TABLES",
@@ -25,9 +208,9 @@ def main():
                 api_only=False
         )
         st.selectbox("Tables",options= list(map(lambda v: v['id'], tables)))
-    with st.expander("Keboola Buckets"):    
+    with st.expander("Keboola Buckets"):
         buckets=kb.keboola_bucket_list(
-                keboola_URL="https://connection.north-europe.azure.keboola.com",
+                keboola_URL=KEBOOLA_URL,
                 keboola_key='<key>',
                 # Button Label
                 label="GET BUCKETS",
@@ -38,25 +221,36 @@ def main():
         )
         st.selectbox("Buckets",options= list(map(lambda v: v['id'], buckets)))
     url = "http://www.dickimaw-books.com/latex/admin/html/examples/booklist.csv"
-    st.write("Get a sample CSV here [link](%s)" % url)    
-    fl=st.file_uploader("Drop a csv...",type="csv")    
-    if hasattr(fl,'name'):
-        # Streamlit uploader doesn't save the file to disk, only in mem. 
-        # We need to save the file to disk to send it to Keboola python client
-        fpath=saveFile(fl)
-        with st.expander("Keboola Upload files"):    
-            value = kb.keboola_upload(
-                keboola_URL="https://connection.north-europe.azure.keboola.com",
-                keboola_key='<key>',
-                keboola_table_name="test-anthony",
-                keboola_bucket_id='in.c-streamlit_output',
-                keboola_file_path=fpath,
-                keboola_primary_key=['id'],
-                # Button Label
-                label="UPLOAD FILE",
-                # Key is mandatory and has to be unique
-                key="two",
-                # if api_only= True than the button is not shown and the api call is fired directly
-                api_only=False
-            )
-            value
\ No newline at end of file
+    st.write("Get a sample CSV here [link](%s)" % url)
+    fl=st.file_uploader("Drop a csv...",type="csv")
+    # Streamlit uploader doesn't save the file to disk, only in mem.
+    # The Keboola python client needs a file, so stream it to gzipped temp slices
+    staged = _staged_file(fl)
+    if staged is not None:
+        st.caption(staged.summary())
+        with st.expander("Keboola Upload files"):
+            if len(staged.paths) == 1:
+                value = kb.keboola_upload(
+                    keboola_URL=KEBOOLA_URL,
+                    keboola_key='<key>',
+                    keboola_table_name="test-anthony",
+                    keboola_bucket_id='in.c-streamlit_output',
+                    keboola_file_path=staged.paths[0],
+                    keboola_primary_key=['id'],
+                    # Button Label
+                    label="UPLOAD FILE",
+                    # Key is mandatory and has to be unique
+                    key="two",
+                    # if api_only= True than the button is not shown and the api call is fired directly
+                    api_only=False
+                )
+                if value:
+                    get_metadata_cache().invalidate(Client(KEBOOLA_URL, '<key>'))
+                value
+            elif st.button("UPLOAD FILE", key="two"):
+                started = time.perf_counter()
+                table_id = upload_staged(Client(KEBOOLA_URL, '<key>'), staged, 'in.c-streamlit_output',
+                                         "test-anthony", primary_key=['id'])
+                seconds = time.perf_counter() - started
+                st.write(f"Uploaded {len(staged.paths)} slices to {table_id} in {seconds:.1f}s "
+                         f"({staged.compressed_bytes / 1024 ** 2 / seconds:.1f} MB/s compressed)")
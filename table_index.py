@@ -0,0 +1,75 @@
+import hashlib
+import threading
+from typing import Dict, List, Tuple
+
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import FAISS
+
+from schema_catalog import SchemaCatalog
+
+TOP_K = 5
+
+
+def table_document(name: str, entry: dict) -> str:
+    columns = ", ".join(f"{c['name']} ({c['type']})" for c in entry["columns"])
+    return f"Table {name}. Columns: {columns}"
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class TableIndex:
+    """
+    FAISS index of one short description per catalog table, used to hand the agent the
+    few tables relevant to a question instead of making it list and inspect the whole schema.
+    Vectors are kept per table, so a catalog change only re-embeds the tables that changed.
+    """
+
+    def __init__(self, catalog: SchemaCatalog, embeddings: Embeddings, k: int = TOP_K):
+        self.catalog = catalog
+        self.embeddings = embeddings
+        self.k = k
+        self.vector_db = None
+        self.embedded_count = 0
+        self._vectors: Dict[str, Tuple[str, List[float]]] = {}
+        self._lock = threading.Lock()
+        catalog.on_change(lambda _: self.rebuild())
+
+    def rebuild(self):
+        with self._lock:
+            docs = {name: table_document(name, entry) for name, entry in self.catalog.snapshot().items()}
+            changed = [name for name, text in docs.items()
+                       if self._vectors.get(name, (None,))[0] != _text_hash(docs[name])]
+            if changed:
+                vectors = self.embeddings.embed_documents([docs[name] for name in changed])
+                self.embedded_count += len(changed)
+                for name, vector in zip(changed, vectors):
+                    self._vectors[name] = (_text_hash(docs[name]), vector)
+            for name in set(self._vectors) - set(docs):
+                del self._vectors[name]
+            if not docs:
+                self.vector_db = None
+                return
+            names = sorted(docs)
+            self.vector_db = FAISS.from_embeddings(
+                [(docs[name], self._vectors[name][1]) for name in names],
+                self.embeddings,
+                metadatas=[{"table": name} for name in names],
+            )
+
+    def relevant_tables(self, question: str, k: int = None, vector: List[float] = None) -> List[str]:
+        if self.vector_db is None:
+            self.catalog.ensure_fresh()
+            self.rebuild()
+        if self.vector_db is None:
+            return []
+        if vector is not None:
+            docs = self.vector_db.similarity_search_by_vector(vector, k=k or self.k)
+        else:
+            docs = self.vector_db.similarity_search(question, k=k or self.k)
+        return [doc.metadata["table"] for doc in docs]
+
+    def relevant_schema(self, question: str, k: int = None, vector: List[float] = None) -> str:
+        tables = self.relevant_tables(question, k, vector)
+        return self.catalog.table_info(tables) if tables else ""
@@ -0,0 +1,213 @@
+import atexit
+import json
+import os
+import queue
+import random
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+import requests
+import streamlit as st
+
+from settings import CACHE_DIR
+
+TELEMETRY_SPOOL_PATH = os.path.join(CACHE_DIR, "telemetry_spool.jsonl")
+BATCH_SIZE = 50
+FLUSH_SECONDS = 2.0
+MAX_QUEUED_EVENTS = 10000
+MAX_RETRIES = 4
+BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+REQUEST_TIMEOUT_SECONDS = 10
+# once a batch has failed every retry, later batches are spooled right away, with a single
+# POST at most this often to find out whether the endpoint is back
+PROBE_SECONDS = 30.0
+# the spool holds users' questions, so it is bounded; past this the oldest events are dropped
+MAX_SPOOL_BYTES = 10 * 1024 ** 2
+
+
+class TelemetryClient:
+    """
+    Conversation and feedback events for the logging endpoint, sent off the request path.
+
+    emit() only puts the event on an in-process queue. A background worker sends the queue in
+    batches of up to `batch_size`, or whatever arrived within `flush_seconds`, retrying a failed
+    POST with exponential backoff. Batches that still fail are appended to a local spool file of
+    at most `max_spool_bytes`, which drops its oldest events when full; while the endpoint is
+    down, new batches are spooled without retrying, and one POST every PROBE_SECONDS checks
+    whether it is back. The spool is sent after the next successful batch. If the queue is full,
+    or no endpoint is configured, events are dropped and counted rather than kept.
+    """
+
+    def __init__(self, url: Optional[str] = None, spool_path: str = TELEMETRY_SPOOL_PATH,
+                 batch_size: int = BATCH_SIZE, flush_seconds: float = FLUSH_SECONDS,
+                 max_queued: int = MAX_QUEUED_EVENTS, max_spool_bytes: int = MAX_SPOOL_BYTES):
+        self.url = url
+        self.spool_path = spool_path
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.max_spool_bytes = max_spool_bytes
+        self.sent = 0
+        self.spooled = 0
+        self.dropped = 0
+        self.emitted = 0
+        self.emit_seconds = 0.0
+        self._queue: "queue.Queue[dict]" = queue.Queue(maxsize=max_queued)
+        self._session = requests.Session()
+        # monotonic time of the next probe while the endpoint is down, None while it is up
+        self._probe_at: Optional[float] = None
+        self._worker = threading.Thread(target=self._run, name="kai-telemetry", daemon=True)
+        self._worker.start()
+        atexit.register(self.flush)
+
+    # request path
+
+    def emit(self, event_type: str, **fields):
+        started = time.perf_counter()
+        event = {"id": uuid.uuid4().hex, "type": event_type, "timestamp": time.time(), **fields}
+        if not self.url:
+            # nowhere to send it, and keeping it locally would only pile up users' questions
+            self.dropped += 1
+        else:
+            try:
+                self._queue.put_nowait(event)
+            except queue.Full:
+                self.dropped += 1
+        self.emitted += 1
+        self.emit_seconds += time.perf_counter() - started
+
+    @property
+    def mean_emit_us(self) -> float:
+        """Average time emit() kept the caller, in microseconds."""
+        return 1e6 * self.emit_seconds / self.emitted if self.emitted else 0.0
+
+    def flush(self, timeout: float = 5.0):
+        """Wait until the queued events are sent or spooled, e.g. before the process exits."""
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    # worker
+
+    def _next_batch(self) -> List[dict]:
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.flush_seconds
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                self._handle(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    def _handle(self, batch: List[dict]):
+        try:
+            sent = self._send_with_retry(batch)
+        except Exception:
+            sent = False
+        # the batch is settled here, so a failing spool drain below can't send it twice
+        try:
+            if not sent:
+                self._spool(batch)
+            else:
+                self._drain_spool()
+        except Exception:
+            pass  # a spool that can't be read now is drained after a later successful send
+
+    def _post(self, batch: List[dict]) -> bool:
+        try:
+            response = self._session.post(self.url, data=json.dumps(batch, default=str).encode("utf-8"),
+                                          headers={"Content-Type": "application/json"},
+                                          timeout=REQUEST_TIMEOUT_SECONDS)
+            return response.ok
+        except requests.RequestException:
+            return False
+
+    def _send_with_retry(self, batch: List[dict]) -> bool:
+        if not self.url:
+            return False
+        if self._probe_at is not None and time.monotonic() < self._probe_at:
+            return False
+        # while the endpoint is down, one POST is the probe
+        retries = MAX_RETRIES if self._probe_at is None else 0
+        for attempt in range(retries + 1):
+            if self._post(batch):
+                self.sent += len(batch)
+                self._probe_at = None
+                return True
+            if attempt < retries:
+                delay = min(MAX_BACKOFF_SECONDS, BACKOFF_SECONDS * 2 ** attempt)
+                time.sleep(delay * random.uniform(0.5, 1.0))
+        self._probe_at = time.monotonic() + PROBE_SECONDS
+        return False
+
+    # spool; only the worker thread touches it
+
+    def _spool(self, batch: List[dict]):
+        os.makedirs(os.path.dirname(self.spool_path), exist_ok=True)
+        with open(self.spool_path, "a") as f:
+            for event in batch:
+                f.write(json.dumps(event, default=str) + "\n")
+        self.spooled += len(batch)
+        if os.path.getsize(self.spool_path) > self.max_spool_bytes:
+            self._trim_spool()
+
+    def _trim_spool(self):
+        # keep the newest events within half the limit, so trimming doesn't happen on every batch
+        with open(self.spool_path, "r") as f:
+            lines = f.readlines()
+        kept, size = [], 0
+        for line in reversed(lines):
+            size += len(line.encode("utf-8"))
+            if size > self.max_spool_bytes // 2:
+                break
+            kept.append(line)
+        self.dropped += len(lines) - len(kept)
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.writelines(reversed(kept))
+        os.replace(tmp_path, self.spool_path)
+
+    def _drain_spool(self):
+        if not os.path.exists(self.spool_path):
+            return
+        events = []
+        with open(self.spool_path, "r") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    # e.g. a line cut short when the process died mid-write
+                    if line.strip():
+                        self.dropped += 1
+        for start in range(0, len(events), self.batch_size):
+            batch = events[start:start + self.batch_size]
+            if not self._post(batch):
+                # keep what is left for the next successful send
+                tmp_path = self.spool_path + ".tmp"
+                with open(tmp_path, "w") as f:
+                    for event in events[start:]:
+                        f.write(json.dumps(event, default=str) + "\n")
+                os.replace(tmp_path, self.spool_path)
+                return
+            self.sent += len(batch)
+        os.remove(self.spool_path)
+
+
+@st.cache_resource(show_spinner=False)
+def get_telemetry() -> TelemetryClient:
+    """Events go to `url` from secrets when it is set, and are dropped otherwise."""
+    return TelemetryClient(st.secrets.get("url"))
@@ -0,0 +1,57 @@
+import threading
+import time
+
+from agent_jobs import AgentJob, AgentScheduler
+
+
+def blocking_job(release: threading.Event, **kwargs) -> AgentJob:
+    # stands in for an agent stuck in one long LLM call
+    def fn(callbacks):
+        release.wait(5)
+        return "answer"
+    return AgentJob("user", fn, **kwargs)
+
+
+def wait_until_running(job):
+    while job.state != "running":
+        time.sleep(0.01)
+
+
+def test_iter_steps_ticks_while_waiting_and_stops_on_cancel():
+    release = threading.Event()
+    scheduler = AgentScheduler(max_workers=1)
+    job = scheduler.submit(blocking_job(release))
+    wait_until_running(job)
+    started = time.monotonic()
+    ticks = 0
+    for step in job.iter_steps(poll_interval=0.05):
+        assert step is None
+        ticks += 1
+        if ticks == 2:
+            scheduler.cancel(job)
+    assert time.monotonic() - started < 1
+    assert not job.done() and job.stopped()
+
+    # the call in flight returns later; its answer is dropped
+    release.set()
+    job.wait(5)
+    assert job.output is None and job.cancelled
+
+
+def test_timeout_stops_waiting_before_the_call_returns():
+    release = threading.Event()
+    job = AgentScheduler(max_workers=1).submit(blocking_job(release, timeout=0.1))
+    wait_until_running(job)
+    list(job.iter_steps(poll_interval=0.02))
+    assert job.timed_out and "longer than" in job.stop_reason
+    release.set()
+    job.wait(5)
+    assert job.output is None
+
+
+def test_finished_job_keeps_its_answer():
+    release = threading.Event()
+    release.set()
+    job = AgentScheduler(max_workers=1).submit(blocking_job(release))
+    assert [s for s in job.iter_steps(poll_interval=0.01) if s is not None] == []
+    assert job.output == "answer" and not job.stopped()
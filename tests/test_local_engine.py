@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+from local_engine import LocalTableEngine, column_type, exported_tables, local_table_name
+
+
+def write_csv(directory, table_id, text):
+    path = os.path.join(directory, f"{table_id}.csv")
+    with open(path, "w") as f:
+        f.write(text)
+    return path
+
+
+@pytest.fixture
+def engine(tmp_path):
+    local = LocalTableEngine(path=str(tmp_path / "local.sqlite"), default_schema="in.c-main")
+    local.load(write_csv(tmp_path, "in.c-a.orders", "id,amount,note\n1,10,NA\n2,,x\n"))
+    local.load(write_csv(tmp_path, "out.c-b.orders", "id,amount\n1,100\n"))
+    local.load(write_csv(tmp_path, "in.c-main.customers", "id,name\n1,Ann\n"))
+    return local
+
+
+def run(engine, sql):
+    route = engine.route(sql)
+    assert route.local, route.reason
+    with engine.engine.connect() as conn:
+        return conn.exec_driver_sql(route.sql).fetchall()
+
+
+def test_tables_are_keyed_by_table_id(tmp_path, engine):
+    assert local_table_name("data/in.c-sales.orders.csv") == "in.c-sales.orders"
+    assert set(engine.tables()) == {"in.c-a.orders", "out.c-b.orders", "in.c-main.customers"}
+    assert list(exported_tables(str(tmp_path))) == ["in.c-a.orders", "in.c-main.customers", "out.c-b.orders"]
+
+
+def test_same_table_name_in_two_buckets(engine):
+    assert run(engine, 'SELECT SUM(amount) FROM "in.c-a"."orders"') == [(10,)]
+    assert run(engine, 'SELECT SUM(amount) FROM "out.c-b"."orders"') == [(100,)]
+
+
+def test_column_references_keep_the_table_name(engine):
+    assert run(engine, 'SELECT orders.id FROM "in.c-a"."orders" WHERE orders.amount = 10') == [(1,)]
+
+
+def test_unqualified_names_use_the_default_schema(engine):
+    assert run(engine, 'SELECT "name" FROM "customers"') == [("Ann",)]
+    assert not engine.route('SELECT * FROM "orders"').local
+
+
+def test_tables_of_other_buckets_are_not_routed(engine):
+    assert not engine.route('SELECT * FROM "in.c-other"."orders"').local
+    assert not engine.route('SELECT * FROM "in.c-a"."orders" JOIN "in.c-x"."items" ON TRUE').local
+
+
+def test_non_queries_are_not_routed(engine):
+    assert not engine.route('DELETE FROM "in.c-a"."orders"').local
+    assert not engine.route("SELECT 1").local
+
+
+def test_empty_values_and_na_strings(engine):
+    assert run(engine, 'SELECT id, amount, note FROM "in.c-a"."orders" ORDER BY id') == [(1, 10, "NA"), (2, None, "x")]
+
+
+def test_unchanged_csv_is_not_reloaded(tmp_path, engine):
+    loaded = engine.tables()
+    table = engine.load(str(tmp_path / "in.c-a.orders.csv"), loaded=loaded)
+    assert table is loaded["in.c-a.orders"]
+
+
+def test_column_type_ignores_empty_values():
+    import pandas as pd
+    assert column_type(pd.Series(["1", "", "3"])) == "INTEGER"
+    assert column_type(pd.Series(["1.5", "NA"])) == "TEXT"
@@ -0,0 +1,77 @@
+import pytest
+
+pytest.importorskip("kbcstorage")
+
+from src.keboola_storage_api.metadata import MetadataCache, ProjectMetadata  # noqa: E402
+
+BUCKETS = [
+    {"id": "in.c-sales", "name": "sales", "description": "Orders from the shop"},
+    {"id": "in.c-crm", "name": "crm", "description": ""},
+    {"id": "out.c-reports", "name": "reports", "description": "Monthly revenue"},
+]
+TABLES = [
+    {"id": "in.c-sales.orders", "displayName": "orders"},
+    {"id": "in.c-sales.order_items", "displayName": "order items"},
+    {"id": "in.c-crm.customers", "displayName": "customers"},
+    {"id": "out.c-reports.revenue", "displayName": "revenue by month"},
+]
+
+
+@pytest.fixture
+def project():
+    return ProjectMetadata("https://connection.keboola.com/", BUCKETS, TABLES)
+
+
+def test_empty_query_lists_everything(project):
+    assert project.bucket_ids() == ["in.c-sales", "in.c-crm", "out.c-reports"]
+    assert [t["id"] for t in project.bucket_tables("in.c-sales")] == ["in.c-sales.orders", "in.c-sales.order_items"]
+
+
+def test_bucket_matches_through_its_tables(project):
+    assert project.bucket_ids("customers") == ["in.c-crm"]
+    assert [t["id"] for t in project.bucket_tables("in.c-crm", "customers")] == ["in.c-crm.customers"]
+
+
+def test_matching_bucket_keeps_all_its_tables(project):
+    assert project.bucket_ids("shop") == ["in.c-sales"]
+    assert len(project.bucket_tables("in.c-sales", "shop")) == 2
+
+
+def test_all_terms_must_match_the_same_item(project):
+    assert [t["id"] for t in project.bucket_tables("in.c-sales", "order ITEMS")] == ["in.c-sales.order_items"]
+    assert project.bucket_ids("orders revenue") == []
+
+
+class _Listing:
+    def __init__(self, items):
+        self.items = items
+        self.calls = 0
+
+    def list(self):
+        self.calls += 1
+        return self.items
+
+
+class FakeClient:
+    def __init__(self, token="token", url="https://connection.keboola.com/"):
+        self.root_url = url
+        self.token = token
+        self.buckets = _Listing(BUCKETS)
+        self.tables = _Listing(TABLES)
+
+
+def test_cache_serves_until_invalidated():
+    cache = MetadataCache(ttl=60)
+    client = FakeClient()
+    assert cache.get(client) is cache.get(client)
+    assert client.tables.calls == 1
+    cache.invalidate(client)
+    cache.get(client)
+    assert client.tables.calls == 2
+
+
+def test_expired_entries_are_evicted():
+    cache = MetadataCache(ttl=60)
+    cache.get(FakeClient("a")).fetched_at -= 120
+    cache.get(FakeClient("b"))
+    assert len(cache._entries) == 1
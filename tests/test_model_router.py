@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+import model_router
+from agent_jobs import AgentCancelled
+from model_router import FAST_MODEL, STRONG_MODEL, ModelRouter, RoutingDecision, answer_with_escalation
+
+
+@pytest.fixture
+def router(tmp_path):
+    return ModelRouter(path=str(tmp_path / "routing.jsonl"))
+
+
+def fast_decision():
+    return RoutingDecision(question="how many orders?", model=FAST_MODEL, score=0.1, threshold=0.5, reason="simple")
+
+
+def logged_runs(router):
+    return [r for r in router._load() if r["type"] == "run"]
+
+
+def test_failed_fast_run_is_escalated_and_logged(router):
+    def run(model):
+        if model == FAST_MODEL:
+            raise RuntimeError("bad output")
+        return {"output": "42"}
+
+    assert answer_with_escalation(router, fast_decision(), run) == {"output": "42"}
+    [record] = logged_runs(router)
+    assert record["escalated"] and record["final_model"] == STRONG_MODEL
+
+
+def test_failed_escalation_is_still_logged(router):
+    def run(model):
+        raise RuntimeError(model)
+
+    with pytest.raises(RuntimeError):
+        answer_with_escalation(router, fast_decision(), run)
+    [record] = logged_runs(router)
+    assert record["error"] == f"RuntimeError: {STRONG_MODEL}"
+
+
+def test_cancelled_run_is_not_escalated_or_logged(router):
+    models = []
+
+    def run(model):
+        models.append(model)
+        raise AgentCancelled("The run was cancelled")
+
+    with pytest.raises(AgentCancelled):
+        answer_with_escalation(router, fast_decision(), run)
+    assert models == [FAST_MODEL]
+    assert logged_runs(router) == []
+
+
+def test_fit_ignores_cancelled_runs_in_older_logs(router, monkeypatch):
+    monkeypatch.setattr(model_router, "MIN_SAMPLES", 1)
+    with open(router.path, "w") as f:
+        for i in range(5):
+            f.write(json.dumps({"type": "run", "id": str(i), "score": 0.3, "first_model": FAST_MODEL,
+                                "escalated": True, "latency": 1.0, "first_latency": 1.0,
+                                "escalation_reason": "AgentCancelled: The run was cancelled"}) + "\n")
+        f.write(json.dumps({"type": "run", "id": "ok", "score": 0.7, "first_model": FAST_MODEL,
+                            "escalated": False, "latency": 1.0, "first_latency": 1.0}) + "\n")
+    assert router.fit() == 0.7
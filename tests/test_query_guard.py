@@ -0,0 +1,64 @@
+import pytest
+import sqlalchemy
+import sqlglot
+
+from query_guard import QueryGuard, _sample_safe
+
+
+@pytest.fixture
+def guard():
+    return QueryGuard(sqlalchemy.create_engine("sqlite://"), preview_limit=100)
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT * FROM t",
+    "SELECT * FROM t WHERE x > (SELECT AVG(x) FROM t)",
+    "WITH c AS (SELECT COUNT(*) AS n FROM t) SELECT * FROM c",
+    "SELECT *, SUM(a) OVER () FROM t",
+    "SELECT a, COUNT(*) FROM t GROUP BY a",
+    "SELECT * FROM t LIMIT 5000",
+    "SELECT * FROM t FETCH FIRST 5000 ROWS ONLY",
+    "SELECT * FROM t FETCH FIRST 10 PERCENT ROWS ONLY",
+])
+def test_preview_is_limited(guard, sql):
+    guarded = guard.check(sql)
+    assert guarded.limited
+    assert sqlglot.parse_one(guarded.sql).args["limit"].expression.this == "100"
+
+
+@pytest.mark.parametrize("sql", [
+    "SELECT COUNT(*) FROM t",
+    "SELECT MAX(a) + 1 AS m FROM t WHERE b = 1",
+    "SELECT * FROM t LIMIT 10",
+    "SELECT * FROM t FETCH FIRST 10 ROWS ONLY",
+    "INSERT INTO t VALUES (1)",
+])
+def test_left_as_written(guard, sql):
+    guarded = guard.check(sql)
+    assert not guarded.limited and not guarded.rejected and guarded.sql == sql
+
+
+@pytest.mark.parametrize("sql", [
+    "not sql at all",
+    "SELECT * FROM t; DROP TABLE t",
+    "SELECT 1; SELECT 2",
+])
+def test_unparsable_or_multiple_statements_are_rejected(guard, sql):
+    assert guard.check(sql).rejected
+
+
+def test_full_run_is_not_rewritten(guard):
+    assert guard.check("SELECT * FROM t", full=True).sql == "SELECT * FROM t"
+
+
+@pytest.mark.parametrize("sql, safe", [
+    ("SELECT a FROM t WHERE b > 1", True),
+    ("SELECT COUNT(*) FROM t", False),
+    ("SELECT DISTINCT a FROM t", False),
+    ("SELECT a FROM t GROUP BY a", False),
+    ("SELECT *, SUM(a) OVER () FROM t", False),
+    ("SELECT * FROM t WHERE x > (SELECT AVG(x) FROM t)", False),
+    ("SELECT a FROM t UNION SELECT a FROM u", False),
+])
+def test_sample_safe(sql, safe):
+    assert _sample_safe(sqlglot.parse_one(sql, read="snowflake")) is safe
@@ -0,0 +1,54 @@
+import pyarrow as pa
+import pytest
+
+from result_store import fetch_result
+
+
+class FakeResult:
+    """Yields the given batches from fetchmany, like a SQLAlchemy result."""
+
+    def __init__(self, columns, batches):
+        self.columns = columns
+        self.batches = list(batches)
+
+    def keys(self):
+        return self.columns
+
+    def fetchmany(self, size):
+        return self.batches.pop(0) if self.batches else []
+
+
+@pytest.fixture(autouse=True)
+def spill_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr("result_store.SPILL_DIR", str(tmp_path))
+
+
+def spilled_table(result_set):
+    with pa.memory_map(result_set.path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def test_int_batch_then_float_batch_widens_to_float():
+    result_set = fetch_result(FakeResult(["x"], [[(1,), (2,)], [(2.5,)]]), preview_rows=10, batch_rows=2)
+    assert result_set.preview["x"].tolist() == [1.0, 2.0, 2.5]
+
+
+def test_null_first_batch_takes_the_later_type():
+    result_set = fetch_result(FakeResult(["x", "y"], [[(None, "a")], [(3, "b")]]), preview_rows=10, batch_rows=1)
+    assert result_set.preview["x"].tolist()[1] == 3
+
+
+def test_incompatible_types_become_strings():
+    result_set = fetch_result(FakeResult(["x"], [[(1,)], [("a",)]]), preview_rows=10, batch_rows=1)
+    assert result_set.preview["x"].tolist() == ["1", "a"]
+
+
+def test_drift_after_spilling_rewrites_the_spill_file():
+    batches = [[(1,), (2,)], [(3,), (4,)], [(4.5,), (None,)]]
+    result_set = fetch_result(FakeResult(["x"], batches), preview_rows=2, batch_rows=2)
+    assert result_set.spilled
+    table = spilled_table(result_set)
+    assert table.schema.field("x").type == pa.float64()
+    assert table.column("x").to_pylist() == [1.0, 2.0, 3.0, 4.0, 4.5, None]
+    assert result_set.row_count == 6
+    result_set.cleanup()
@@ -0,0 +1,68 @@
+import pytest
+import sqlalchemy
+
+from sql_evaluator import ExecutionEvaluator, extract_sql, normalize_sql
+
+
+@pytest.mark.parametrize("text, sql", [
+    ("Here it is:\n```sql\nSELECT a FROM t;\n```", "SELECT a FROM t"),
+    ("Run ```sql SELECT a FROM t``` to see it", "SELECT a FROM t"),
+    ("The query is\nSELECT a, b\nFROM t\nWHERE a > 1;\nIt returns two rows.", "SELECT a, b\nFROM t\nWHERE a > 1"),
+    ("WITH x AS (SELECT 1 AS a)\nSELECT a FROM x", "WITH x AS (SELECT 1 AS a)\nSELECT a FROM x"),
+    ("SELECT a FROM t\n\nThis lists every a.", "SELECT a FROM t"),
+])
+def test_extract_sql(text, sql):
+    assert extract_sql(text) == sql
+
+
+@pytest.mark.parametrize("text", [
+    "I can help with that. Which table do you mean?",
+    "Select a table from the sidebar first.",
+    "You could select the rows from orders with a filter.",
+])
+def test_prose_is_not_sql(text):
+    assert extract_sql(text) is None
+
+
+@pytest.fixture
+def evaluator(tmp_path, monkeypatch):
+    monkeypatch.setattr("sql_evaluator.EVAL_RESULTS_DIR", str(tmp_path / "results"))
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'eval.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (a INTEGER, b TEXT)")
+        conn.exec_driver_sql("INSERT INTO t VALUES (1, 'x'), (2, 'y')")
+    return ExecutionEvaluator(engine)
+
+
+def test_matching_results_score_one(evaluator):
+    evaluation = evaluator.evaluate("```sql\nSELECT b AS name, a FROM t ORDER BY a DESC\n```", reference_sql="SELECT a, b FROM t")
+    assert evaluation["score"] == 1.0
+
+
+def test_failing_prediction_scores_zero(evaluator):
+    evaluation = evaluator.evaluate("```sql\nSELECT missing FROM t\n```", reference_sql="SELECT a FROM t")
+    assert evaluation["score"] == 0.0 and evaluation["method"] == "execution"
+
+
+def test_failing_reference_is_not_scored(evaluator):
+    evaluation = evaluator.evaluate("```sql\nSELECT a FROM t\n```", reference_sql="SELECT missing FROM t")
+    assert evaluation["score"] is None and evaluation["method"] == "reference_failed"
+
+
+def test_comments_do_not_swallow_the_query(evaluator):
+    evaluation = evaluator.evaluate("```sql\nSELECT a -- the id\nFROM t\n```", reference_sql="SELECT a FROM t")
+    assert evaluation["score"] == 1.0
+
+
+def test_string_literals_are_run_as_written(evaluator):
+    with evaluator.engine.begin() as conn:
+        conn.exec_driver_sql("INSERT INTO t VALUES (3, 'x  y')")
+    assert evaluator.run_query("SELECT a FROM t WHERE b = 'x  y'")["a"].tolist() == [3]
+    # cached under a key of its own, not the one of the single-space literal
+    assert evaluator.run_query("SELECT a FROM t WHERE b = 'x y'").empty
+
+
+def test_cache_key_ignores_layout_but_not_literals():
+    assert normalize_sql("select a\n  from t;") == normalize_sql("SELECT a FROM t")
+    assert normalize_sql("SELECT a FROM t -- note") == normalize_sql("SELECT a FROM t")
+    assert normalize_sql("SELECT 'x  y'") != normalize_sql("SELECT 'x y'")
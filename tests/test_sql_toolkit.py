@@ -0,0 +1,38 @@
+import pytest
+import sqlalchemy
+from langchain.sql_database import SQLDatabase
+
+from query_guard import QueryGuard
+from result_cache import ResultCache
+from sql_toolkit import GuardedQueryTool
+
+
+@pytest.fixture
+def db(tmp_path):
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'toolkit.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE t (a INTEGER, b TEXT, c REAL, d TIMESTAMP)")
+        conn.exec_driver_sql("INSERT INTO t VALUES (1, 'x', 1.5, '2023-01-02 03:04:05'), (2, NULL, NULL, NULL)")
+    return SQLDatabase(engine)
+
+
+def test_cached_result_renders_like_run_no_throw(db):
+    cache = ResultCache("test", "sqlite")
+    tool = GuardedQueryTool(db=db, cache=cache)
+    sql = "SELECT a, b, c, d FROM t ORDER BY a"
+    fresh = tool._execute(sql)
+    assert fresh == db.run_no_throw(sql)
+    assert tool._execute(sql) == fresh
+    assert cache.hits == 1
+
+
+def test_errors_render_like_run_no_throw(db):
+    tool = GuardedQueryTool(db=db, cache=ResultCache("test", "sqlite"))
+    assert tool._execute("SELECT missing FROM t") == db.run_no_throw("SELECT missing FROM t")
+
+
+def test_rows_are_capped_and_cut_off_results_not_cached(db):
+    cache = ResultCache("test", "sqlite")
+    tool = GuardedQueryTool(db=db, cache=cache, guard=QueryGuard(db._engine, preview_limit=1))
+    assert tool._execute("SELECT a FROM t ORDER BY a") == "[(1,)]"
+    assert len(cache) == 0
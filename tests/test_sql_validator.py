@@ -0,0 +1,46 @@
+import pytest
+import sqlalchemy
+
+import schema_catalog
+from schema_catalog import SchemaCatalog
+from sql_validator import SQLValidator
+
+
+@pytest.fixture
+def validator(tmp_path, monkeypatch):
+    monkeypatch.setattr(schema_catalog, "CATALOG_DIR", str(tmp_path / "catalog"))
+    engine = sqlalchemy.create_engine(f"sqlite:///{tmp_path / 'validator.db'}")
+    with engine.begin() as conn:
+        conn.exec_driver_sql("CREATE TABLE customer (id INTEGER, email TEXT)")
+        conn.exec_driver_sql("CREATE TABLE orders (id INTEGER, customer_id INTEGER, total REAL)")
+    catalog = SchemaCatalog(engine, "test")
+    catalog.refresh(blocking=True)
+    # stored names are lower case, so unquoted names miss them the way they do on Snowflake
+    return SQLValidator(catalog, dialect="snowflake")
+
+
+def test_qualifiers_follow_a_rewritten_table(validator):
+    result = validator.validate("SELECT customer.email, c2.id FROM customer JOIN customer AS c2 ON customer.id = c2.id")
+    assert result.ok
+    assert result.sql == ('SELECT "customer"."email", c2."id" FROM "customer" '
+                          'JOIN "customer" AS c2 ON "customer"."id" = c2."id"')
+
+
+def test_star_qualifier_follows_a_rewritten_table(validator):
+    assert validator.validate("SELECT customer.* FROM customer").sql == 'SELECT "customer".* FROM "customer"'
+
+
+def test_unqualified_column_in_two_joined_tables_is_ambiguous(validator):
+    result = validator.validate("SELECT id FROM customer JOIN orders ON customer.id = orders.customer_id")
+    assert not result.ok
+    assert "ambiguous" in result.message() and '"customer", "orders"' in result.message()
+
+
+def test_columns_of_other_scopes_and_using_joins_are_not_ambiguous(validator):
+    assert validator.validate("SELECT email FROM customer WHERE id IN (SELECT customer_id FROM orders)").ok
+    assert validator.validate("SELECT id FROM customer JOIN orders USING (id)").ok
+
+
+def test_missing_column_is_rejected(validator):
+    result = validator.validate("SELECT phone FROM customer")
+    assert not result.ok and "does not exist" in result.message()
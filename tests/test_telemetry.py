@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+import telemetry
+from telemetry import TelemetryClient
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(telemetry.time, "sleep", lambda seconds: None)
+    client = TelemetryClient("http://telemetry.invalid/events", spool_path=str(tmp_path / "spool.jsonl"))
+    client.posted = []
+    client.up = True
+
+    def post(batch):
+        if client.up:
+            client.posted.append([event["id"] for event in batch])
+        return client.up
+
+    client._post = post
+    return client
+
+
+def spooled_ids(client):
+    with open(client.spool_path) as f:
+        return [json.loads(line)["id"] for line in f if line.strip()]
+
+
+def test_failed_batch_is_spooled_and_sent_after_the_next_one(client):
+    client.up = False
+    client._handle([{"id": "a"}])
+    assert spooled_ids(client) == ["a"]
+    client.up = True
+    client._probe_at = 0.0
+    client._handle([{"id": "b"}])
+    assert client.posted == [["b"], ["a"]]
+    assert client.sent == 2
+
+
+def test_failing_drain_does_not_resend_the_batch(client, monkeypatch):
+    def broken_drain():
+        raise OSError("spool unreadable")
+
+    monkeypatch.setattr(client, "_drain_spool", broken_drain)
+    client._handle([{"id": "a"}])
+    assert client.posted == [["a"]]
+    assert client.spooled == 0
+
+
+def test_batches_are_spooled_without_retrying_while_the_endpoint_is_down(client):
+    attempts = []
+    client._post = lambda batch: attempts.append(batch) and False
+    client._handle([{"id": "a"}])
+    assert len(attempts) == telemetry.MAX_RETRIES + 1
+    client._handle([{"id": "b"}])
+    assert len(attempts) == telemetry.MAX_RETRIES + 1
+    assert spooled_ids(client) == ["a", "b"]
+
+
+def test_corrupt_spool_lines_are_skipped(client):
+    with open(client.spool_path, "w") as f:
+        f.write(json.dumps({"id": "a"}) + "\n{\"id\": \"b\n\n" + json.dumps({"id": "c"}) + "\n")
+    client._handle([{"id": "d"}])
+    assert client.posted == [["d"], ["a", "c"]]
+    assert client.dropped == 1
+
+
+def test_nothing_is_kept_without_an_endpoint(tmp_path):
+    client = TelemetryClient(None, spool_path=str(tmp_path / "spool.jsonl"))
+    client.emit("question", question="what is our revenue?")
+    client.flush()
+    assert client.dropped == 1 and client.spooled == 0
+    assert not (tmp_path / "spool.jsonl").exists()
+
+
+def test_full_spool_drops_the_oldest_events(client):
+    client.max_spool_bytes = 200
+    client.up = False
+    for i in range(20):
+        client._handle([{"id": str(i)}])
+    ids = spooled_ids(client)
+    assert ids == [str(i) for i in range(20 - len(ids), 20)]
+    assert os.path.getsize(client.spool_path) <= 200
+    assert client.dropped == 20 - len(ids)
@@ -0,0 +1,80 @@
+import pytest
+from langchain.llms.fake import FakeListLLM
+from langchain.memory import ChatMessageHistory
+
+import token_memory
+from chat_history import ChatHistoryStore, SQLiteChatMessageHistory
+from token_memory import TokenBudgetMemory
+
+
+class WordEncoding:
+    """One token per whitespace-separated word, so budgets are easy to reason about offline."""
+
+    def encode(self, text):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(token_memory, "_encoding", lambda model: WordEncoding())
+
+
+def memory_with(history, budget, summaries=("summary",)):
+    llm = FakeListLLM(responses=list(summaries))
+    return TokenBudgetMemory(llm=llm, chat_memory=history, max_token_limit=budget, save_to_history=False), llm
+
+
+def fill(history, n):
+    for i in range(n):
+        history.add_user_message(f"question {i}")
+        history.add_ai_message(f"answer {i}")
+
+
+def test_history_within_budget_is_kept_verbatim():
+    history = ChatMessageHistory()
+    fill(history, 2)
+    memory, _ = memory_with(history, budget=100)
+    assert [m.content for m in memory.budgeted_messages()] == ["question 0", "answer 0", "question 1", "answer 1"]
+    assert memory.moving_summary_buffer == ""
+
+
+def test_older_turns_are_summarised_once():
+    history = ChatMessageHistory()
+    fill(history, 3)
+    # "Human: question 2" / "AI: answer 2" are 3 words each; the summary takes 1
+    memory, llm = memory_with(history, budget=7, summaries=("summary", "unused"))
+    kept = memory.budgeted_messages()
+    assert [m.content for m in kept] == ["question 2", "answer 2"]
+    assert memory.moving_summary_buffer == "summary"
+    assert memory.summarized_count == 4
+    assert memory.budgeted_messages() == kept
+    assert llm.i == 1
+
+
+def test_tables_are_dropped_from_kept_messages():
+    history = ChatMessageHistory()
+    history.add_ai_message("Here you go:\n| a | b |\n|---|---|\n| 1 | 2 |\n")
+    memory, _ = memory_with(history, budget=100)
+    assert "[table omitted]" in memory.budgeted_messages()[0].content
+
+
+def test_cleared_history_resets_the_summary():
+    history = ChatMessageHistory()
+    fill(history, 3)
+    memory, _ = memory_with(history, budget=7)
+    memory.budgeted_messages()
+    history.clear()
+    assert memory.budgeted_messages() == []
+    assert memory.summarized_count == 0 and memory.moving_summary_buffer == ""
+
+
+def test_messages_outside_the_hot_window_are_read_back(tmp_path):
+    store = ChatHistoryStore(str(tmp_path / "chat.sqlite"), hot_messages=2)
+    history = SQLiteChatMessageHistory("s", store)
+    fill(history, 3)
+    assert history.offset == 4
+    memory, _ = memory_with(history, budget=100)
+    assert len(memory.budgeted_messages()) == 6
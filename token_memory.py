@@ -0,0 +1,117 @@
+import re
+from functools import lru_cache
+from typing import Any, Dict, List
+
+import tiktoken
+from langchain.memory.chat_memory import BaseChatMemory
+from langchain.memory.summary import SummarizerMixin
+from langchain.schema.messages import BaseMessage, get_buffer_string
+
+# tokens of history (summary + verbatim turns) sent with each question
+MODEL_TOKEN_BUDGETS = {
+    'gpt-3.5-turbo-instruct': 1000,
+    'gpt-3.5-turbo-16k': 4000,
+    'gpt-4': 2000,
+}
+DEFAULT_TOKEN_BUDGET = 2000
+# a single message is cut down to this many tokens before it is kept verbatim
+MAX_MESSAGE_TOKENS = 400
+
+TABLE_PATTERN = re.compile(r"(?:^\s*\|.*\|\s*$\n?)+", re.MULTILINE)
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: str) -> int:
+    return len(_encoding(model).encode(text))
+
+
+def compact_text(text: str, model: str, max_tokens: int = MAX_MESSAGE_TOKENS) -> str:
+    """Drop rendered result tables and cut what is left to `max_tokens`."""
+    text = TABLE_PATTERN.sub("[table omitted]\n", text)
+    tokens = _encoding(model).encode(text)
+    if len(tokens) <= max_tokens:
+        return text
+    return _encoding(model).decode(tokens[:max_tokens]) + " [...]"
+
+
+class TokenBudgetMemory(BaseChatMemory, SummarizerMixin):
+    """
+    Conversation memory bounded by a per-model token budget.
+
+    The newest turns are returned verbatim (compacted) for as long as they fit; older turns are
+    folded into a running summary, one batch at a time, so each message is summarised once.
+    The chat history itself is never pruned, so the UI can keep showing all of it. Messages
+    older than the history's in-memory window are read back from it only if not yet summarised.
+    """
+    model: str = 'gpt-3.5-turbo-16k'
+    max_token_limit: int = 0
+    memory_key: str = "history"
+    input_key: str = "input"
+    output_key: str = "output"
+    # app.py writes the chat history itself; validation lets the agent do it
+    save_to_history: bool = True
+    moving_summary_buffer: str = ""
+    summarized_count: int = 0
+
+    @property
+    def memory_variables(self) -> List[str]:
+        return [self.memory_key]
+
+    @property
+    def token_budget(self) -> int:
+        return self.max_token_limit or MODEL_TOKEN_BUDGETS.get(self.model, DEFAULT_TOKEN_BUDGET)
+
+    def _compacted(self, messages: List[BaseMessage]) -> List[BaseMessage]:
+        return [m.copy(update={"content": compact_text(m.content, self.model)}) for m in messages]
+
+    def budgeted_messages(self) -> List[BaseMessage]:
+        # histories that keep only their newest messages in memory say how many precede them
+        offset = getattr(self.chat_memory, "offset", 0)
+        messages = self.chat_memory.messages
+        if self.summarized_count > offset + len(messages):
+            # the chat was cleared underneath us
+            self.moving_summary_buffer = ""
+            self.summarized_count = 0
+        if self.summarized_count < offset:
+            messages = self.chat_memory.slice(self.summarized_count, offset) + messages
+            offset = self.summarized_count
+        pending = self._compacted(messages[self.summarized_count - offset:])
+
+        budget = self.token_budget - count_tokens(self.moving_summary_buffer, self.model)
+        keep = 0
+        used = 0
+        for message in reversed(pending):
+            tokens = count_tokens(get_buffer_string([message], self.human_prefix, self.ai_prefix), self.model)
+            if used + tokens > budget:
+                break
+            used += tokens
+            keep += 1
+
+        overflow = pending[:len(pending) - keep]
+        if overflow:
+            self.moving_summary_buffer = self.predict_new_summary(overflow, self.moving_summary_buffer)
+            self.summarized_count += len(overflow)
+        return pending[len(pending) - keep:]
+
+    def load_memory_variables(self, inputs: Dict[str, Any]) -> Dict[str, Any]:
+        recent = self.budgeted_messages()
+        history = get_buffer_string(recent, human_prefix=self.human_prefix, ai_prefix=self.ai_prefix)
+        if self.moving_summary_buffer:
+            history = f"Summary of the earlier conversation: {self.moving_summary_buffer}\n{history}"
+        return {self.memory_key: history}
+
+    def save_context(self, inputs: Dict[str, Any], outputs: Dict[str, str]) -> None:
+        if self.save_to_history:
+            super().save_context(inputs, outputs)
+
+    def clear(self) -> None:
+        super().clear()
+        self.moving_summary_buffer = ""
+        self.summarized_count = 0
@@ -0,0 +1,177 @@
+import json
+import os
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from uuid import UUID
+
+import pandas as pd
+from langchain.callbacks.base import BaseCallbackHandler
+
+from settings import CACHE_DIR
+from token_memory import count_tokens
+
+TRACES_PATH = os.path.join(CACHE_DIR, "traces.jsonl")
+# tools that run a query on the warehouse, as opposed to the catalog or the retriever
+WAREHOUSE_TOOLS = {"sql_db_query"}
+
+_write_lock = threading.Lock()
+
+
+def write_spans(spans: List[dict], path: str = TRACES_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _write_lock, open(path, "a") as f:
+        for span in spans:
+            f.write(json.dumps(span, default=str) + "\n")
+
+
+def record_span(step_type: str, name: str, duration: float, trace_id: str = None, **attributes):
+    """Write a standalone span, for work that happens outside an agent run (e.g. Execute SQL)."""
+    write_spans([{
+        "trace_id": trace_id or uuid.uuid4().hex,
+        "span_id": uuid.uuid4().hex,
+        "parent_id": None,
+        "type": step_type,
+        "name": name,
+        "start": time.time() - duration,
+        "duration_ms": round(duration * 1000, 2),
+        **attributes,
+    }])
+
+
+class TraceCallbackHandler(BaseCallbackHandler):
+    """
+    Times every LLM call, tool call and chain in an agent run and writes them as spans to
+    traces.jsonl when the outermost chain finishes. Token counts come from the API usage when
+    it is reported and are counted with tiktoken otherwise (streaming responses carry no usage).
+    """
+
+    def __init__(self, question: str = "", model: str = "", path: str = TRACES_PATH):
+        self.trace_id = uuid.uuid4().hex
+        self.question = question
+        self.model = model
+        self.path = path
+        self.iterations = 0
+        self.spans: List[dict] = []
+        self.summary: Dict[str, int] = {}
+        self._open: Dict[UUID, dict] = {}
+        self._root: Optional[UUID] = None
+
+    def _start(self, run_id: UUID, parent_run_id: Optional[UUID], step_type: str, name: str, **attributes):
+        span = {
+            "trace_id": self.trace_id,
+            "span_id": str(run_id),
+            "parent_id": str(parent_run_id) if parent_run_id else None,
+            "type": step_type,
+            "name": name,
+            "start": time.time(),
+            "_perf": time.perf_counter(),
+            **attributes,
+        }
+        self._open[run_id] = span
+
+    def _end(self, run_id: UUID, error: Optional[BaseException] = None, **attributes) -> Optional[dict]:
+        span = self._open.pop(run_id, None)
+        if span is None:
+            return None
+        span["duration_ms"] = round((time.perf_counter() - span.pop("_perf")) * 1000, 2)
+        if error is not None:
+            span["error"] = f"{type(error).__name__}: {error}"
+        span.update(attributes)
+        self.spans.append(span)
+        return span
+
+    # chains
+
+    def on_chain_start(self, serialized: Dict[str, Any], inputs: Dict[str, Any], *, run_id: UUID,
+                       parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        if parent_run_id is None:
+            self._root = run_id
+        name = (serialized or {}).get("id", ["chain"])[-1]
+        self._start(run_id, parent_run_id, "agent" if parent_run_id is None else "chain", name)
+
+    def on_chain_end(self, outputs: Dict[str, Any], *, run_id: UUID, **kwargs: Any):
+        self._end(run_id)
+        if run_id == self._root:
+            self.flush()
+
+    def on_chain_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+        if run_id == self._root:
+            self.flush()
+
+    # llm
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], *, run_id: UUID,
+                     parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        model = (kwargs.get("invocation_params") or {}).get("model_name") or self.model
+        self._start(run_id, parent_run_id, "llm", model,
+                    prompt_tokens=sum(count_tokens(p, model or "gpt-3.5-turbo") for p in prompts))
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        span = self._open.get(run_id, {})
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            attributes = {"prompt_tokens": usage.get("prompt_tokens", 0),
+                          "completion_tokens": usage.get("completion_tokens", 0)}
+        else:
+            text = "".join(g.text for generations in response.generations for g in generations)
+            attributes = {"completion_tokens": count_tokens(text, span.get("name") or "gpt-3.5-turbo")}
+        self._end(run_id, **attributes)
+
+    def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    # tools
+
+    def on_tool_start(self, serialized: Dict[str, Any], input_str: str, *, run_id: UUID,
+                      parent_run_id: Optional[UUID] = None, **kwargs: Any):
+        name = (serialized or {}).get("name", "tool")
+        step_type = "warehouse" if name in WAREHOUSE_TOOLS else "tool"
+        self._start(run_id, parent_run_id, step_type, name, input=input_str[:500])
+
+    def on_tool_end(self, output: str, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, output_chars=len(str(output)))
+
+    def on_tool_error(self, error: BaseException, *, run_id: UUID, **kwargs: Any):
+        self._end(run_id, error)
+
+    def on_agent_action(self, action, **kwargs: Any):
+        self.iterations += 1
+
+    def flush(self):
+        if not self.spans:
+            return
+        llm_spans = [s for s in self.spans if s["type"] == "llm"]
+        self.summary = {
+            "llm_calls": len(llm_spans),
+            "tokens": sum(s.get("prompt_tokens", 0) + s.get("completion_tokens", 0) for s in llm_spans),
+            "warehouse_queries": sum(1 for s in self.spans if s["type"] == "warehouse"),
+            "iterations": self.iterations,
+        }
+        for span in self.spans:
+            if span["type"] == "agent":
+                span.update({"question": self.question, "model": self.model, **self.summary})
+        write_spans(self.spans, self.path)
+        self.spans = []
+
+
+def load_spans(path: str = TRACES_PATH, limit: int = 50000) -> pd.DataFrame:
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    with open(path, "r") as f:
+        lines = f.readlines()[-limit:]
+    return pd.DataFrame([json.loads(line) for line in lines if line.strip()])
+
+
+def step_percentiles(spans: pd.DataFrame) -> pd.DataFrame:
+    """count, p50 and p95 duration per step type and name."""
+    if spans.empty:
+        return spans
+    grouped = spans.groupby(["type", "name"])["duration_ms"]
+    return pd.DataFrame({
+        "count": grouped.count(),
+        "p50_ms": grouped.quantile(0.5).round(1),
+        "p95_ms": grouped.quantile(0.95).round(1),
+    }).reset_index().sort_values("p95_ms", ascending=False)
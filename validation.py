@@ -1,16 +1,16 @@
 import openai
 import re
+import time
+import uuid
 import streamlit as st
 import json
 import pandas as pd
 
 from streamlit_ace import st_ace
 from langchain.memory import StreamlitChatMessageHistory
-from langchain.memory import ConversationBufferMemory
 from langchain.memory.chat_message_histories import StreamlitChatMessageHistory
 
 from langchain.agents import create_sql_agent, AgentExecutor
-from langchain.agents.agent_toolkits import SQLDatabaseToolkit
 from langchain.sql_database import SQLDatabase
 from langchain.llms.openai import OpenAI
 from langchain.chat_models import ChatOpenAI
@@ -20,6 +20,15 @@ from langchain.evaluation import load_evaluator
 
 from langchain.callbacks import StreamlitCallbackHandler, HumanApprovalCallbackHandler
 from prompts import custom_gen_sql_1, custom_gen_sql
+from benchmark import build_llm, supports
+from resources import database_url, get_schema_catalog
+from llm_cache import install_llm_cache
+from sql_toolkit import KaiSQLDatabaseToolkit
+from token_memory import TokenBudgetMemory
+from sql_evaluator import ExecutionEvaluator, EXECUTION_PASS_RATE
+from tracing import TraceCallbackHandler
+from validation_store import ValidationStore, case_fingerprint, regression_report
+from few_shot_examples import few_shots
 
 st.header("Validation page")
 
@@ -27,27 +36,23 @@ models = ['gpt-3.5-turbo-instruct', 'gpt-3.5-turbo-16k', 'gpt-4']
 agent_types = [AgentType.ZERO_SHOT_REACT_DESCRIPTION, AgentType.OPENAI_FUNCTIONS]
 
 msgs = StreamlitChatMessageHistory(key="chat_messages")
-memory = ConversationBufferMemory(chat_memory=msgs)
 
 llm = ChatOpenAI(model=models[1], temperature=0)
+memory = TokenBudgetMemory(llm=llm, chat_memory=msgs, model=models[1])
+
+# record once, then replay the whole suite offline: set llm_cache_mode and database_url in the secrets
+install_llm_cache(st.secrets.get("llm_cache_mode", "passthrough"))
 
 def initialize_connection():
-    account_identifier = st.secrets["account_identifier"]
-    user = st.secrets["user"]
-    password = st.secrets["password"]
-    database_name = st.secrets["database_name"]
-    schema_name = st.secrets["schema_name"]
-    warehouse_name = st.secrets["warehouse_name"]
-    role_name = st.secrets["user"]
-    conn_string = f"snowflake://{user}:{password}@{account_identifier}/{database_name}/{schema_name}?warehouse={warehouse_name}&role={role_name}"
+    conn_string = database_url()
     db = SQLDatabase.from_uri(conn_string)
     
-    return db
+    return db, get_schema_catalog(conn_string)
 
-db = initialize_connection()   
+db, catalog = initialize_connection()   
 
 def generate_agent_executor(db, llm, memory, max_iterations, agent_type):
-    toolkit = SQLDatabaseToolkit(llm=llm, db=db)
+    toolkit = KaiSQLDatabaseToolkit(llm=llm, db=db, catalog=catalog)
     agent_executor = create_sql_agent(
         llm=llm,
         toolkit=toolkit,
@@ -66,29 +71,50 @@ gen_sql_prompt = custom_gen_sql
 # grab the validation.json file and loop through it to call agent_executor.run
 # for each validation example
 
-evaluator = load_evaluator("pairwise_string")
+# score by running the predicted and reference SQL; the LLM grader only sees answers without SQL
+use_llm_grader = st.checkbox("Grade answers without SQL with an LLM", value=True)
+evaluator = ExecutionEvaluator(db._engine, llm_fallback=load_evaluator("pairwise_string") if use_llm_grader else None)
 with open('validation.json', 'r') as f:
     data = json.load(f)
 
 st.write('Data loaded')
 st.balloons()
 
+# cases whose question, answer, prompt, few-shots, model and agent type are unchanged reuse their last result
+only_changed = st.checkbox("Only rerun cases whose inputs changed", value=True)
+store = ValidationStore()
+previous_run_id = store.last_run_id()
+run_id = uuid.uuid4().hex[:12]
+
 n = 0
 evaluation_output = {}
+wall_times = {}
 
 
 #  for each LLM and agent type combination, run the validation examples and evaluate the results
 for model in models:
+    model_llm = build_llm(model)
     # use the agent executor function to create an agent executor for each model and agent type combination
     for agent in agent_types:
-        agent_executor = generate_agent_executor(db, llm, memory, 10, agent)
+        if not supports(model, agent):
+            continue
+        agent_executor = generate_agent_executor(db, model_llm, memory, 10, agent)
         st.write(f"Running validation for model {model} and agent type {agent}")
         for i in range(len(data)):
             n += 1
             st.write(f"Question: {data[i]['question']}")
+            fingerprint = case_fingerprint(data[i], model, agent, gen_sql_prompt.template, few_shots)
+            previous = store.lookup(fingerprint) if only_changed else None
+            if previous is not None and "evaluation" in previous:
+                st.write("Inputs unchanged, reusing the previous result")
+                evaluation_output[n] = {key: previous[key] for key in ["model", "agent_type", "question", "answer", "prediction", "evaluation"]}
+                wall_times[n] = previous.get("wall_time")
+                store.append({**previous, "run_id": run_id, "timestamp": pd.Timestamp.now().isoformat(), "reused": True})
+                continue
             prompt_formatted = gen_sql_prompt.format(context=data[i]['question'])
+            started = time.perf_counter()
             try:
-                response = agent_executor.run(input=prompt_formatted, memory=memory)
+                response = agent_executor.run(input=prompt_formatted, callbacks=[TraceCallbackHandler(data[i]['question'], model)])
             except ValueError as e:
                 response = str(e)
                 if not response.startswith("Could not parse LLM output: `"):
@@ -99,10 +125,11 @@ for model in models:
                 if response.startswith("InvalidRequestError: This model's maximum context length%"):
                         response = "Model context length exceeded. Please try again."
 
-            evaluation = evaluator.evaluate_string_pairs(
+            evaluation = evaluator.evaluate(
             prediction=response,
-            prediction_b=data[i]['answer'],
-            input=data[i]['question'],
+            reference_sql=data[i].get('sql'),
+            reference_answer=data[i]['answer'],
+            question=data[i]['question'],
             )
             st.write(f"Answer: {data[i]['answer']}")
             st.write(f"Prediction: {response}")
@@ -116,6 +143,10 @@ for model in models:
                 "prediction": response,
                 "evaluation": evaluation
             }
+            wall_times[n] = round(time.perf_counter() - started, 3)
+            store.append({**evaluation_output[n], "agent_type": str(agent), "score": evaluation["score"],
+                          "wall_time": wall_times[n], "fingerprint": fingerprint, "run_id": run_id,
+                          "timestamp": pd.Timestamp.now().isoformat(), "reused": False})
 
 
 
@@ -128,11 +159,22 @@ df['score'] = df['evaluation'].apply(lambda x: x['score'])
 
 st.write("Evaluation results:")
 
-avg_score = df['score'].mean()
-
-st.metric(label="Average evaluation score", value=avg_score)
-
-if avg_score >= 0.1:
+methods = df['evaluation'].apply(lambda x: x['method'])
+executed = df.loc[methods == 'execution', 'score']
+graded = df.loc[methods == 'llm', 'score']
+if (methods == 'reference_failed').any():
+    st.warning(f"The reference SQL of {(methods == 'reference_failed').sum()} case(s) failed; they are not scored.")
+
+failed = False
+if len(executed):
+    st.metric(label="Execution accuracy", value=executed.mean())
+    failed = failed or executed.mean() < EXECUTION_PASS_RATE
+if len(graded):
+    avg_score = graded.mean()
+    st.metric(label="Average evaluation score", value=avg_score)
+    failed = failed or avg_score >= 0.1
+
+if failed:
      st.error("The evaluation failed. Please try again.")
 
 else:
@@ -141,6 +183,11 @@ else:
 
 st.dataframe(df)
 
+st.write("Changes against the previous run:")
+current = df.assign(agent_type=df['agent_type'].astype(str), wall_time=pd.Series(wall_times))
+previous = store.run(previous_run_id) if previous_run_id else pd.DataFrame()
+st.dataframe(regression_report(current, previous))
+
 
 # append the current timestamp as a column to the dataframe
 df['timestamp'] = pd.Timestamp.now()
@@ -0,0 +1,77 @@
+import hashlib
+import json
+import os
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+RESULTS_PATH = 'benchmark_output.jsonl'
+CASE_KEY = ["model", "agent_type", "question"]
+
+
+def case_fingerprint(case: dict, model: str, agent_type: str, prompt_template: str, few_shots: Dict[str, str],
+                     router_threshold: Optional[float] = None) -> str:
+    """Hash of every input that can change a case's outcome; for the Auto model, that includes the router threshold."""
+    payload = {
+        "question": case["question"],
+        "answer": case["answer"],
+        "sql": case.get("sql"),
+        "prompt": prompt_template,
+        "few_shots": few_shots,
+        "model": model,
+        "agent_type": str(agent_type),
+    }
+    if router_threshold is not None:
+        payload["router_threshold"] = round(router_threshold, 4)
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class ValidationStore:
+    """
+    Append-only JSONL of validation results, one line per case per run.
+    A case whose fingerprint already has a successful result can be copied into the new run
+    instead of being executed again.
+    """
+
+    def __init__(self, path: str = RESULTS_PATH):
+        self.path = path
+        self.records: List[dict] = []
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                self.records = [json.loads(line) for line in f if line.strip()]
+
+    def lookup(self, fingerprint: str) -> Optional[dict]:
+        for record in reversed(self.records):
+            if record.get("fingerprint") == fingerprint and not record.get("error"):
+                return record
+        return None
+
+    def last_run_id(self) -> Optional[str]:
+        return self.records[-1].get("run_id") if self.records else None
+
+    def run(self, run_id: str) -> pd.DataFrame:
+        return pd.DataFrame([r for r in self.records if r.get("run_id") == run_id])
+
+    def append(self, record: dict):
+        with open(self.path, "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+        self.records.append(record)
+
+
+def regression_report(current: pd.DataFrame, previous: pd.DataFrame) -> pd.DataFrame:
+    """Per-case score and wall-time deltas of `current` against `previous`."""
+    columns = CASE_KEY + ["score", "wall_time"]
+    current = current.reindex(columns=columns)
+    if previous.empty:
+        report = current.rename(columns={"score": "score_new", "wall_time": "wall_time_new"})
+        report["status"] = "new"
+        return report
+    previous = previous.reindex(columns=columns)
+    report = current.merge(previous, on=CASE_KEY, how="left", suffixes=("_new", "_prev"))
+    report["score_delta"] = report["score_new"] - report["score_prev"]
+    report["wall_time_delta"] = report["wall_time_new"] - report["wall_time_prev"]
+    report["status"] = "unchanged"
+    report.loc[report["score_delta"] < 0, "status"] = "regressed"
+    report.loc[report["score_delta"] > 0, "status"] = "improved"
+    report.loc[report["score_prev"].isna() & report["wall_time_prev"].isna(), "status"] = "new"
+    return report.sort_values(["status", "score_delta"]).reset_index(drop=True)